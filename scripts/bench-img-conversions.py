@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+Measure the cost of the conversions between Pillow images, Cairo surfaces
+and GdkPixbufs (see paperwork.backend.util and paperwork.frontend.util.img),
+and compare it with the previous implementations (encoding to PPM, alpha
+channel added to the images, etc).
+
+Results are given in milliseconds per megapixel.
+"""
+
+import array
+import getopt
+import StringIO
+import sys
+import time
+
+import cairo
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf
+import PIL.Image
+
+from paperwork.backend.util import image2surface
+from paperwork.backend.util import surface2image
+from paperwork.frontend.util.img import image2pixbuf
+
+
+# A4 page at 150, 300 and 600 dpi
+SIZES = [
+    (1240, 1754),
+    (2480, 3508),
+    (4960, 7016),
+]
+
+
+def old_image2pixbuf(img):
+    file_desc = StringIO.StringIO()
+    try:
+        img.save(file_desc, "ppm")
+        contents = file_desc.getvalue()
+    finally:
+        file_desc.close()
+    loader = GdkPixbuf.PixbufLoader.new_with_type("pnm")
+    try:
+        loader.write(contents)
+        pixbuf = loader.get_pixbuf()
+    finally:
+        loader.close()
+    return pixbuf
+
+
+def old_image2surface(img):
+    img = img.copy()  # the old implementation modified the image
+    img.putalpha(256)
+    (width, height) = img.size
+    imgd = img.tobytes('raw', 'BGRA')
+    imga = array.array('B', imgd)
+    stride = width * 4
+    return cairo.ImageSurface.create_for_data(
+        imga, cairo.FORMAT_ARGB32, width, height, stride)
+
+
+def old_surface2image(surface):
+    dimension = (surface.get_width(), surface.get_height())
+    img = PIL.Image.frombuffer("RGBA", dimension,
+                               surface.get_data(), "raw", "BGRA", 0, 1)
+    background = PIL.Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(img, mask=img.split()[3])  # 3 is the alpha channel
+    return background
+
+
+def bench(func, arg, nb_runs):
+    start = time.time()
+    for _ in xrange(0, nb_runs):
+        func(arg)
+    stop = time.time()
+    return (stop - start) / nb_runs
+
+
+def usage():
+    print("Usage: %s [-n <number of runs>]" % sys.argv[0])
+
+
+def main():
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hn:")
+    except getopt.GetoptError, exc:
+        print(str(exc))
+        usage()
+        sys.exit(1)
+
+    nb_runs = 5
+    for (opt, val) in opts:
+        if opt == "-h":
+            usage()
+            sys.exit(0)
+        elif opt == "-n":
+            nb_runs = int(val)
+
+    # (name, old implementation, new implementation, input builder for
+    # the old one, input builder for the new one). The old implementations
+    # produced ARGB32 surfaces, the new ones RGB24 surfaces.
+    conversions = [
+        ("image2pixbuf", old_image2pixbuf, image2pixbuf,
+         lambda img: img, lambda img: img),
+        ("image2surface", old_image2surface, image2surface,
+         lambda img: img, lambda img: img),
+        ("surface2image", old_surface2image, surface2image,
+         old_image2surface, image2surface),
+    ]
+
+    print("%-15s %12s %10s %10s %8s" % ("conversion", "size", "before",
+                                        "after", "speedup"))
+    for size in SIZES:
+        img = PIL.Image.new("RGB", size, (255, 255, 255))
+        # something else than a uniform color
+        img.paste((10, 20, 30), (0, 0, size[0] / 2, size[1] / 2))
+        megapixels = float(size[0] * size[1]) / (1000 * 1000)
+
+        for (name, old_func, new_func, old_input, new_input) in conversions:
+            old_time = bench(old_func, old_input(img), nb_runs) / megapixels
+            new_time = bench(new_func, new_input(img), nb_runs) / megapixels
+            print("%-15s %12s %8.1fms %8.1fms %7.1fx" % (
+                name, "%dx%d" % size, old_time * 1000, new_time * 1000,
+                old_time / new_time))
+    print("(times per megapixel)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Compare the orientation detection done on full pages (one complete OCR per
+orientation) with the one done on samples of the pages (see
+paperwork.backend.ocr.get_orientation_sample()).
+
+Each fixture image must be a page in the right orientation. It is rotated
+with all the possible angles, and both heuristics must find back the
+rotation.
+"""
+
+import getopt
+import os
+import sys
+import time
+
+import PIL.Image
+
+from paperwork.backend.ocr import get_ocr_tool
+from paperwork.backend.ocr import guess_orientation
+
+ANGLES = [0, 90, 180, 270]
+
+
+def usage():
+    print("Usage: %s [-l <ocr lang>] [-s <spelling lang>] <fixture dir>"
+          % sys.argv[0])
+
+
+def main():
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hl:s:")
+    except getopt.GetoptError, exc:
+        print(str(exc))
+        usage()
+        sys.exit(1)
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    langs = {'ocr': 'eng', 'spelling': 'en'}
+    for (opt, val) in opts:
+        if opt == "-h":
+            usage()
+            sys.exit(0)
+        elif opt == "-l":
+            langs['ocr'] = val
+        elif opt == "-s":
+            langs['spelling'] = val
+
+    ocr_tool = get_ocr_tool()
+    print("Using %s" % ocr_tool.get_name())
+
+    heuristics = [
+        ("full pages", True),
+        ("samples", False),
+    ]
+    stats = {
+        name: {'good': 0, 'total': 0, 'time': 0.0}
+        for (name, _) in heuristics
+    }
+
+    for filename in sorted(os.listdir(args[0])):
+        filepath = os.path.join(args[0], filename)
+        try:
+            img = PIL.Image.open(filepath)
+            img.load()
+        except IOError:
+            continue
+
+        for angle in ANGLES:
+            # rotate the page clockwise: the expected answer is 'angle'
+            rotated = img.rotate(-1 * angle, expand=True)
+            sys.stdout.write("%s (%3d):" % (filename, angle))
+            for (name, full_pages) in heuristics:
+                start = time.time()
+                scores = guess_orientation(ocr_tool, langs, rotated, ANGLES,
+                                           full_pages=full_pages)
+                stop = time.time()
+
+                guessed = scores[0][1]
+                stats[name]['total'] += 1
+                stats[name]['time'] += (stop - start)
+                if guessed == angle:
+                    stats[name]['good'] += 1
+                sys.stdout.write(" %s: %3d (%.1fs)" % (name, guessed,
+                                                       stop - start))
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    print("")
+    print("Results")
+    print("=======")
+    for (name, _) in heuristics:
+        stat = stats[name]
+        if stat['total'] <= 0:
+            print("No fixture found")
+            return
+        print("%s: %d/%d correct (%.1f%%), average time: %.2fs" % (
+            name, stat['good'], stat['total'],
+            100.0 * stat['good'] / stat['total'],
+            stat['time'] / stat['total']))
+
+
+if __name__ == "__main__":
+    main()
@@ -168,6 +168,7 @@ Main features are:
     scripts=[
         'scripts/paperwork',
         'scripts/paperwork-chkdeps',
+        'scripts/paperwork-ocr',
     ],
     install_requires=[
         "Pillow",
@@ -0,0 +1,178 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary copy of the box files (hOCR), much faster to load.
+
+The hOCR box files remain the reference: the binary copy is only used if it
+has been written from the current version of the box file (same
+modification time, size and inode). Otherwise it is rewritten from the box
+file.
+
+Format (little-endian):
+    header: magic, box file mtime (double), size (uint64) and inode (uint64),
+        number of lines (uint32), number of words (uint32)
+    lines: number of lines x (x1, y1, x2, y2, number of words) (int32)
+    words: number of words x (x1, y1, x2, y2, confidence, offset, length)
+        (int32), offset and length in characters in the string table
+    string table: content of all the words, utf-8
+"""
+
+import array
+import codecs
+import logging
+import os
+import struct
+import sys
+
+import pyocr
+import pyocr.builders
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = "PWB2"
+_HEADER = struct.Struct("<4sdQQII")
+_LINE_FIELDS = 5
+_WORD_FIELDS = 7
+
+
+def _get_int_array(data):
+    ints = array.array('i')
+    ints.fromstring(data)
+    if sys.byteorder != "little":
+        ints.byteswap()
+    return ints
+
+
+def _get_src_id(src_stat):
+    return (src_stat.st_mtime, src_stat.st_size, src_stat.st_ino)
+
+
+def write_box_cache(cache_path, src_stat, line_boxes):
+    """
+    Arguments:
+        src_stat --- os.stat() of the box file the boxes come from
+    """
+    lines = array.array('i')
+    words = array.array('i')
+    strings = []
+    str_offset = 0
+    for line in line_boxes:
+        ((x1, y1), (x2, y2)) = line.position
+        lines.extend((x1, y1, x2, y2, len(line.word_boxes)))
+        for word in line.word_boxes:
+            ((x1, y1), (x2, y2)) = word.position
+            # the box files only keep the integer part
+            words.extend((x1, y1, x2, y2, int(word.confidence), str_offset,
+                          len(word.content)))
+            strings.append(word.content)
+            str_offset += len(word.content)
+    if sys.byteorder != "little":
+        lines.byteswap()
+        words.byteswap()
+
+    (mtime, size, inode) = _get_src_id(src_stat)
+    try:
+        with open(cache_path + ".new", 'wb') as file_desc:
+            file_desc.write(_HEADER.pack(MAGIC, mtime, size, inode,
+                                         len(lines) / _LINE_FIELDS,
+                                         len(words) / _WORD_FIELDS))
+            file_desc.write(lines.tostring())
+            file_desc.write(words.tostring())
+            file_desc.write(u"".join(strings).encode("utf-8"))
+        os.rename(cache_path + ".new", cache_path)
+    except (IOError, OSError), exc:
+        logger.warning("Failed to write box cache %s: %s", cache_path, exc)
+
+
+def read_box_cache(cache_path, src_stat):
+    """
+    Returns:
+        The line boxes, or None if the cache file doesn't exist or is not
+        up-to-date
+    """
+    try:
+        with open(cache_path, 'rb') as file_desc:
+            data = file_desc.read()
+    except (IOError, OSError):
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    (magic, mtime, size, inode, nb_lines, nb_words) = \
+        _HEADER.unpack_from(data)
+    if (magic != MAGIC
+            or (mtime, size, inode) != _get_src_id(src_stat)):
+        return None
+    offset = _HEADER.size
+    end = offset + (nb_lines * _LINE_FIELDS * 4)
+    lines = _get_int_array(data[offset:end])
+    offset = end
+    end = offset + (nb_words * _WORD_FIELDS * 4)
+    words = _get_int_array(data[offset:end])
+    strings = data[end:].decode("utf-8")
+
+    line_boxes = []
+    word_idx = 0
+    for line_idx in xrange(0, nb_lines * _LINE_FIELDS, _LINE_FIELDS):
+        word_boxes = []
+        for _ in xrange(0, lines[line_idx + 4]):
+            str_offset = words[word_idx + 5]
+            word_boxes.append(pyocr.builders.Box(
+                strings[str_offset:str_offset + words[word_idx + 6]],
+                ((words[word_idx], words[word_idx + 1]),
+                 (words[word_idx + 2], words[word_idx + 3])),
+                words[word_idx + 4]
+            ))
+            word_idx += _WORD_FIELDS
+        line_boxes.append(pyocr.builders.LineBox(
+            word_boxes,
+            ((lines[line_idx], lines[line_idx + 1]),
+             (lines[line_idx + 2], lines[line_idx + 3]))
+        ))
+    return line_boxes
+
+
+def load_line_boxes(box_path, cache_path):
+    """
+    Load the line boxes of a box file, from its binary copy when it is
+    up-to-date.
+
+    Returns:
+        The line boxes, or None if the box file doesn't exist.
+    """
+    try:
+        src_stat = os.stat(box_path)
+    except OSError:
+        return None
+    boxes = read_box_cache(cache_path, src_stat)
+    if boxes is not None:
+        return boxes
+    logger.info("Parsing box file %s", box_path)
+    with codecs.open(box_path, 'r', encoding='utf-8') as file_desc:
+        boxes = pyocr.builders.LineBoxBuilder().read_file(file_desc)
+    if len(boxes) > 0:
+        write_box_cache(cache_path, src_stat, boxes)
+    return boxes
+
+
+def write_line_boxes(box_path, cache_path, boxes):
+    """
+    Write the box file, and its binary copy
+    """
+    with codecs.open(box_path, 'w', encoding='utf-8') as file_desc:
+        pyocr.builders.LineBoxBuilder().write_file(file_desc, boxes)
+    write_box_cache(cache_path, os.stat(box_path), boxes)
@@ -0,0 +1,60 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+
+from paperwork.backend.util import split_words
+
+
+class BoxIndex(object):
+
+    """
+    Index of the word boxes of a page on their keywords (as returned by
+    split_words(): lower case, without accents). Used to find the boxes to
+    highlight without going through all the boxes of the page.
+    """
+
+    def __init__(self, line_boxes):
+        self.__boxes = {}  # keyword --> [boxes]
+        for line in line_boxes:
+            for box in line.word_boxes:
+                for keyword in split_words(box.content):
+                    if keyword not in self.__boxes:
+                        self.__boxes[keyword] = []
+                    self.__boxes[keyword].append(box)
+        # for the prefix lookups
+        self.__keywords = sorted(self.__boxes.keys())
+
+    def __len__(self):
+        return len(self.__keywords)
+
+    def find(self, keyword):
+        """
+        The given keyword is normalized the same way as the indexed ones
+        (see split_words()).
+
+        Returns:
+            The word boxes containing a keyword starting with the given
+            one
+        """
+        boxes = set()
+        for prefix in split_words(keyword):
+            idx = bisect.bisect_left(self.__keywords, prefix)
+            while (idx < len(self.__keywords)
+                    and self.__keywords[idx].startswith(prefix)):
+                boxes.update(self.__boxes[self.__keywords[idx]])
+                idx += 1
+        return boxes
@@ -0,0 +1,103 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Snapshot of the content of a document directory.
+
+The directory is listed once, and the files are stat()'ed only when their
+modification time is requested (once each). The document type, its number
+of pages and its last modification can then all be deduced from the same
+snapshot. Documents keep their snapshot until their cache is dropped.
+"""
+
+import errno
+import logging
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class DirSnapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+        # filename --> os.DirEntry (or None if the scandir module is not
+        # available)
+        self.__entries = {}
+        self.__mtimes = {}
+        self.exists = True
+        try:
+            if scandir is not None:
+                for entry in scandir(path):
+                    self.__entries[entry.name] = entry
+            else:
+                for filename in os.listdir(path):
+                    self.__entries[filename] = None
+        except OSError, exc:
+            if exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logger.warning("Failed to list files in %s: %s", path, exc)
+            self.exists = False
+
+    def __get_filenames(self):
+        return self.__entries.keys()
+
+    filenames = property(__get_filenames)
+
+    def __contains__(self, filename):
+        return filename in self.__entries
+
+    def get_mtime(self, filename):
+        """
+        Returns:
+            The modification time of the file, or None if it doesn't exist
+        """
+        if filename not in self.__entries:
+            return None
+        if filename not in self.__mtimes:
+            entry = self.__entries[filename]
+            try:
+                if entry is not None:
+                    mtime = entry.stat().st_mtime
+                else:
+                    mtime = os.stat(os.path.join(self.path,
+                                                 filename)).st_mtime
+            except OSError:
+                # removed since the directory has been listed
+                mtime = None
+            self.__mtimes[filename] = mtime
+        return self.__mtimes[filename]
+
+    def get_max_mtime(self, filenames):
+        """
+        Returns:
+            The most recent modification time of the given files (those
+            that exist), or 0.0 if none of them exists
+        """
+        last_mod = 0.0
+        for filename in filenames:
+            mtime = self.get_mtime(filename)
+            if mtime is not None and mtime > last_mod:
+                last_mod = mtime
+        return last_mod
@@ -22,7 +22,9 @@ import os.path
 import time
 import hashlib
 
+from paperwork.backend.common.dirsnapshot import DirSnapshot
 from paperwork.backend.labels import Label
+from paperwork.backend.thumbnails import get_thumbnail_store
 from paperwork.backend.util import rm_rf
 
 from gi.repository import GLib
@@ -41,13 +43,18 @@ class BasicDoc(object):
     can_split = False
     _storage = None
 
-    def __init__(self, docpath, docid=None, label_store=None):
+    def __init__(self, docpath, docid=None, label_store=None,
+                 snapshot=None):
         """
         Basic init of common parts of doc.
 
         Note regarding subclassing: *do not* load the document
         content in __init__(). It would reduce in a huge performance loose
         and thread-safety issues. Load the content on-the-fly when requested.
+
+        Arguments:
+            snapshot --- DirSnapshot of the document directory, if the
+                caller already has one (see DocSearch)
         """
         assert label_store is not None
         self.label_store = label_store
@@ -70,6 +77,8 @@ class BasicDoc(object):
             self.__docid = docid
             self.path = docpath
         self.__cache = {}
+        if snapshot is not None:
+            self.__cache['snapshot'] = snapshot
 
         # We need to keep track of the labels:
         # When updating bayesian filters for label guessing,
@@ -80,6 +89,20 @@ class BasicDoc(object):
     def drop_cache(self):
         self.__cache = {}
 
+    def __get_snapshot(self):
+        """
+        Snapshot of the content of the document directory. Kept until the
+        cache is dropped or the document files are modified.
+        """
+        if 'snapshot' not in self.__cache:
+            self.__cache['snapshot'] = DirSnapshot(self.path)
+        return self.__cache['snapshot']
+
+    snapshot = property(__get_snapshot)
+
+    def _drop_snapshot(self):
+        self.__cache.pop('snapshot', None)
+
     def __str__(self):
         return self.__docid
 
@@ -132,6 +155,7 @@ class BasicDoc(object):
         Delete the document. The *whole* document. There will be no survivors.
         """
         rm_rf(self.path)
+        get_thumbnail_store(os.path.dirname(self.path)).delete(self.docid)
         self.drop_cache()
 
     def add_label(self, label, force=False):
@@ -151,6 +175,7 @@ class BasicDoc(object):
         except (OSError,IOError):
             self.labels.add(label)
             self._write_labels(self.labels)
+        self._drop_snapshot()
 
     def remove_label(self, to_remove):
         """
@@ -213,6 +238,7 @@ class BasicDoc(object):
                 file_desc.write("%s,%s\n" % (name,
                                              label.get_color_str()))
         os.rename(label_file+'.new',label_file)
+        self._drop_snapshot()
 
     def get_index_text(self):
         txt = u""
@@ -317,7 +343,7 @@ class BasicDoc(object):
     def __is_new(self):
         if 'new' in self.__cache:
             return self.__cache['new']
-        self.__cache['new'] = not os.access(self.path, os.F_OK)
+        self.__cache['new'] = not self.snapshot.exists
         return self.__cache['new']
 
     is_new = property(__is_new)
@@ -388,9 +414,9 @@ class BasicDoc(object):
     date = property(__get_date, __set_date)
 
     def __get_extra_text(self):
-        extra_txt_file = os.path.join(self.path, self.EXTRA_TEXT_FILE)
-        if not os.access(extra_txt_file, os.R_OK):
+        if self.EXTRA_TEXT_FILE not in self.snapshot:
             return u""
+        extra_txt_file = os.path.join(self.path, self.EXTRA_TEXT_FILE)
         with codecs.open(extra_txt_file, 'r', encoding='utf-8') as file_desc:
             text = file_desc.read()
             return text
@@ -406,6 +432,7 @@ class BasicDoc(object):
                              encoding='utf-8') as file_desc:
                 file_desc.write(txt)
             os.rename(extra_txt_file+'.new',extra_txt_file)
+        self._drop_snapshot()
 
     extra_text = property(__get_extra_text, __set_extra_text)
 
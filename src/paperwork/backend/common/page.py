@@ -18,6 +18,9 @@ from copy import copy
 import PIL.Image
 import os.path
 
+from paperwork.backend.common.boxindex import BoxIndex
+from paperwork.backend.thumbnails import get_thumbnail_store
+from paperwork.backend.util import image2surface
 from paperwork.backend.util import split_words
 
 
@@ -95,7 +98,18 @@ class BasicPage(object):
     # proportions
     DEFAULT_THUMB_HEIGHT = 424
 
+    # Sizes of the thumbnails generated for each page. They are all
+    # generated at once (see paperwork.backend.thumbnails)
+    THUMB_SIZES = {
+        'doclist': (64, 80),
+        'grid': (DEFAULT_THUMB_WIDTH, DEFAULT_THUMB_HEIGHT),
+        'preview': (2 * DEFAULT_THUMB_WIDTH, 2 * DEFAULT_THUMB_HEIGHT),
+    }
+
+    # thumbnails used to be stored next to the pages
     EXT_THUMB = "thumb.jpg"
+    # binary copy of the box file (see boxcache)
+    EXT_BOX_CACHE = "words.bin"
     FILE_PREFIX = "paper."
 
     boxes = []
@@ -115,8 +129,9 @@ class BasicPage(object):
         self.doc = doc
         self.page_nb = page_nb
 
-        self.__thumbnail_cache = (None, 0)
+        self.__thumbnail_cache = {}  # size name --> thumbnail
         self.__text_cache = None
+        self.__box_index = None
 
         assert(self.page_nb >= 0)
         self.__prototype_exporters = {
@@ -137,52 +152,136 @@ class BasicPage(object):
         filename = ("%s%d.%s" % (self.FILE_PREFIX, self.page_nb + 1, ext))
         return os.path.join(self.doc.path, filename)
 
-    def __make_thumbnail(self, width, height):
+    def __make_thumbnails(self):
+        """
+        Create the page's thumbnails (all the sizes)
+        """
+        thumbnails = {}
+        # biggest first: each thumbnail is made from the previous one
+        sizes = sorted(self.THUMB_SIZES.items(), key=lambda x: x[1],
+                       reverse=True)
+        img = self.get_image(sizes[0][1])
+        for (size_name, (width, height)) in sizes:
+            (w, h) = img.size
+            factor = max(
+                (float(w) / width),
+                (float(h) / height)
+            )
+            if factor > 1.0:
+                w /= factor
+                h /= factor
+                img = img.resize((int(w), int(h)), PIL.Image.ANTIALIAS)
+            thumbnails[size_name] = img
+        return thumbnails
+
+    def get_image(self, size):
+        """
+        Returns an image object corresponding to the page, at least as big
+        as 'size' when possible. Subclasses may return something smaller
+        than the full-size image if it's cheaper to get.
+        """
+        return self.img
+
+    def prefetch_image(self, size):
+        """
+        Start getting the image of the page in the background, if the page
+        type allows it, so a following get_image(size) takes less time.
+        """
+        pass
+
+    def get_surface(self, size):
         """
-        Create the page's thumbnail
+        Returns a cairo surface of the page, with exactly the given size.
+        Meant for display.
         """
-        img = self.img
-        (w, h) = img.size
-        factor = max(
-            (float(w) / width),
-            (float(h) / height)
-        )
-        w /= factor
-        h /= factor
-        img = img.resize((int(w), int(h)), PIL.Image.ANTIALIAS)
-        return img
+        size = (int(size[0]), int(size[1]))
+        img = self.get_image(size)
+        if img.size != size:
+            img = img.resize(size, PIL.Image.ANTIALIAS)
+        return image2surface(img)
+
+    def __get_box_cache_path(self):
+        return self._get_filepath(self.EXT_BOX_CACHE)
+
+    _box_cache_path = property(__get_box_cache_path)
 
     def __get_thumb_path(self):
         return self._get_filepath(self.EXT_THUMB)
 
     _thumb_path = property(__get_thumb_path)
 
+    def __get_thumbnail_store(self):
+        return get_thumbnail_store(os.path.dirname(self.doc.path))
+
+    _thumbnail_store = property(__get_thumbnail_store)
+
+    @staticmethod
+    def get_thumbnail_size_name(width, height):
+        """
+        Returns the name of the smallest thumbnail size bigger or equal to
+        the given size (or the biggest one if none is big enough)
+        """
+        sizes = sorted(BasicPage.THUMB_SIZES.items(), key=lambda x: x[1])
+        for (size_name, size) in sizes:
+            if size[0] >= width and size[1] >= height:
+                return size_name
+        return sizes[-1][0]
+
     def get_thumbnail(self, width, height):
         """
-        thumbnail with a memory cache
+        Returns the smallest thumbnail of the page bigger or equal to
+        the given size (see THUMB_SIZES). It is up to the caller to resize
+        it if required.
         """
-        if ((width, height) == self.__thumbnail_cache[1]):
-            return self.__thumbnail_cache[0]
-
-        # get from the file
-        thumbnail = None
-        try:
-            if (os.path.getmtime(self.get_doc_file_path()) <
-                    os.path.getmtime(self._thumb_path)):
-                thumbnail = PIL.Image.open(self._thumb_path)
-        except Exception:
-            pass
+        size_name = self.get_thumbnail_size_name(width, height)
+        if size_name in self.__thumbnail_cache:
+            return self.__thumbnail_cache[size_name]
+
+        store = self._thumbnail_store
+        thumbnail = store.get(self.doc.docid, self.page_nb, size_name)
         if thumbnail is None:
-            thumbnail = self.__make_thumbnail(width, height)
-            thumbnail.save(self._thumb_path+'.new', format='jpeg')
-            os.rename(self._thumb_path+'.new',self._thumb_path)
+            src_mtime = os.path.getmtime(self.get_doc_file_path())
+            thumbnails = self.__make_thumbnails()
+            store.put(self.doc.docid, self.page_nb, src_mtime, thumbnails)
+            thumbnail = thumbnails[size_name]
 
-        self.__thumbnail_cache = (thumbnail, (width, height))
+        self.__thumbnail_cache[size_name] = thumbnail
         return thumbnail
 
+    def prefetch_thumbnail(self, width, height):
+        """
+        If the thumbnails of the page must be generated for
+        get_thumbnail(width, height), start getting the image they are made
+        from in the background (see prefetch_image())
+        """
+        size_name = self.get_thumbnail_size_name(width, height)
+        if size_name in self.__thumbnail_cache:
+            return
+        if self._thumbnail_store.contains(self.doc.docid, self.page_nb,
+                                          size_name):
+            return
+        biggest = max(self.THUMB_SIZES.values())
+        self.prefetch_image(biggest)
+
+    def _drop_thumbnails(self):
+        """
+        Must be called when the content of the page is modified
+        """
+        self._thumbnail_store.delete(self.doc.docid, self.page_nb)
+        self.__thumbnail_cache = {}
+
+    def _move_thumbnails(self, old_docid, old_page_nb):
+        """
+        Must be called when the files of the page are moved
+        """
+        self._thumbnail_store.move(old_docid, old_page_nb,
+                                   self.doc.docid, self.page_nb)
+        self.__thumbnail_cache = {}
+
     def drop_cache(self):
-        self.__thumbnail_cache = (None, 0)
+        self.__thumbnail_cache = {}
         self.__text_cache = None
+        self.__box_index = None
 
     def __get_text(self):
         if self.__text_cache is not None:
@@ -192,6 +291,17 @@ class BasicPage(object):
 
     text = property(__get_text)
 
+    def __get_box_index(self):
+        """
+        Index of the word boxes on their keywords (see BoxIndex). Built
+        the first time it is requested.
+        """
+        if self.__box_index is None:
+            self.__box_index = BoxIndex(self.boxes)
+        return self.__box_index
+
+    box_index = property(__get_box_index)
+
     def print_page_cb(self, print_op, print_context, keep_refs={}):
         raise NotImplementedError()
 
@@ -257,7 +367,7 @@ class DummyPage(object):
     def _get_filepath(self, ext):
         raise NotImplementedError()
 
-    def get_thumbnail(self, width):
+    def get_thumbnail(self, width, height):
         raise NotImplementedError()
 
     def print_page_cb(self, print_op, print_context):
@@ -32,12 +32,14 @@ import whoosh.qparser
 import whoosh.query
 import whoosh.sorting
 
+from paperwork.backend.common.dirsnapshot import DirSnapshot
 from paperwork.backend.common.page import BasicPage
 from paperwork.backend.img.doc import ImgDoc
 from paperwork.backend.img.doc import is_img_doc
 from paperwork.backend.labels import LabelGuesser
 from paperwork.backend.pdf.doc import PdfDoc
 from paperwork.backend.pdf.doc import is_pdf_doc
+from paperwork.backend.thumbnails import get_thumbnail_store
 from paperwork.backend.util import dummy_progress_cb
 from paperwork.backend.util import MIN_KEYWORD_LEN
 from paperwork.backend.util import mkdir_p
@@ -279,6 +281,8 @@ class DocIndexUpdater(GObject.GObject):
         logger.info("Updating modified doc: %s", doc)
         self._update_doc_in_index(self.index_writer, doc)
         self.label_guesser_updater.upd_doc(doc)
+        # the doc may have been modified outside of Paperwork
+        get_thumbnail_store(self.docsearch.rootdir).revalidate(doc)
 
     def del_doc(self, doc):
         """
@@ -287,12 +291,15 @@ class DocIndexUpdater(GObject.GObject):
         logger.info("Removing doc from the index: %s", doc)
         if doc.docid in self.docsearch._docs_by_id:
             self.docsearch._docs_by_id.pop(doc.docid)
+        thumbnail_store = get_thumbnail_store(self.docsearch.rootdir)
         if isinstance(doc, str) or isinstance(doc, unicode):
             # annoying case : we can't know which labels were on it
             # so we can't roll back the label guesser training ...
             self._delete_doc_from_index(self.index_writer, doc)
+            thumbnail_store.delete(doc)
             return
         self._delete_doc_from_index(self.index_writer, doc.docid)
+        thumbnail_store.delete(doc.docid)
         self.label_guesser_updater.del_doc(doc)
 
     def commit(self):
@@ -481,13 +488,17 @@ class DocSearch(object):
         """
         doc = None
         docpath = os.path.join(self.rootdir, docid)
-        if not os.path.exists(docpath):
+        # listed once: used to guess the doc type, and then by the document
+        # itself (number of pages, last modification, etc)
+        snapshot = DirSnapshot(docpath)
+        if not snapshot.exists:
             return None
         if doc_type_name is not None:
             # if we already know the doc type name
             for (is_doc_type, doc_type_name_b, doc_type) in DOC_TYPE_LIST:
                 if doc_type_name_b == doc_type_name:
-                    doc = doc_type(docpath, docid, label_store=self.label_store)
+                    doc = doc_type(docpath, docid, label_store=self.label_store,
+                                   snapshot=snapshot)
             if not doc:
                 logger.warning("unknown doc type found in the index: %s",
                     doc_type_name
@@ -495,8 +506,9 @@ class DocSearch(object):
         # otherwise we guess the doc type
         if not doc:
             for (is_doc_type, doc_type_name, doc_type) in DOC_TYPE_LIST:
-                if is_doc_type(docpath):
-                    doc = doc_type(docpath, docid, label_store=self.label_store)
+                if is_doc_type(docpath, snapshot):
+                    doc = doc_type(docpath, docid, label_store=self.label_store,
+                                   snapshot=snapshot)
                     break
         if not doc:
             logger.warning("Warning: unknown doc type for doc '%s'", docid)
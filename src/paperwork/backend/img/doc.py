@@ -18,7 +18,6 @@
 Code for managing documents (not page individually ! see page.py for that)
 """
 
-import errno
 import os
 import os.path
 import logging
@@ -28,6 +27,7 @@ import cairo
 import PIL.Image
 from gi.repository import Poppler
 
+from paperwork.backend.common.dirsnapshot import DirSnapshot
 from paperwork.backend.common.doc import BasicDoc
 from paperwork.backend.img.page import ImgPage
 from paperwork.backend.util import image2surface
@@ -223,25 +223,14 @@ class ImgDoc(BasicDoc):
         return ImgDoc(self.path, self.docid)
 
     def __get_last_mod(self):
-        last_mod = 0.0
-        for page in self.pages:
-            if last_mod < page.last_mod:
-                last_mod = page.last_mod
-        labels_path = os.path.join(self.path, BasicDoc.LABEL_FILE)
-        try:
-            file_last_mod = os.stat(labels_path).st_mtime
-            if file_last_mod > last_mod:
-                last_mod = file_last_mod
-        except OSError:
-            pass
-        extra_txt_path = os.path.join(self.path, BasicDoc.EXTRA_TEXT_FILE)
-        try:
-            file_last_mod = os.stat(extra_txt_path).st_mtime
-            if file_last_mod > last_mod:
-                last_mod = file_last_mod
-        except OSError:
-            pass
-        return last_mod
+        snapshot = self.snapshot
+        box_ext = "." + ImgPage.EXT_BOX
+        return snapshot.get_max_mtime(
+            [BasicDoc.LABEL_FILE, BasicDoc.EXTRA_TEXT_FILE]
+            + [filename for filename in snapshot.filenames
+               if (filename.startswith(ImgPage.FILE_PREFIX)
+                   and filename.endswith(box_ext))]
+        )
 
     last_mod = property(__get_last_mod)
 
@@ -257,23 +246,15 @@ class ImgDoc(BasicDoc):
         Compute the number of pages in the document. It basically counts
         how many JPG files there are in the document.
         """
-        try:
-            filelist = os.listdir(self.path)
-            count = 0
-            for filename in filelist:
-                if (filename[-4:].lower() != "." + ImgPage.EXT_IMG
-                    or (filename[-10:].lower() == "." + ImgPage.EXT_THUMB)
-                    or (filename[:len(ImgPage.FILE_PREFIX)].lower() !=
-                        ImgPage.FILE_PREFIX)):
-                    continue
-                count += 1
-            return count
-        except OSError, exc:
-            if exc.errno != errno.ENOENT:
-                logger.error("Exception while trying to get the number of"
-                             " pages of '%s': %s", self.docid, exc)
-                raise
-            return 0
+        count = 0
+        for filename in self.snapshot.filenames:
+            if (filename[-4:].lower() != "." + ImgPage.EXT_IMG
+                or (filename[-10:].lower() == "." + ImgPage.EXT_THUMB)
+                or (filename[:len(ImgPage.FILE_PREFIX)].lower() !=
+                    ImgPage.FILE_PREFIX)):
+                continue
+            count += 1
+        return count
 
     def print_page_cb(self, print_op, print_context, page_nb, keep_refs={}):
         """
@@ -351,16 +332,12 @@ class ImgDoc(BasicDoc):
         return self.pages[page_nb]
 
 
-def is_img_doc(docpath):
-    if not os.path.isdir(docpath):
+def is_img_doc(docpath, snapshot=None):
+    if snapshot is None:
+        snapshot = DirSnapshot(docpath)
+    if not snapshot.exists:
         return False
-    try:
-        filelist = os.listdir(docpath)
-    except OSError, exc:
-        logger.warn("Warning: Failed to list files in %s: %s",
-                    docpath, exc)
-        return False
-    for filename in filelist:
+    for filename in snapshot.filenames:
         if (filename.lower().endswith(ImgPage.EXT_IMG)
                 and not filename.lower().endswith(ImgPage.EXT_THUMB)):
             return True
@@ -28,6 +28,8 @@ import logging
 import pyocr
 import pyocr.builders
 
+from paperwork.backend.common.boxcache import load_line_boxes
+from paperwork.backend.common.boxcache import write_line_boxes
 from paperwork.backend.common.page import BasicPage
 from paperwork.backend.util import image2surface
 
@@ -54,6 +56,7 @@ class ImgPage(BasicPage):
             page_nb = doc.nb_pages
         BasicPage.__init__(self, doc, page_nb)
         self.surface_cache = None
+        self.__boxes = None
 
     def __get_box_path(self):
         """
@@ -102,13 +105,19 @@ class ImgPage(BasicPage):
         """
         Get all the word boxes of this page.
         """
+        if self.__boxes is not None:
+            return self.__boxes
+
         boxfile = self._box_path
 
         try:
-            box_builder = pyocr.builders.LineBoxBuilder()
-            with codecs.open(boxfile, 'r', encoding='utf-8') as file_desc:
-                boxes = box_builder.read_file(file_desc)
+            boxes = load_line_boxes(boxfile, self._box_cache_path)
+            if boxes is None:
+                logger.error("Unable to get boxes for '%s': no box file",
+                             self.doc.docid)
+                return []
             if boxes != []:
+                self.__boxes = boxes
                 return boxes
             # fallback: old format: word boxes
             # shouldn't be used anymore ...
@@ -122,14 +131,16 @@ class ImgPage(BasicPage):
             return []
 
     def __set_boxes(self, boxes):
-        boxfile = self._box_path
-        with codecs.open(boxfile, 'w', encoding='utf-8') as file_desc:
-            pyocr.builders.LineBoxBuilder().write_file(file_desc, boxes)
+        write_line_boxes(self._box_path, self._box_cache_path, boxes)
         self.drop_cache()
         self.doc.drop_cache()
 
     boxes = property(__get_boxes, __set_boxes)
 
+    def drop_cache(self):
+        BasicPage.drop_cache(self)
+        self.__boxes = None
+
     def __get_img(self):
         """
         Returns an image object corresponding to the page
@@ -137,11 +148,32 @@ class ImgPage(BasicPage):
         return PIL.Image.open(self._img_path)
 
     def __set_img(self, img):
-        img.save(self._img_path)
+        # keep the resolution at which the page has been scanned (if known):
+        # the OCR preprocessing needs it
+        dpi = img.info.get('dpi')
+        if dpi is not None:
+            img.save(self._img_path, dpi=dpi)
+        else:
+            img.save(self._img_path)
+        self._drop_thumbnails()
         self.drop_cache()
+        self.doc.drop_cache()
 
     img = property(__get_img, __set_img)
 
+    def get_image(self, size):
+        """
+        Returns an image object corresponding to the page, at least as
+        big as 'size' but possibly smaller than the original: JPEG images
+        are downscaled while being decoded (by 1/2, 1/4 or 1/8), which is
+        much faster than decoding them entirely.
+        It is up to the caller to resize the image to the exact size.
+        """
+        img = PIL.Image.open(self._img_path)
+        if img.format == "JPEG":
+            img.draft(img.mode, (int(size[0]), int(size[1])))
+        return img
+
     def __get_size(self):
         return self.img.size
 
@@ -199,6 +231,7 @@ class ImgPage(BasicPage):
         """
         src = {}
         src["box"] = self._box_path
+        src["box_cache"] = self._box_cache_path
         src["img"] = self._img_path
         src["thumb"] = self._thumb_path
 
@@ -213,6 +246,7 @@ class ImgPage(BasicPage):
 
         dst = {}
         dst["box"] = self._box_path
+        dst["box_cache"] = self._box_cache_path
         dst["img"] = self._img_path
         dst["thumb"] = self._thumb_path
 
@@ -222,6 +256,7 @@ class ImgPage(BasicPage):
                     logger.error("Error: file already exists: %s", dst[key])
                     assert(0)
                 os.rename(src[key], dst[key])
+        self._move_thumbnails(self.doc.docid, page_nb - offset)
 
     def destroy(self):
         """
@@ -236,12 +271,14 @@ class ImgPage(BasicPage):
         current_doc_nb_pages = self.doc.nb_pages
         paths = [
             self._box_path,
+            self._box_cache_path,
             self._img_path,
             self._thumb_path,
         ]
         for path in paths:
             if os.access(path, os.F_OK):
                 os.unlink(path)
+        self._drop_thumbnails()
         for page_nb in range(self.page_nb + 1, current_doc_nb_pages):
             page = doc_pages[page_nb]
             page.change_index(offset=-1)
@@ -270,6 +307,9 @@ class ImgPage(BasicPage):
         for (src, dst) in to_move:
             logger.info("%s --> %s", src, dst)
             os.rename(src, dst)
+        if os.access(other_page._box_cache_path, os.F_OK):
+            os.rename(other_page._box_cache_path, self._box_cache_path)
+        self._move_thumbnails(other_doc.docid, other_page_nb)
 
         if (other_doc_nb_pages <= 1):
             other_doc.destroy()
@@ -0,0 +1,870 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+OCR helpers:
+    - pool of initialized OCR engines
+    - cache of OCR results
+    - orientation detection when the OCR tool can't do it
+    - batch OCR: redo the OCR of many pages at once, using as many processes
+      as there are processors/cores on the computer.
+"""
+
+import codecs
+import collections
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+
+import PIL.Image
+import pyocr
+import pyocr.builders
+try:
+    import pyocr.libtesseract
+    from pyocr.libtesseract import tesseract_raw
+except ImportError:
+    tesseract_raw = None
+
+from paperwork.backend.util import check_spelling
+from paperwork.backend.util import dummy_progress_cb
+from paperwork.backend.util import mkdir_p
+
+
+logger = logging.getLogger(__name__)
+
+# Orientation detection is done on the center of the page only, scaled down
+ORIENTATION_SAMPLE_RATIO = 0.6  # of the width and height of the page
+ORIENTATION_SAMPLE_MAX_SIZE = 1200  # pixels
+
+# OCR tool of the current worker process (see _init_worker())
+_worker_ocr_tool = None
+
+
+def get_ocr_tool():
+    ocr_tools = pyocr.get_available_tools()
+    if len(ocr_tools) == 0:
+        raise Exception("No OCR tool found")
+    if tesseract_raw is not None and pyocr.libtesseract in ocr_tools:
+        # images are given in memory to libtesseract, and the engines can
+        # be kept initialized (see OCREnginePool)
+        return pyocr.libtesseract
+    return ocr_tools[0]
+
+
+def _get_fallback_ocr_tool():
+    """
+    Returns the OCR tool to use when libtesseract can't be initialized (the
+    one used before libtesseract was preferred)
+    """
+    for ocr_tool in pyocr.get_available_tools():
+        if ocr_tool is not pyocr.libtesseract:
+            return ocr_tool
+    return pyocr.libtesseract
+
+
+class _TesseractEngine(object):
+
+    """
+    A libtesseract handle, initialized once for a given language and then
+    used for as many images as required.
+    """
+
+    # not provided by all the versions of pyocr
+    REQUIRED_FUNCTIONS = (
+        "PageIteratorLevel", "init", "set_page_seg_mode", "set_image",
+        "recognize", "get_iterator", "result_iterator_get_page_iterator",
+        "page_iterator_is_at_beginning_of",
+        "page_iterator_is_at_final_element", "page_iterator_bounding_box",
+        "page_iterator_next", "result_iterator_get_utf8_text",
+        "result_iterator_get_confidence", "cleanup",
+    )
+
+    def __init__(self, lang):
+        """
+        Raises:
+            AttributeError if pyocr doesn't provide the required functions
+        """
+        for function in self.REQUIRED_FUNCTIONS:
+            if not hasattr(tesseract_raw, function):
+                raise AttributeError(
+                    "pyocr.libtesseract.tesseract_raw.%s() is missing"
+                    % function)
+        self.lang = lang
+        self.handle = tesseract_raw.init(lang=lang)
+
+    @staticmethod
+    def __get_box(page_iterator, level):
+        (_, box) = tesseract_raw.page_iterator_bounding_box(page_iterator,
+                                                            level)
+        return ((box[0], box[1]), (box[2], box[3]))
+
+    def image_to_boxes(self, img):
+        builder = pyocr.builders.LineBoxBuilder()
+        lvl_line = tesseract_raw.PageIteratorLevel.TEXTLINE
+        lvl_word = tesseract_raw.PageIteratorLevel.WORD
+
+        tesseract_raw.set_page_seg_mode(self.handle,
+                                        builder.tesseract_layout)
+        tesseract_raw.set_image(self.handle, img)
+        tesseract_raw.recognize(self.handle)
+        res_iterator = tesseract_raw.get_iterator(self.handle)
+        if res_iterator is None:
+            # no text found
+            return builder.get_output()
+        page_iterator = tesseract_raw.result_iterator_get_page_iterator(
+            res_iterator)
+
+        while True:
+            if tesseract_raw.page_iterator_is_at_beginning_of(page_iterator,
+                                                               lvl_line):
+                builder.start_line(self.__get_box(page_iterator, lvl_line))
+
+            last_word_in_line = \
+                tesseract_raw.page_iterator_is_at_final_element(
+                    page_iterator, lvl_line, lvl_word)
+            word = tesseract_raw.result_iterator_get_utf8_text(res_iterator,
+                                                               lvl_word)
+            confidence = tesseract_raw.result_iterator_get_confidence(
+                res_iterator, lvl_word)
+            if word is not None and confidence is not None and word != "":
+                builder.add_word(word,
+                                 self.__get_box(page_iterator, lvl_word),
+                                 confidence)
+                if last_word_in_line:
+                    builder.end_line()
+
+            if not tesseract_raw.page_iterator_next(page_iterator, lvl_word):
+                break
+
+        return builder.get_output()
+
+    def close(self):
+        tesseract_raw.cleanup(self.handle)
+
+
+class OCREnginePool(object):
+
+    """
+    Keep OCR engines initialized, per language, instead of loading the
+    language data again for each image. An engine is used by only one
+    thread at a time: there are as many engines for a language as threads
+    running the OCR at the same time with this language.
+
+    Only libtesseract engines can be kept this way. With other OCR tools,
+    or if pyocr doesn't provide the required libtesseract functions,
+    image_to_boxes() simply calls the tool. If libtesseract can't be
+    initialized for a language (missing language data, incompatible
+    library, ...), the other OCR tool available is called instead for this
+    language. An engine that fails on an image is discarded, and the error
+    is raised to the caller.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__idle = {}  # lang --> [engines]
+        self.__failed_langs = set()  # libtesseract can't be initialized
+        self.usable = (tesseract_raw is not None)
+
+    def __get_engine(self, lang):
+        with self.__lock:
+            engines = self.__idle.get(lang)
+            if engines:
+                return engines.pop()
+        logger.info("Initializing a new OCR engine for '%s'", lang)
+        return _TesseractEngine(lang)
+
+    def __release_engine(self, engine):
+        with self.__lock:
+            self.__idle.setdefault(engine.lang, []).append(engine)
+
+    @staticmethod
+    def __discard_engine(engine):
+        try:
+            engine.close()
+        except Exception, exc:
+            logger.warning("Failed to close OCR engine: %s", exc)
+
+    def image_to_boxes(self, ocr_tool, img, lang):
+        """
+        Equivalent to ocr_tool.image_to_string(img, lang=lang,
+        builder=pyocr.builders.LineBoxBuilder())
+        """
+        if (self.usable and ocr_tool is pyocr.libtesseract
+                and lang in self.__failed_langs):
+            ocr_tool = _get_fallback_ocr_tool()
+        elif self.usable and ocr_tool is pyocr.libtesseract:
+            try:
+                engine = self.__get_engine(lang)
+            except (AttributeError, ImportError), exc:
+                # a version of pyocr not providing the functions we need
+                logger.warning("Can't use persistent OCR engines: %s."
+                               " Will call the OCR tool for each image", exc)
+                self.usable = False
+            except Exception, exc:
+                ocr_tool = _get_fallback_ocr_tool()
+                logger.error("Failed to initialize libtesseract for '%s':"
+                             " %s. Will use %s for this language", lang,
+                             exc, ocr_tool.get_name())
+                with self.__lock:
+                    self.__failed_langs.add(lang)
+            else:
+                try:
+                    boxes = engine.image_to_boxes(img)
+                except:
+                    # the engine may be left in an unknown state: it is
+                    # not reused
+                    self.__discard_engine(engine)
+                    raise
+                self.__release_engine(engine)
+                return boxes
+        return ocr_tool.image_to_string(
+            img, lang=lang, builder=pyocr.builders.LineBoxBuilder())
+
+    def close(self):
+        with self.__lock:
+            for engines in self.__idle.values():
+                for engine in engines:
+                    engine.close()
+            self.__idle = {}
+
+
+_ocr_engine_pool = None
+_ocr_engine_pool_lock = threading.Lock()
+
+
+def get_ocr_engine_pool():
+    global _ocr_engine_pool
+    with _ocr_engine_pool_lock:
+        if _ocr_engine_pool is None:
+            _ocr_engine_pool = OCREnginePool()
+        return _ocr_engine_pool
+
+
+class OCRCache(object):
+
+    """
+    Keep the results of the OCR (line boxes), so running the OCR again on
+    the same image is just a file read. Results are indexed on the image
+    content, the rotation applied to the image before the OCR, the OCR
+    language and the OCR tool version.
+    """
+
+    MAX_ENTRIES = 5000
+    # check the number of entries every PRUNE_INTERVAL new entries only
+    PRUNE_INTERVAL = 100
+    EXT = ".words"
+
+    def __init__(self, cachedir=None):
+        if cachedir is None:
+            base_cache_dir = os.getenv(
+                "XDG_CACHE_HOME",
+                os.path.expanduser("~/.cache")
+            )
+            cachedir = os.path.join(base_cache_dir, "paperwork", "ocr")
+        self.cachedir = cachedir
+        mkdir_p(self.cachedir)
+        self.__tool_versions = {}  # tool name --> version
+        self.__nb_puts = 0
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def get_img_hash(img):
+        """
+        Hash of the image content. Computed once by the caller, so it can
+        be used for several rotations of the same image.
+        """
+        img_hash = hashlib.sha1()
+        img_hash.update("%s %dx%d\n" % (img.mode, img.size[0], img.size[1]))
+        img_hash.update(img.tobytes())
+        return img_hash.hexdigest()
+
+    def __get_tool_version(self, ocr_tool):
+        name = ocr_tool.get_name()
+        with self.__lock:
+            if name not in self.__tool_versions:
+                # with some tools, getting the version means running a command
+                self.__tool_versions[name] = ocr_tool.get_version()
+            return self.__tool_versions[name]
+
+    def get_key(self, img_hash, angle, lang, ocr_tool, preprocessing=None):
+        key = u"%s|%d|%s|%s|%s" % (
+            img_hash, angle % 360, lang, ocr_tool.get_name(),
+            ".".join([str(x) for x in self.__get_tool_version(ocr_tool)])
+        )
+        if preprocessing is not None:
+            key += u"|" + preprocessing.get_cache_key()
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.cachedir, key + self.EXT)
+
+    def get(self, key):
+        """
+        Returns:
+            The cached line boxes, or None if there are none
+        """
+        try:
+            with codecs.open(self.__get_path(key), 'r',
+                             encoding='utf-8') as file_desc:
+                boxes = pyocr.builders.LineBoxBuilder().read_file(file_desc)
+        except IOError:
+            return None
+        logger.info("OCR cache hit (%s)", key)
+        return boxes
+
+    def put(self, key, boxes):
+        path = self.__get_path(key)
+        try:
+            with codecs.open(path + ".new", 'w',
+                             encoding='utf-8') as file_desc:
+                pyocr.builders.LineBoxBuilder().write_file(file_desc, boxes)
+            os.rename(path + ".new", path)
+        except (IOError, OSError), exc:
+            logger.warning("Failed to store OCR result in the cache: %s", exc)
+            return
+
+        with self.__lock:
+            self.__nb_puts += 1
+            if self.__nb_puts % self.PRUNE_INTERVAL != 0:
+                return
+        self.prune()
+
+    def prune(self):
+        """
+        Drop the oldest entries if there are too many of them
+        """
+        entries = []
+        for filename in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, filename)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        if len(entries) <= self.MAX_ENTRIES:
+            return
+        entries.sort()
+        for (_, path) in entries[:len(entries) - self.MAX_ENTRIES]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+_ocr_cache = None
+
+
+def get_ocr_cache():
+    global _ocr_cache
+    if _ocr_cache is None:
+        _ocr_cache = OCRCache()
+    return _ocr_cache
+
+
+def image_to_boxes(ocr_tool, img, lang, angle=0, img_hash=None,
+                   preprocessing=None):
+    """
+    Rotate the image and run the OCR on it, unless the result is already
+    in the OCR cache.
+
+    Arguments:
+        angle --- see PIL.Image.rotate()
+        img_hash --- see OCRCache.get_img_hash(). Computed if not provided
+        preprocessing --- OCRPreprocessing or None. The boxes returned are
+            always relative to the rotated image, not the preprocessed one.
+
+    Returns:
+        (rotated image, line boxes)
+    """
+    cache = get_ocr_cache()
+    if img_hash is None:
+        img_hash = cache.get_img_hash(img)
+    key = cache.get_key(img_hash, angle, lang, ocr_tool, preprocessing)
+
+    if angle != 0:
+        img = img.rotate(angle, expand=True)
+    boxes = cache.get(key)
+    if boxes is None:
+        ocr_img = img
+        if preprocessing is not None:
+            (ocr_img, factor, offset) = preprocessing.apply(img)
+        start = time.time()
+        boxes = get_ocr_engine_pool().image_to_boxes(ocr_tool, ocr_img, lang)
+        logger.info("OCR on %dx%d %s image took %dms", ocr_img.size[0],
+                    ocr_img.size[1], ocr_img.mode,
+                    (time.time() - start) * 1000)
+        if preprocessing is not None:
+            preprocessing.remap_boxes(boxes, factor, offset)
+        cache.put(key, boxes)
+    return (img, boxes)
+
+
+def get_orientation_sample(img):
+    """
+    Returns the part of the image used to guess the page orientation: its
+    center, scaled down. The center of a rotated image is the rotated
+    center of the image, so the sample can be rotated instead of the
+    whole page.
+    """
+    (width, height) = img.size
+    margin_x = int(width * (1.0 - ORIENTATION_SAMPLE_RATIO) / 2)
+    margin_y = int(height * (1.0 - ORIENTATION_SAMPLE_RATIO) / 2)
+    sample = img.crop((margin_x, margin_y,
+                       width - margin_x, height - margin_y))
+    factor = (float(ORIENTATION_SAMPLE_MAX_SIZE)
+              / max(sample.size[0], sample.size[1]))
+    if factor < 1.0:
+        sample = sample.resize((int(sample.size[0] * factor),
+                                int(sample.size[1] * factor)),
+                               PIL.Image.ANTIALIAS)
+    return sample
+
+
+def _boxes_to_txt(boxes):
+    txt = u""
+    for line in boxes:
+        txt += line.content + u"\n"
+    return txt
+
+
+def _compute_ocr_score_without_spell_checking(txt):
+    """
+    Try to evaluate how well the OCR worked.
+    Current implementation:
+        The score is the number of words only made of 4 or more letters
+        ([a-zA-Z])
+    """
+    # TODO(Jflesch): i18n / l10n
+    score = 0
+    prog = re.compile(r'^[a-zA-Z]{4,}$')
+    for word in txt.split(" "):
+        if prog.match(word):
+            score += 1
+    return (txt, score)
+
+
+def compute_ocr_score(langs, boxes):
+    """
+    Try to evaluate how well the OCR worked, using the best scoring method
+    available.
+    """
+    score_methods = [
+        ("spell_checker", lambda txt: check_spelling(langs['spelling'], txt)),
+        ("lucky_guess", _compute_ocr_score_without_spell_checking),
+        ("no_score", lambda txt: (txt, 0))
+    ]
+
+    txt = _boxes_to_txt(boxes)
+
+    for score_method in score_methods:
+        try:
+            (_, score) = score_method[1](txt)
+            # TODO(Jflesch): For now, we throw away the fixed version of
+            # the text:
+            # The original version may contain proper nouns, and spell
+            # checking could make them disappear
+            # However, it would be best if we could keep both versions
+            # without increasing too much indexation time
+            return score
+        except Exception, exc:
+            logger.error("Scoring method '%s' failed !", score_method[0])
+            logger.error("Reason: %s" % exc)
+    return 0
+
+
+class _ImgOCRThread(threading.Thread):
+
+    def __init__(self, ocr_tool, langs, angle, img):
+        threading.Thread.__init__(self, name="OCR")
+        self.ocr_tool = ocr_tool
+        self.langs = langs
+        self.angle = angle
+        self.img = img
+        self.score = -1
+        self.boxes = None
+
+    def run(self):
+        logger.info("Running OCR on page orientation %d", self.angle)
+        self.boxes = get_ocr_engine_pool().image_to_boxes(
+            self.ocr_tool, self.img, self.langs['ocr'])
+        self.score = compute_ocr_score(self.langs, self.boxes)
+
+
+def guess_orientation(ocr_tool, langs, img, angles, full_pages=False,
+                      score_cb=lambda angle, score: None):
+    """
+    Run the OCR on the image rotated with each of the given angles, in as
+    many threads as there are processors/cores, and evaluate each result.
+
+    Arguments:
+        full_pages --- if False, only a sample of the image is used
+            (see get_orientation_sample()). Much faster, but the boxes
+            returned are not those of the full page.
+        score_cb --- called each time an orientation has been evaluated
+
+    Returns:
+        [(score, angle, rotated image, boxes), ...], best score first
+    """
+    if not full_pages:
+        img = get_orientation_sample(img)
+    imgs = {angle: img.rotate(angle, expand=True) for angle in angles}
+
+    max_threads = multiprocessing.cpu_count()
+    threads = []
+    scores = []
+
+    while (len(imgs) > 0 or len(threads) > 0):
+        # look for finished threads
+        for thread in threads[:]:
+            if not thread.is_alive():
+                threads.remove(thread)
+                logger.info("OCR done on angle %d: %f",
+                            thread.angle, thread.score)
+                scores.append((thread.score, thread.angle,
+                               thread.img, thread.boxes))
+                score_cb(thread.angle, thread.score)
+        # start new threads if required
+        while (len(threads) < max_threads and len(imgs) > 0):
+            (angle, rotated) = imgs.popitem()
+            logger.info("Starting OCR on angle %d", angle)
+            thread = _ImgOCRThread(ocr_tool, langs, angle, rotated)
+            thread.start()
+            threads.append(thread)
+        time.sleep(0.1)
+
+    # We want the higher score first
+    scores.sort(cmp=lambda x, y: cmp(y[0], x[0]))
+    return scores
+
+
+def _init_worker():
+    global _worker_ocr_tool
+    # interruptions are handled by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_ocr_tool = get_ocr_tool()
+
+
+def _ocr_img(img, lang):
+    # each worker process keeps its own engines initialized
+    return get_ocr_engine_pool().image_to_boxes(_worker_ocr_tool, img, lang)
+
+
+class OCRWorkerPool(object):
+
+    """
+    Pool of processes doing the OCR for BatchOCR. The workers are forked
+    from the calling process: in a multithreaded process, the pool must be
+    started before any other thread (see start_ocr_worker_pool()), otherwise
+    the workers may inherit locks held by the other threads.
+    """
+
+    def __init__(self, nb_workers=None):
+        """
+        Arguments:
+            nb_workers --- default to the number of processors/cores
+        """
+        if nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        logger.info("Starting %d OCR worker(s)", nb_workers)
+        self.nb_workers = nb_workers
+        self.__pool = multiprocessing.Pool(nb_workers,
+                                           initializer=_init_worker)
+
+    def image_to_boxes_async(self, img, lang):
+        """
+        Returns:
+            A multiprocessing AsyncResult. Its get() returns the line boxes
+            found on the image.
+        """
+        return self.__pool.apply_async(_ocr_img, (img, lang))
+
+    def close(self):
+        self.__pool.terminate()
+        self.__pool.join()
+
+
+_ocr_worker_pool = None
+
+
+def start_ocr_worker_pool(nb_workers=None):
+    """
+    Start the OCR worker pool used by BatchOCR. Until it is started, each
+    batch starts its own pool.
+    """
+    global _ocr_worker_pool
+    if _ocr_worker_pool is None:
+        _ocr_worker_pool = OCRWorkerPool(nb_workers)
+    return _ocr_worker_pool
+
+
+def stop_ocr_worker_pool():
+    global _ocr_worker_pool
+    if _ocr_worker_pool is not None:
+        _ocr_worker_pool.close()
+        _ocr_worker_pool = None
+
+
+def get_ocr_worker_pool():
+    """
+    Returns:
+        The OCR worker pool, or None if it hasn't been started
+    """
+    return _ocr_worker_pool
+
+
+class BatchOCR(object):
+
+    """
+    Run the OCR on a bunch of pages and replace their boxes.
+
+    Images are loaded by the calling process (page objects cannot be shared
+    with the workers), and the OCR itself is done in a pool of processes
+    (the one started with start_ocr_worker_pool() if any; otherwise, a pool
+    is started for each run).
+    Each page done is written down in the checkpoint file (if any), so an
+    interrupted run can be resumed later, even by another process.
+    """
+
+    STEP_OCR = "ocr"
+
+    # number of pages sent to the pool but not done yet, per worker.
+    # Keeps the workers busy without loading too many images in memory
+    MAX_PENDING_PER_WORKER = 2
+    POLLING_TIME = 0.2  # secs
+
+    def __init__(self, pages, langs, nb_pages=None, checkpoint_path=None,
+                 nb_workers=None, preprocessing=None):
+        """
+        Arguments:
+            pages --- iterable of pages. May be a generator
+            langs --- see config['langs'].value
+            nb_pages --- total number of pages, if known. Only used for the
+                progression and the ETA
+            checkpoint_path --- file where the pages done are written down
+            nb_workers --- default to the number of processors/cores.
+                Ignored if the OCR worker pool has been started
+            preprocessing --- OCRPreprocessing or None. Done by the calling
+                process, so smaller images are sent to the workers
+        """
+        self.__pages = iter(pages)
+        # pages sent to the pool when run() was interrupted
+        self.__retry = collections.deque()
+        self.lang = langs['ocr']
+        self.ocr_tool = get_ocr_tool()
+        self.cache = get_ocr_cache()
+        self.preprocessing = preprocessing
+        self.nb_pages = nb_pages
+        if get_ocr_worker_pool() is not None:
+            nb_workers = get_ocr_worker_pool().nb_workers
+        elif nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        self.nb_workers = nb_workers
+        self.checkpoint_path = checkpoint_path
+        self.__done = self.__load_checkpoint()
+
+        self.nb_done = 0
+        self.nb_cached = 0
+        self.nb_skipped = 0
+        self.nb_failed = 0
+        self.run_time = 0.0
+        self.docs = set()  # documents with at least one page updated
+
+        self.can_run = False
+        self.finished = False
+
+    @staticmethod
+    def __get_page_id(page):
+        return u"%s\t%d" % (page.doc.docid, page.page_nb)
+
+    def __load_checkpoint(self):
+        if self.checkpoint_path is None:
+            return set()
+        try:
+            with open(self.checkpoint_path, 'r') as file_desc:
+                done = {
+                    line.decode('utf-8').rstrip(u"\n") for line in file_desc
+                }
+        except IOError:
+            return set()
+        logger.info("Batch OCR: resuming from '%s' (%d pages already done)",
+                    self.checkpoint_path, len(done))
+        return done
+
+    def __get_nb_processed(self):
+        return (self.nb_done + self.nb_cached + self.nb_skipped
+                + self.nb_failed)
+
+    nb_processed = property(__get_nb_processed)
+
+    def __get_throughput(self):
+        """
+        Pages OCR'ed per second (pages skipped thanks to the checkpoint or
+        found in the OCR cache don't count)
+        """
+        if self.run_time <= 0.0:
+            return 0.0
+        return self.nb_done / self.run_time
+
+    throughput = property(__get_throughput)
+
+    def __get_eta(self):
+        """
+        Estimated remaining time, in seconds. None if unknown.
+        """
+        throughput = self.throughput
+        if self.nb_pages is None or throughput <= 0.0:
+            return None
+        return max(0, self.nb_pages - self.nb_processed) / throughput
+
+    eta = property(__get_eta)
+
+    def __next_page(self):
+        if self.__retry:
+            return self.__retry.popleft()
+        for page in self.__pages:
+            if self.__get_page_id(page) in self.__done:
+                self.nb_skipped += 1
+                continue
+            return page
+        return None
+
+    def __on_page_done(self, page, boxes, checkpoint, cached=False):
+        page.boxes = boxes
+        self.docs.add(page.doc)
+        if cached:
+            self.nb_cached += 1
+        else:
+            self.nb_done += 1
+        if checkpoint is not None:
+            checkpoint.write(
+                (self.__get_page_id(page) + u"\n").encode('utf-8')
+            )
+            checkpoint.flush()
+
+    def run(self, progress_cb=dummy_progress_cb):
+        """
+        Do the OCR on all the pages, until done or until stop() is called.
+        May be called again after an interruption to resume the work.
+
+        Arguments:
+            progress_cb --- called after each page:
+                progress_cb(nb_processed, nb_pages, BatchOCR.STEP_OCR, page)
+
+        Returns:
+            True if all the pages have been processed
+        """
+        self.can_run = True
+        logger.info("Batch OCR: starting with %d worker(s)", self.nb_workers)
+
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = open(self.checkpoint_path, 'a')
+
+        pool = get_ocr_worker_pool()
+        own_pool = None
+        if pool is None:
+            own_pool = pool = OCRWorkerPool(self.nb_workers)
+        # (page, cache key, (preprocessing factor, offset), result)
+        pending = collections.deque()
+        max_pending = self.nb_workers * self.MAX_PENDING_PER_WORKER
+        start = time.time()
+        try:
+            while self.can_run:
+                while len(pending) < max_pending and self.can_run:
+                    page = self.__next_page()
+                    if page is None:
+                        break
+                    lookup_start = time.time()
+                    img = page.img
+                    key = self.cache.get_key(self.cache.get_img_hash(img), 0,
+                                             self.lang, self.ocr_tool,
+                                             self.preprocessing)
+                    boxes = self.cache.get(key)
+                    if boxes is None:
+                        remap = None
+                        if self.preprocessing is not None:
+                            (img, factor, offset) = \
+                                self.preprocessing.apply(img)
+                            remap = (factor, offset)
+                        result = pool.image_to_boxes_async(img, self.lang)
+                        pending.append((page, key, remap, result))
+                        continue
+                    self.__on_page_done(page, boxes, checkpoint, cached=True)
+                    # the time spent on the pages found in the cache doesn't
+                    # count in the throughput
+                    start += time.time() - lookup_start
+                    progress_cb(self.nb_processed, self.nb_pages,
+                                self.STEP_OCR, page)
+
+                if len(pending) <= 0:
+                    if self.can_run:
+                        self.finished = True
+                    break
+
+                (page, key, remap, result) = pending[0]
+                result.wait(self.POLLING_TIME)
+                if not result.ready():
+                    continue
+                pending.popleft()
+
+                try:
+                    boxes = result.get()
+                except Exception, exc:
+                    logger.error("Batch OCR: OCR failed on %s: %s", page, exc)
+                    self.nb_failed += 1
+                else:
+                    if remap is not None:
+                        self.preprocessing.remap_boxes(boxes, *remap)
+                    self.cache.put(key, boxes)
+                    self.__on_page_done(page, boxes, checkpoint)
+
+                self.run_time += time.time() - start
+                start = time.time()
+                progress_cb(self.nb_processed, self.nb_pages,
+                            self.STEP_OCR, page)
+        finally:
+            # with a shared pool, the pages still pending are OCR'ed anyway
+            # but their results are dropped
+            if own_pool is not None:
+                own_pool.close()
+            self.run_time += time.time() - start
+            # the pages being processed will be done first when resuming
+            pending.reverse()
+            self.__retry.extendleft(entry[0] for entry in pending)
+            if checkpoint is not None:
+                checkpoint.close()
+
+        if self.finished:
+            logger.info("Batch OCR: done (%d pages in %ds, %d from the OCR"
+                        " cache, %d skipped, %d failed)", self.nb_done,
+                        self.run_time, self.nb_cached, self.nb_skipped,
+                        self.nb_failed)
+            if self.checkpoint_path is not None:
+                os.unlink(self.checkpoint_path)
+        else:
+            logger.info("Batch OCR: interrupted (%d pages done, %d from the"
+                        " OCR cache)", self.nb_done, self.nb_cached)
+        return self.finished
+
+    def stop(self):
+        """
+        Interrupt run(). Can be called from another thread.
+        """
+        self.can_run = False
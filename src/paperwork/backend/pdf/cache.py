@@ -0,0 +1,247 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Caches shared by all the PDF documents:
+    - the rendered pages, bounded by the memory used by the images
+    - the open Poppler documents, bounded by their number and the size of
+      their files
+
+When full, the least recently used entries are dropped first.
+"""
+
+import collections
+import logging
+import os
+import threading
+import urllib
+
+from gi.repository import Poppler
+
+
+logger = logging.getLogger(__name__)
+
+# default memory budget of the render cache
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# default limits of the pool of open documents
+DEFAULT_MAX_DOCS = 16
+DEFAULT_MAX_DOC_BYTES = 128 * 1024 * 1024
+
+
+def _get_img_nb_bytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class RenderCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.__lock = threading.Lock()
+        self.__max_bytes = max_bytes
+        # key --> (Pillow image, nb bytes), least recently used first
+        self.__imgs = collections.OrderedDict()
+        self.__nb_bytes = 0
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+
+    def __get_max_bytes(self):
+        return self.__max_bytes
+
+    def __set_max_bytes(self, max_bytes):
+        with self.__lock:
+            self.__max_bytes = max_bytes
+            self.__evict()
+
+    max_bytes = property(__get_max_bytes, __set_max_bytes)
+
+    def __get_nb_bytes(self):
+        return self.__nb_bytes
+
+    nb_bytes = property(__get_nb_bytes)
+
+    def __len__(self):
+        return len(self.__imgs)
+
+    def __contains__(self, key):
+        # doesn't count as a use of the image
+        return key in self.__imgs
+
+    def __evict(self):
+        while self.__nb_bytes > self.__max_bytes and len(self.__imgs) > 0:
+            (key, (_, nb_bytes)) = self.__imgs.popitem(last=False)
+            self.__nb_bytes -= nb_bytes
+            self.nb_evictions += 1
+            logger.debug("Render cache: %s evicted", str(key))
+
+    def get(self, key):
+        """
+        Returns:
+            The cached Pillow image, or None
+        """
+        with self.__lock:
+            entry = self.__imgs.pop(key, None)
+            if entry is None:
+                self.nb_misses += 1
+                return None
+            # most recently used
+            self.__imgs[key] = entry
+            self.nb_hits += 1
+            return entry[0]
+
+    def put(self, key, img):
+        nb_bytes = _get_img_nb_bytes(img)
+        with self.__lock:
+            previous = self.__imgs.pop(key, None)
+            if previous is not None:
+                self.__nb_bytes -= previous[1]
+            if nb_bytes > self.__max_bytes:
+                # would evict everything else and itself
+                return
+            self.__imgs[key] = (img, nb_bytes)
+            self.__nb_bytes += nb_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__imgs = collections.OrderedDict()
+            self.__nb_bytes = 0
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict: {'hits': int, 'misses': int, 'evictions': int,
+            'entries': int, 'bytes': int, 'max_bytes': int}
+        """
+        with self.__lock:
+            return {
+                'hits': self.nb_hits,
+                'misses': self.nb_misses,
+                'evictions': self.nb_evictions,
+                'entries': len(self.__imgs),
+                'bytes': self.__nb_bytes,
+                'max_bytes': self.__max_bytes,
+            }
+
+
+class DocumentPool(object):
+
+    """
+    Poppler documents currently open. A Poppler document keeps the whole
+    parsed PDF in memory, so only the most recently used ones are kept
+    open. The others are transparently reopened when needed.
+
+    The memory used by a document is estimated from the size of its file.
+    """
+
+    def __init__(self, max_docs=DEFAULT_MAX_DOCS,
+                 max_bytes=DEFAULT_MAX_DOC_BYTES):
+        self.__lock = threading.Lock()
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        # pdf path --> (mtime, file size, Poppler document)
+        self.__docs = collections.OrderedDict()
+        self.__nb_bytes = 0
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+
+    def __len__(self):
+        return len(self.__docs)
+
+    def __evict(self):
+        # the most recently used document is always kept, even if too big
+        while (len(self.__docs) > 1
+                and (len(self.__docs) > self.max_docs
+                     or self.__nb_bytes > self.max_bytes)):
+            (path, (_, nb_bytes, _)) = self.__docs.popitem(last=False)
+            self.__nb_bytes -= nb_bytes
+            self.nb_evictions += 1
+            logger.debug("Document pool: %s closed", path)
+
+    def get(self, pdf_path):
+        """
+        Returns:
+            The Poppler document of the given PDF file. It is reopened if
+            the file has been modified since it was opened.
+        """
+        try:
+            stat = os.stat(pdf_path)
+            (mtime, nb_bytes) = (stat.st_mtime, stat.st_size)
+        except OSError:
+            # let Poppler report the error
+            (mtime, nb_bytes) = (None, 0)
+
+        with self.__lock:
+            entry = self.__docs.pop(pdf_path, None)
+            if entry is not None:
+                self.__nb_bytes -= entry[1]
+                if entry[0] == mtime:
+                    self.nb_hits += 1
+                    self.__docs[pdf_path] = entry
+                    self.__nb_bytes += entry[1]
+                    return entry[2]
+            self.nb_misses += 1
+
+        # parsing the document may take a while: done without the lock
+        doc = Poppler.Document.new_from_file(
+            "file://%s" % urllib.quote(pdf_path), password=None)
+
+        with self.__lock:
+            previous = self.__docs.pop(pdf_path, None)
+            if previous is not None:
+                self.__nb_bytes -= previous[1]
+            self.__docs[pdf_path] = (mtime, nb_bytes, doc)
+            self.__nb_bytes += nb_bytes
+            self.__evict()
+        return doc
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict: {'hits': int, 'misses': int, 'evictions': int,
+            'entries': int, 'bytes': int, 'max_docs': int, 'max_bytes': int}
+        """
+        with self.__lock:
+            return {
+                'hits': self.nb_hits,
+                'misses': self.nb_misses,
+                'evictions': self.nb_evictions,
+                'entries': len(self.__docs),
+                'bytes': self.__nb_bytes,
+                'max_docs': self.max_docs,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_RENDER_CACHE = RenderCache()
+_DOCUMENT_POOL = DocumentPool()
+
+
+def get_render_cache():
+    """
+    Returns the render cache shared by all the PDF documents
+    """
+    return _RENDER_CACHE
+
+
+def get_document_pool():
+    """
+    Returns the pool of open Poppler documents shared by all the PDF
+    documents
+    """
+    return _DOCUMENT_POOL
@@ -21,13 +21,17 @@ import urllib
 
 from gi.repository import GLib
 from gi.repository import Gio
-from gi.repository import Poppler
 
+from paperwork.backend.common.dirsnapshot import DirSnapshot
 from paperwork.backend.common.doc import BasicDoc
+from paperwork.backend.pdf.cache import get_document_pool
 from paperwork.backend.pdf.page import PdfPage
 
 
 PDF_FILENAME = "doc.pdf"
+# number of pages and page sizes, so the PDF doesn't have to be parsed
+# to display the document list or to look for changes
+PDF_METADATA_FILENAME = "doc.pdf.meta"
 logger = logging.getLogger(__name__)
 
 
@@ -76,26 +80,30 @@ class PdfPagesIterator(object):
 
 
 class PdfPages(object):
-    def __init__(self, pdfdoc, pdf):
+    def __init__(self, pdfdoc):
         self.pdfdoc = pdfdoc
-        self.pdf = pdf
         self.page = {}
 
+    def __get_pdf(self):
+        return self.pdfdoc.pdf
+
+    pdf = property(__get_pdf)
+
     def __getitem__(self, idx):
         if isinstance(idx,slice):
             res = []
-            for i in range(idx.start or 0, idx.stop or self.pdf.get_n_pages(), idx.step or 1):
+            for i in range(idx.start or 0, idx.stop or self.pdfdoc.nb_pages, idx.step or 1):
                 res.append(self[i])
             return res
 
         if idx < 0:
-            idx = self.pdf.get_n_pages() + idx
+            idx = self.pdfdoc.nb_pages + idx
         if idx not in self.page:
-            self.page[idx] = PdfPage(self.pdfdoc, self.pdf, idx)
+            self.page[idx] = PdfPage(self.pdfdoc, idx)
         return self.page[idx]
 
     def __len__(self):
-        return self.pdf.get_n_pages()
+        return self.pdfdoc.nb_pages
 
     def __iter__(self):
         return PdfPagesIterator(self.pdfdoc)
@@ -107,32 +115,20 @@ class PdfDoc(BasicDoc):
     doctype = u"PDF"
     _pages = None
 
-    def __init__(self, *args,**kwargs):
-        BasicDoc.__init__(self, *args,**kwargs)
-        self._pdf = None
+    def __init__(self, *args, **kwargs):
+        BasicDoc.__init__(self, *args, **kwargs)
+        self.__metadata = None
 
     def __get_last_mod(self):
-        pdfpath = os.path.join(self.path, PDF_FILENAME)
-        last_mod = os.stat(pdfpath).st_mtime
-        for page in self.pages:
-            if page.last_mod > last_mod:
-                last_mod = page.last_mod
-        labels_path = os.path.join(self.path, BasicDoc.LABEL_FILE)
-        try:
-            file_last_mod = os.stat(labels_path).st_mtime
-            if file_last_mod > last_mod:
-                last_mod = file_last_mod
-        except OSError:
-            pass
-        extra_txt_path = os.path.join(self.path, BasicDoc.EXTRA_TEXT_FILE)
-        try:
-            file_last_mod = os.stat(extra_txt_path).st_mtime
-            if file_last_mod > last_mod:
-                last_mod = file_last_mod
-        except OSError:
-            pass
-
-        return last_mod
+        # the PDF is not opened and only the relevant files are stat()'ed
+        snapshot = self.snapshot
+        word_ext = "." + PdfPage.EXT_BOX
+        return snapshot.get_max_mtime(
+            [PDF_FILENAME, BasicDoc.LABEL_FILE, BasicDoc.EXTRA_TEXT_FILE]
+            + [filename for filename in snapshot.filenames
+               if (filename.startswith(PdfPage.FILE_PREFIX)
+                   and filename.endswith(word_ext))]
+        )
 
     last_mod = property(__get_last_mod)
 
@@ -140,28 +136,84 @@ class PdfDoc(BasicDoc):
         return ("%s/%s" % (self.path, PDF_FILENAME))
 
     def _open_pdf(self):
-        if self._pdf:
-            return self._pdf
-        self._pdf = Poppler.Document.new_from_file(
-            ("file://%s/%s" % (urllib.quote(self.path), PDF_FILENAME)),
-            password=None)
-        return self._pdf
+        # not kept here: documents are closed when not used for a while
+        return get_document_pool().get(self.get_pdf_file_path())
 
     pdf = property(_open_pdf)
 
     def __get_pages(self):
         if self._pages is None:
-            self._pages = PdfPages(self, self.pdf)
+            self._pages = PdfPages(self)
         return self._pages
 
     pages = property(__get_pages)
 
+    def __read_metadata(self, pdf_stat):
+        path = os.path.join(self.path, PDF_METADATA_FILENAME)
+        try:
+            with open(path, 'r') as file_desc:
+                lines = file_desc.readlines()
+        except IOError:
+            return None
+        try:
+            (mtime, size) = lines[0].split()
+            if (float(mtime) != pdf_stat.st_mtime
+                    or int(size) != pdf_stat.st_size):
+                return None
+            page_sizes = []
+            for line in lines[1:]:
+                (width, height) = line.split()
+                page_sizes.append((int(width), int(height)))
+        except (IndexError, ValueError), exc:
+            logger.warning("%s: Invalid metadata file: %s", self, exc)
+            return None
+        return page_sizes
+
+    def __write_metadata(self, pdf_stat, page_sizes):
+        path = os.path.join(self.path, PDF_METADATA_FILENAME)
+        try:
+            with open(path + ".new", 'w') as file_desc:
+                file_desc.write("%r %d\n" % (pdf_stat.st_mtime,
+                                             pdf_stat.st_size))
+                for (width, height) in page_sizes:
+                    file_desc.write("%d %d\n" % (width, height))
+            os.rename(path + ".new", path)
+        except (IOError, OSError), exc:
+            logger.warning("%s: Failed to write metadata file: %s", self, exc)
+
+    def __get_metadata(self):
+        """
+        Returns:
+            The size of each page (in PDF points). Read from the metadata
+            file, unless the PDF file has changed since it was written.
+        """
+        if self.__metadata is not None:
+            return self.__metadata
+        pdf_stat = os.stat(self.get_pdf_file_path())
+        page_sizes = self.__read_metadata(pdf_stat)
+        if page_sizes is None:
+            logger.info("%s: Reading page sizes from the PDF", self)
+            pdf = self.pdf
+            page_sizes = []
+            for page_nb in xrange(0, pdf.get_n_pages()):
+                size = pdf.get_page(page_nb).get_size()
+                page_sizes.append((int(size[0]), int(size[1])))
+            self.__write_metadata(pdf_stat, page_sizes)
+        self.__metadata = page_sizes
+        return page_sizes
+
+    def get_page_size(self, page_nb):
+        """
+        Returns:
+            The size of the page, in PDF points
+        """
+        return self.__get_metadata()[page_nb]
+
     def _get_nb_pages(self):
         if self.is_new:
             # happens when a doc was recently deleted
             return 0
-        nb_pages = self.pdf.get_n_pages()
-        return nb_pages
+        return len(self.__get_metadata())
 
     def print_page_cb(self, print_op, print_context, page_nb, keep_refs={}):
         """
@@ -183,6 +235,7 @@ class PdfDoc(BasicDoc):
         f.copy(dest,
                0,  # TODO(Jflesch): Missing flags: don't keep attributes
                None, None, None)
+        self.drop_cache()
 
     @staticmethod
     def get_export_formats():
@@ -193,12 +246,10 @@ class PdfDoc(BasicDoc):
 
     def drop_cache(self):
         BasicDoc.drop_cache(self)
+        self.__metadata = None
         if self._pages:
             del self._pages
         self._pages = None
-        if self._pdf:
-            del self._pdf
-        self._pdf = None
 
     def get_docfilehash(self):
         return BasicDoc.hash_file("%s/%s" % (self.path, PDF_FILENAME))
@@ -279,9 +330,11 @@ class PdfDoc(BasicDoc):
         for pdf_page,page in zip(pdf_r.pages,doc_pages):
             if page.page_nb in pages:
                 pages.remove(page.page_nb)
-                for path in (page._box_path, page._thumb_path):
+                for path in (page._box_path, page._box_cache_path,
+                             page._thumb_path):
                     if os.access(path, os.F_OK):
                         os.unlink(path)
+                page._drop_thumbnails()
                 offset += 1
             else:
                 pdf_w.addpage(pdf_page)
@@ -295,12 +348,7 @@ class PdfDoc(BasicDoc):
     def open(self):
         GLib.spawn_async([b"xdg-open",os.path.join(self.path,PDF_FILENAME).encode('utf-8')], flags=GLib.SPAWN_SEARCH_PATH)
 
-def is_pdf_doc(docpath):
-    if not os.path.isdir(docpath):
-        return False
-    try:
-        filelist = os.listdir(docpath)
-    except OSError, exc:
-        logger.exception("Warning: Failed to list files in %s", docpath)
-        return False
-    return PDF_FILENAME in filelist
+def is_pdf_doc(docpath, snapshot=None):
+    if snapshot is None:
+        snapshot = DirSnapshot(docpath)
+    return PDF_FILENAME in snapshot
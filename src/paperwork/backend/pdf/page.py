@@ -16,12 +16,20 @@
 
 import cairo
 import codecs
+import collections
+import hashlib
 import os
 import logging
+import threading
 import pyocr
 import pyocr.builders
 
+from paperwork.backend.common.boxcache import load_line_boxes
+from paperwork.backend.common.boxcache import write_line_boxes
 from paperwork.backend.common.page import BasicPage
+from paperwork.backend.ocr import OCRCache
+from paperwork.backend.pdf.cache import get_render_cache
+from paperwork.backend.pdf.renderer import get_renderer_pool
 from paperwork.backend.util import split_words
 from paperwork.backend.util import surface2image
 
@@ -32,6 +40,78 @@ PDF_RENDER_FACTOR = 2
 logger = logging.getLogger(__name__)
 
 
+# renders requested in advance to the renderer pool (see
+# PdfPage.prefetch_image()), not used yet
+MAX_PENDING_RENDERS = 32
+_pending_renders = collections.OrderedDict()  # render key --> PendingRender
+_pending_renders_lock = threading.Lock()
+
+_boxes_cache = None
+
+
+def _get_boxes_cache():
+    """
+    Returns the cache of the boxes extracted from the PDF files (same
+    format as the OCR cache, but stored separately)
+    """
+    global _boxes_cache
+    if _boxes_cache is None:
+        base_cache_dir = os.getenv(
+            "XDG_CACHE_HOME",
+            os.path.expanduser("~/.cache")
+        )
+        _boxes_cache = OCRCache(
+            os.path.join(base_cache_dir, "paperwork", "pdf_boxes")
+        )
+    return _boxes_cache
+
+
+def _layout_to_line_boxes(txt, rects):
+    """
+    Build the line boxes of a page from its text layout, in a single pass.
+
+    Arguments:
+        txt --- text of the page (unicode)
+        rects --- one rectangle (x1, y1, x2, y2) per character of the text,
+            origin at the top left of the page (see
+            Poppler.Page.get_text_layout())
+    """
+    def scale(rect):
+        return ((int(rect[0] * PDF_RENDER_FACTOR),
+                 int(rect[1] * PDF_RENDER_FACTOR)),
+                (int(rect[2] * PDF_RENDER_FACTOR),
+                 int(rect[3] * PDF_RENDER_FACTOR)))
+
+    def union(rect_a, rect_b):
+        if rect_a is None:
+            return rect_b
+        return (min(rect_a[0], rect_b[0]), min(rect_a[1], rect_b[1]),
+                max(rect_a[2], rect_b[2]), max(rect_a[3], rect_b[3]))
+
+    line_boxes = []
+    word_boxes = []
+    word = u""
+    word_rect = None
+    line_rect = None
+    # an extra line break to flush the last word and the last line
+    for (char, rect) in zip(txt, rects) + [(u"\n", None)]:
+        if not char.isspace():
+            word += char
+            word_rect = union(word_rect, rect)
+            continue
+        if word != u"":
+            word_boxes.append(pyocr.builders.Box(word, scale(word_rect)))
+            line_rect = union(line_rect, word_rect)
+            word = u""
+            word_rect = None
+        if char == u"\n" and len(word_boxes) > 0:
+            line_boxes.append(pyocr.builders.LineBox(word_boxes,
+                                                     scale(line_rect)))
+            word_boxes = []
+            line_rect = None
+    return line_boxes
+
+
 class PdfWordBox(object):
     def __init__(self, content, rectangle, pdf_size):
         self.content = content
@@ -62,14 +142,21 @@ class PdfPage(BasicPage):
     EXT_TXT = "txt"
     EXT_BOX = "words"
 
-    def __init__(self, doc, pdf, page_nb):
+    def __init__(self, doc, page_nb):
         BasicPage.__init__(self, doc, page_nb)
-        self.pdf_page = pdf.get_page(page_nb)
-        assert(self.pdf_page is not None)
-        size = self.pdf_page.get_size()
-        self._size = (int(size[0]), int(size[1]))
         self.__boxes = None
-        self.__img_cache = {}
+
+    def __get_pdf_page(self):
+        # the Poppler page keeps its document open: never kept
+        return self.doc.pdf.get_page(self.page_nb)
+
+    pdf_page = property(__get_pdf_page)
+
+    def __get_pdf_size(self):
+        # from the metadata of the document: doesn't require parsing the PDF
+        return self.doc.get_page_size(self.page_nb)
+
+    _size = property(__get_pdf_size)
 
     def get_doc_file_path(self):
         """
@@ -126,7 +213,11 @@ class PdfPage(BasicPage):
                 txt.append(txt_line)
             return txt
         except OSError, exc:
-            txt = self.pdf_page.get_text()
+            pool = get_renderer_pool()
+            if pool is not None:
+                txt = pool.get_text(self.get_doc_file_path(), self.page_nb)
+            else:
+                txt = self.pdf_page.get_text()
             txt = unicode(txt, encoding='utf-8')
             return txt.split(u"\n")
 
@@ -138,67 +229,169 @@ class PdfPage(BasicPage):
             return self.__boxes
 
         # Check first if there is an OCR file available
-        boxfile = self.__get_box_path()
         try:
-            os.stat(boxfile)
-
-            box_builder = pyocr.builders.LineBoxBuilder()
-
-            try:
-                with codecs.open(boxfile, 'r', encoding='utf-8') as file_desc:
-                    self.__boxes = box_builder.read_file(file_desc)
+            boxes = load_line_boxes(self.__get_box_path(),
+                                    self._box_cache_path)
+            if boxes is not None:
+                self.__boxes = boxes
                 return self.__boxes
-            except IOError, exc:
-                logger.error("Unable to get boxes for '%s': %s",
-                             self.doc.docid, exc)
-                # will fall back on pdf boxes
-        except OSError, exc:  # os.stat() failed
-            pass
-
-        # fall back on what libpoppler tells us
-
-        # TODO: Line support !
+        except IOError, exc:
+            logger.error("Unable to get boxes for '%s': %s",
+                         self.doc.docid, exc)
+            # will fall back on pdf boxes
+
+        # fall back on what libpoppler tells us. Extracting them means
+        # going through the whole text layout of the page, so they are
+        # cached
+        pdf_path = self.get_doc_file_path()
+        key = "%s|%f|%d" % (pdf_path, os.path.getmtime(pdf_path),
+                             self.page_nb)
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        key = hashlib.sha1(key).hexdigest()
+        cache = _get_boxes_cache()
+        self.__boxes = cache.get(key)
+        if self.__boxes is None:
+            self.__boxes = self.__extract_boxes()
+            cache.put(key, self.__boxes)
+        return self.__boxes
 
-        txt = self.pdf_page.get_text()
-        pdf_size = self.pdf_page.get_size()
+    def __extract_boxes(self):
+        pool = get_renderer_pool()
+        if pool is not None:
+            (txt, rects) = pool.get_text_layout(self.get_doc_file_path(),
+                                                self.page_nb)
+        else:
+            pdf_page = self.pdf_page
+            txt = pdf_page.get_text()
+            (ok, rects) = pdf_page.get_text_layout()
+            if ok:
+                rects = [(r.x1, r.y1, r.x2, r.y2) for r in rects]
+            else:
+                rects = None
+        txt = unicode(txt, encoding='utf-8')
+        if rects is not None and len(rects) == len(txt):
+            return _layout_to_line_boxes(txt, rects)
+
+        logger.warning("%s: No usable text layout. Searching the words"
+                       " one by one", self)
+        pdf_page = self.pdf_page
+        pdf_size = pdf_page.get_size()
         words = set()
-        self.__boxes = []
-        for line in txt.split("\n"):
-            for word in split_words(unicode(line, encoding='utf-8')):
+        boxes = []
+        for line in txt.split(u"\n"):
+            for word in split_words(line):
                 words.add(word)
         for word in words:
-            for rect in self.pdf_page.find_text(word):
+            for rect in pdf_page.find_text(word):
                 word_box = PdfWordBox(word, rect, pdf_size)
                 line_box = PdfLineBox([word_box], rect, pdf_size)
-                self.__boxes.append(line_box)
-        return self.__boxes
+                boxes.append(line_box)
+        return boxes
 
     def __set_boxes(self, boxes):
-        boxfile = self.__get_box_path()
-        with codecs.open(boxfile, 'w', encoding='utf-8') as file_desc:
-            pyocr.builders.LineBoxBuilder().write_file(file_desc, boxes)
+        write_line_boxes(self.__get_box_path(), self._box_cache_path, boxes)
         self.drop_cache()
         self.doc.drop_cache()
 
     boxes = property(__get_boxes, __set_boxes)
 
+    def __render(self, size):
+        """
+        Returns:
+            An opaque cairo surface (no alpha compositing when converting
+            it) of the page, with the given size
+        """
+        pool = get_renderer_pool()
+        if pool is not None:
+            return pool.render(self.get_doc_file_path(), self.page_nb, size)
+
+        (width, height) = size
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        ctx = cairo.Context(surface)
+        ctx.set_source_rgb(1.0, 1.0, 1.0)
+        ctx.paint()
+        ctx.scale(float(width) / self._size[0], float(height) / self._size[1])
+        self.pdf_page.render(ctx)
+        return surface
+
+    def __get_render_key(self, factor):
+        # the modification time of the PDF file is part of the key: renders
+        # of the previous versions of the file are never used again and
+        # end up evicted
+        pdf_path = self.get_doc_file_path()
+        return (pdf_path, os.path.getmtime(pdf_path), self.page_nb, factor)
+
+    def __get_render_size(self, factor):
+        return (int(factor * self._size[0]), int(factor * self._size[1]))
+
     def __render_img(self, factor):
         # TODO(Jflesch): In a perfect world, we shouldn't use ImageSurface.
         # we should draw directly on the GtkImage.window.cairo_create()
         # context. It would be much more efficient.
 
-        if factor not in self.__img_cache:
+        key = self.__get_render_key(factor)
+        cache = get_render_cache()
+        img = cache.get(key)
+        if img is not None:
+            return img
+
+        with _pending_renders_lock:
+            pending = _pending_renders.pop(key, None)
+        if pending is not None:
+            surface = pending.get()
+        else:
             logger.debug('Building img from pdf with factor: %s',
                          factor)
-            width = int(factor * self._size[0])
-            height = int(factor * self._size[1])
+            surface = self.__render(self.__get_render_size(factor))
+        img = surface2image(surface)
+        cache.put(key, img)
+        return img
 
-            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-            ctx = cairo.Context(surface)
-            ctx.scale(factor, factor)
-            self.pdf_page.render(ctx)
-            self.__img_cache[factor] = surface2image(surface)
-        return self.__img_cache[factor]
+    def prefetch_image(self, size):
+        """
+        Request the rendering of the page to the renderer pool, without
+        waiting for it: a following get_image(size) only has to wait for
+        the end of the rendering. Many pages can be requested this way,
+        and then rendered at the same time.
+        """
+        pool = get_renderer_pool()
+        if pool is None:
+            return
+        factor = min(self.__get_render_factor(size), PDF_RENDER_FACTOR)
+        key = self.__get_render_key(factor)
+        if key in get_render_cache():
+            return
+        with _pending_renders_lock:
+            if key in _pending_renders:
+                return
+            _pending_renders[key] = pool.render_async(
+                self.get_doc_file_path(), self.page_nb,
+                self.__get_render_size(factor)
+            )
+            # renders never used are forgotten, oldest first
+            while len(_pending_renders) > MAX_PENDING_RENDERS:
+                _pending_renders.popitem(last=False)
+
+    def __get_render_factor(self, size):
+        return max(float(size[0]) / self._size[0],
+                   float(size[1]) / self._size[1])
+
+    def get_image(self, size):
+        """
+        Returns the page rendered just big enough to cover 'size' (but never
+        bigger than 'img'), instead of rendering it at full size and
+        downscaling it.
+        """
+        factor = min(self.__get_render_factor(size), PDF_RENDER_FACTOR)
+        return self.__render_img(factor)
+
+    def get_surface(self, size):
+        """
+        Render the page with Poppler directly on a surface of the given
+        size: no conversion to a Pillow image and no resizing.
+        """
+        return self.__render((int(size[0]), int(size[1])))
 
     def __get_img(self):
         return self.__render_img(PDF_RENDER_FACTOR)
@@ -244,6 +437,7 @@ class PdfPage(BasicPage):
         """
         src = {}
         src["box"] = self._box_path
+        src["box_cache"] = self._box_cache_path
         src["thumb"] = self._thumb_path
 
         page_nb = self.page_nb
@@ -257,6 +451,7 @@ class PdfPage(BasicPage):
 
         dst = {}
         dst["box"] = self._box_path
+        dst["box_cache"] = self._box_cache_path
         dst["thumb"] = self._thumb_path
 
         for key in src.keys():
@@ -265,6 +460,7 @@ class PdfPage(BasicPage):
                     logger.error("Error: file already exists: %s", dst[key])
                     assert(0)
                 os.rename(src[key], dst[key])
+        self._move_thumbnails(self.doc.docid, page_nb - offset)
 
     def move_index(self, new_doc, new_page_nb=1):
         """
@@ -272,6 +468,7 @@ class PdfPage(BasicPage):
         """
         src = {}
         src["box"] = self._box_path
+        src["box_cache"] = self._box_cache_path
         src["thumb"] = self._thumb_path
 
         page_nb = self.page_nb
@@ -280,11 +477,13 @@ class PdfPage(BasicPage):
                     self.page_nb, new_doc.path, new_page_nb)
 
         self.drop_cache()
+        old_docid = self.doc.docid
         self.doc = new_doc
         self.page_nb = new_page_nb
 
         dst = {}
         dst["box"] = self._box_path
+        dst["box_cache"] = self._box_cache_path
         dst["thumb"] = self._thumb_path
 
         for key in src.keys():
@@ -293,6 +492,7 @@ class PdfPage(BasicPage):
                     logger.error("Error: file already exists: %s", dst[key])
                     assert(0)
                 os.rename(src[key], dst[key])
+        self._move_thumbnails(old_docid, page_nb)
 
     def print_page_cb(self, print_op, print_context, keep_refs={}):
         ctx = print_context.get_cairo_context()
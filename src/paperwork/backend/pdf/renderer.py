@@ -0,0 +1,252 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pool of processes rendering PDF pages and extracting their text.
+
+Poppler is not thread-safe, so in a single process, all the PDF work must
+be done one page at a time. Each worker process of the pool opens its own
+Poppler documents, so several pages can be rendered at the same time
+without sharing any Poppler object between threads.
+
+The workers render the pages directly in files mapped in memory (in
+/dev/shm when available). The calling process maps the same files to get
+the pixels: they are never copied nor pickled.
+
+The pool must be started before any other thread (see start_renderer_pool()):
+the worker processes are forked from the calling process.
+"""
+
+import collections
+import logging
+import mmap
+import multiprocessing
+import os
+import signal
+import tempfile
+import urllib
+
+import cairo
+
+
+logger = logging.getLogger(__name__)
+
+# number of Poppler documents kept open by each worker
+WORKER_MAX_OPEN_DOCS = 8
+
+_worker_docs = collections.OrderedDict()  # pdf path --> (mtime, document)
+
+
+def _get_shm_dir():
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None  # default temporary directory
+
+
+def _init_worker():
+    # interruptions are handled by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _get_worker_page(pdf_path, page_nb):
+    from gi.repository import Poppler
+
+    mtime = os.path.getmtime(pdf_path)
+    entry = _worker_docs.pop(pdf_path, None)
+    if entry is None or entry[0] != mtime:
+        entry = (mtime, Poppler.Document.new_from_file(
+            "file://%s" % urllib.quote(pdf_path), password=None))
+    _worker_docs[pdf_path] = entry
+    while len(_worker_docs) > WORKER_MAX_OPEN_DOCS:
+        _worker_docs.popitem(last=False)
+    return entry[1].get_page(page_nb)
+
+
+def _render(pdf_path, page_nb, size):
+    page = _get_worker_page(pdf_path, page_nb)
+    (width, height) = size
+    stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_RGB24,
+                                                        width)
+    (fd, path) = tempfile.mkstemp(prefix="paperwork-render-",
+                                  dir=_get_shm_dir())
+    try:
+        os.ftruncate(fd, stride * height)
+        mapped = mmap.mmap(fd, stride * height, access=mmap.ACCESS_WRITE)
+        try:
+            surface = cairo.ImageSurface.create_for_data(
+                mapped, cairo.FORMAT_RGB24, width, height, stride)
+            ctx = cairo.Context(surface)
+            ctx.set_source_rgb(1.0, 1.0, 1.0)
+            ctx.paint()
+            (page_width, page_height) = page.get_size()
+            ctx.scale(float(width) / page_width, float(height) / page_height)
+            page.render(ctx)
+            surface.finish()
+            del ctx
+            del surface
+        finally:
+            mapped.close()
+    except:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    return (path, width, height, stride)
+
+
+def _get_text(pdf_path, page_nb):
+    return _get_worker_page(pdf_path, page_nb).get_text()
+
+
+def _get_text_layout(pdf_path, page_nb):
+    page = _get_worker_page(pdf_path, page_nb)
+    (ok, rects) = page.get_text_layout()
+    if not ok:
+        rects = None
+    else:
+        # Poppler rectangles can't be pickled
+        rects = [(r.x1, r.y1, r.x2, r.y2) for r in rects]
+    return (page.get_text(), rects)
+
+
+def _map_surface(path, width, height, stride):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.unlink(path)
+        # private mapping: cairo requires a writable buffer, but the
+        # changes made on the surface must not go back to the file
+        mapped = mmap.mmap(fd, stride * height, access=mmap.ACCESS_COPY)
+    finally:
+        os.close(fd)
+    # the surface keeps a reference on the mapping
+    return cairo.ImageSurface.create_for_data(
+        mapped, cairo.FORMAT_RGB24, width, height, stride)
+
+
+class PendingRender(object):
+
+    def __init__(self):
+        self.result = None
+        self.__surface = None
+        self.__exc = None
+
+    def _on_rendered(self, result):
+        # called by the pool as soon as the page is rendered (before
+        # ready() returns True): the file is mapped and unlinked right away,
+        # even if get() is never called.
+        # Must not raise: it would stop the result handler of the pool
+        try:
+            self.__surface = _map_surface(*result)
+        except Exception, exc:
+            self.__exc = exc
+
+    def ready(self):
+        return self.result.ready()
+
+    def get(self):
+        """
+        Returns:
+            A cairo surface (RGB24)
+        """
+        self.result.get()  # raises the exception of the worker, if any
+        if self.__exc is not None:
+            raise self.__exc
+        return self.__surface
+
+
+class PdfRendererPool(object):
+
+    def __init__(self, nb_workers=None):
+        """
+        Arguments:
+            nb_workers --- default to the number of processors/cores
+        """
+        if nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        logger.info("Starting %d PDF renderer(s)", nb_workers)
+        self.nb_workers = nb_workers
+        self.__pool = multiprocessing.Pool(nb_workers,
+                                           initializer=_init_worker)
+
+    def render_async(self, pdf_path, page_nb, size):
+        """
+        Request the rendering of a page at the given size (in pixels).
+
+        Returns:
+            A PendingRender
+        """
+        size = (int(size[0]), int(size[1]))
+        pending = PendingRender()
+        pending.result = self.__pool.apply_async(
+            _render, (pdf_path, page_nb, size),
+            callback=pending._on_rendered)
+        return pending
+
+    def render(self, pdf_path, page_nb, size):
+        """
+        Returns:
+            A cairo surface (RGB24) of the page, with the given size
+        """
+        return self.render_async(pdf_path, page_nb, size).get()
+
+    def get_text(self, pdf_path, page_nb):
+        """
+        Returns:
+            The text of the page, as returned by Poppler (utf-8 string)
+        """
+        return self.__pool.apply(_get_text, (pdf_path, page_nb))
+
+    def get_text_layout(self, pdf_path, page_nb):
+        """
+        Returns:
+            (text of the page (utf-8 string),
+             [(x1, y1, x2, y2), ...] one rectangle per character of the text
+             or None if Poppler couldn't provide them)
+        """
+        return self.__pool.apply(_get_text_layout, (pdf_path, page_nb))
+
+    def close(self):
+        self.__pool.terminate()
+        self.__pool.join()
+
+
+_renderer_pool = None
+
+
+def start_renderer_pool(nb_workers=None):
+    """
+    Start the renderer pool. Until it is started, the PDF pages are rendered
+    in the calling process.
+    """
+    global _renderer_pool
+    if _renderer_pool is None:
+        _renderer_pool = PdfRendererPool(nb_workers)
+    return _renderer_pool
+
+
+def stop_renderer_pool():
+    global _renderer_pool
+    if _renderer_pool is not None:
+        _renderer_pool.close()
+        _renderer_pool = None
+
+
+def get_renderer_pool():
+    """
+    Returns:
+        The renderer pool, or None if it hasn't been started
+    """
+    return _renderer_pool
@@ -0,0 +1,177 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Image preprocessing done before the OCR. The preprocessed image is only
+given to the OCR tool: the original image is the one kept in the documents,
+and the boxes found by the OCR are converted back to its coordinates.
+"""
+
+import logging
+import time
+
+import PIL.Image
+import PIL.ImageChops
+import PIL.ImageFilter
+import PIL.ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_img_memory(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class OCRPreprocessing(object):
+
+    """
+    Turn an image into something smaller and easier to read for the OCR
+    tool:
+        - downsampling to a resolution good enough for the OCR
+        - grayscale (optional)
+        - adaptive binarization (black text on white, even with uneven
+          lighting) (optional)
+        - trimming of the empty borders (optional)
+    All the steps rely on Pillow's filters (implemented in C).
+
+    Only the downsampling is done by default: the binarization hollows out
+    thick strokes and large text, and so may make the OCR worse.
+    The downsampling is only done if the image says at which resolution it
+    has been scanned.
+    """
+
+    # a pixel is considered black if it is darker than the average of its
+    # neighborhood by at least this much
+    BINARIZATION_OFFSET = 10
+    # size of the neighborhood, relative to the resolution
+    BINARIZATION_RADIUS = 0.05  # inch
+    TRIM_MARGIN = 0.1  # inch
+
+    def __init__(self, target_dpi=300, grayscale=False, binarize=False,
+                 trim=False):
+        self.target_dpi = target_dpi
+        self.grayscale = grayscale or binarize
+        self.binarize = binarize
+        self.trim = trim
+
+    def get_cache_key(self):
+        """
+        Returns a string identifying the preprocessing done. Used to index
+        the OCR results.
+        """
+        return "%d-%d-%d-%d" % (self.target_dpi, self.grayscale,
+                                self.binarize, self.trim)
+
+    @staticmethod
+    def get_dpi(img):
+        """
+        Returns:
+            The resolution at which the image has been scanned, or None if
+            unknown
+        """
+        dpi = img.info.get('dpi')
+        if dpi is not None and dpi[0] >= 72:
+            return dpi[0]
+        return None
+
+    def apply(self, img):
+        """
+        Returns:
+            (preprocessed image, factor, (x offset, y offset))
+            A point (x, y) on the preprocessed image is the point
+            ((x + x offset) / factor, (y + y offset) / factor) on the
+            original image.
+        """
+        start = time.time()
+        src_memory = _get_img_memory(img)
+        src_size = img.size
+        src_mode = img.mode
+
+        dpi = self.get_dpi(img)
+        factor = 1.0
+        offset = (0, 0)
+
+        if self.grayscale and img.mode != "L":
+            img = img.convert("L")
+
+        if dpi is None:
+            logger.info("OCR preprocessing: unknown resolution,"
+                        " image not downsampled")
+            # only used to size the binarization and the trimming
+            dpi = self.target_dpi
+        elif dpi > self.target_dpi * 1.1:
+            factor = float(self.target_dpi) / dpi
+            img = img.resize((int(img.size[0] * factor),
+                              int(img.size[1] * factor)),
+                             PIL.Image.ANTIALIAS)
+            dpi = self.target_dpi
+
+        if self.binarize:
+            radius = max(1, int(dpi * self.BINARIZATION_RADIUS))
+            local_avg = img.filter(PIL.ImageFilter.GaussianBlur(radius))
+            # how much each pixel is darker than its neighborhood
+            darkness = PIL.ImageChops.subtract(local_avg, img)
+            img = darkness.point(
+                lambda x: 0 if x > self.BINARIZATION_OFFSET else 255
+            )
+
+        if self.trim:
+            if self.binarize:
+                content = PIL.ImageOps.invert(img)
+            else:
+                content = PIL.ImageOps.invert(img.convert("L")).point(
+                    lambda x: 255 if x > 128 else 0
+                )
+            bbox = content.getbbox()
+            if bbox is not None:
+                margin = int(dpi * self.TRIM_MARGIN)
+                bbox = (max(0, bbox[0] - margin), max(0, bbox[1] - margin),
+                        min(img.size[0], bbox[2] + margin),
+                        min(img.size[1], bbox[3] + margin))
+                img = img.crop(bbox)
+                offset = (bbox[0], bbox[1])
+
+        stop = time.time()
+        logger.info("OCR preprocessing: %dx%d %s (%dKB) --> %dx%d %s (%dKB)"
+                    " in %dms", src_size[0], src_size[1], src_mode,
+                    src_memory / 1024, img.size[0], img.size[1], img.mode,
+                    _get_img_memory(img) / 1024, (stop - start) * 1000)
+        return (img, factor, offset)
+
+    @staticmethod
+    def __remap_position(position, factor, offset):
+        return (
+            (int((position[0][0] + offset[0]) / factor),
+             int((position[0][1] + offset[1]) / factor)),
+            (int((position[1][0] + offset[0]) / factor),
+             int((position[1][1] + offset[1]) / factor)),
+        )
+
+    def remap_boxes(self, line_boxes, factor, offset):
+        """
+        Convert the positions of the boxes found on the preprocessed image
+        to positions on the original image. Boxes are modified in place.
+        """
+        if factor == 1.0 and offset == (0, 0):
+            return line_boxes
+        for line in line_boxes:
+            line.position = self.__remap_position(line.position, factor,
+                                                  offset)
+            for word in line.word_boxes:
+                word.position = self.__remap_position(word.position, factor,
+                                                      offset)
+        return line_boxes
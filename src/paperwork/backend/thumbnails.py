@@ -0,0 +1,260 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Thumbnails of all the pages of a work directory, stored in a single SQLite
+database. For each page, the thumbnails of all the sizes are generated at
+once, and they are only regenerated when the page changes.
+
+The store is not checked against the page files each time a thumbnail is
+requested. Instead, the code modifying the pages must keep it up-to-date
+(see BasicPage._drop_thumbnails() and ThumbnailStore.move()), and
+the documents modified outside of Paperwork are revalidated when they are
+reindexed (see ThumbnailStore.revalidate()).
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import StringIO
+import threading
+
+import PIL.Image
+
+from paperwork.backend.util import mkdir_p
+
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 85
+
+
+class ThumbnailStore(object):
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, workdir, cachedir=None):
+        if cachedir is None:
+            base_cache_dir = os.getenv(
+                "XDG_CACHE_HOME",
+                os.path.expanduser("~/.cache")
+            )
+            cachedir = os.path.join(base_cache_dir, "paperwork")
+        mkdir_p(cachedir)
+        # one store per work directory
+        workdir_hash = hashlib.sha1(
+            os.path.abspath(workdir).encode("utf-8")
+        ).hexdigest()
+        self.path = os.path.join(cachedir,
+                                 "thumbnails-%s.db" % workdir_hash[:16])
+        self.__lock = threading.Lock()
+        # (docid, page_nb, size name) --> JPEG data
+        self.__preloaded = {}
+
+        # used from the job schedulers threads: access is serialized with
+        # self.__lock
+        self.__db = sqlite3.connect(self.path, check_same_thread=False)
+        self.__db.text_factory = str
+        version = self.__db.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            logger.info("Creating thumbnail store %s", self.path)
+            self.__db.execute("DROP TABLE IF EXISTS thumbnails")
+            self.__db.execute(
+                "CREATE TABLE thumbnails ("
+                " docid TEXT NOT NULL,"
+                " page_nb INTEGER NOT NULL,"
+                " size TEXT NOT NULL,"
+                " src_mtime REAL NOT NULL,"
+                " data BLOB NOT NULL,"
+                " PRIMARY KEY (docid, page_nb, size)"
+                ")"
+            )
+            self.__db.execute("PRAGMA user_version = %d"
+                              % self.SCHEMA_VERSION)
+            self.__db.commit()
+
+    @staticmethod
+    def __encode(img):
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = StringIO.StringIO()
+        try:
+            img.save(output, format="jpeg", quality=JPEG_QUALITY)
+            return output.getvalue()
+        finally:
+            output.close()
+
+    @staticmethod
+    def __decode(data):
+        img = PIL.Image.open(StringIO.StringIO(data))
+        img.load()
+        return img
+
+    def preload(self, size):
+        """
+        Load in memory all the thumbnails of the given size with a single
+        query. Meant to be used before going through the thumbnails of
+        many pages (the document list for instance).
+        Preloaded thumbnails are dropped from memory once they have been
+        requested.
+        """
+        with self.__lock:
+            self.__preloaded = {}
+            cursor = self.__db.execute(
+                "SELECT docid, page_nb, data FROM thumbnails WHERE size = ?",
+                (size,)
+            )
+            for (docid, page_nb, data) in cursor:
+                self.__preloaded[(docid, page_nb, size)] = data
+        logger.info("%d thumbnails preloaded", len(self.__preloaded))
+
+    def get(self, docid, page_nb, size):
+        """
+        Returns:
+            A Pillow image, or None if this thumbnail has never been
+            generated
+        """
+        with self.__lock:
+            data = self.__preloaded.pop((docid, page_nb, size), None)
+            if data is None:
+                row = self.__db.execute(
+                    "SELECT data FROM thumbnails"
+                    " WHERE docid = ? AND page_nb = ? AND size = ?",
+                    (docid, page_nb, size)
+                ).fetchone()
+                if row is None:
+                    return None
+                data = row[0]
+        return self.__decode(data)
+
+    def contains(self, docid, page_nb, size):
+        """
+        Returns:
+            True if this thumbnail has already been generated (without
+            loading it)
+        """
+        with self.__lock:
+            if (docid, page_nb, size) in self.__preloaded:
+                return True
+            row = self.__db.execute(
+                "SELECT 1 FROM thumbnails"
+                " WHERE docid = ? AND page_nb = ? AND size = ?",
+                (docid, page_nb, size)
+            ).fetchone()
+            return row is not None
+
+    def put(self, docid, page_nb, src_mtime, thumbnails):
+        """
+        Arguments:
+            src_mtime --- modification time of the file the thumbnails
+                have been generated from
+            thumbnails --- {size name: Pillow image}
+        """
+        rows = [
+            (docid, page_nb, size, src_mtime,
+             sqlite3.Binary(self.__encode(img)))
+            for (size, img) in thumbnails.iteritems()
+        ]
+        with self.__lock:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO thumbnails"
+                " (docid, page_nb, size, src_mtime, data)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.__db.commit()
+
+    def __drop_preloaded(self, docid, page_nb=None):
+        for key in self.__preloaded.keys():
+            if key[0] == docid and (page_nb is None or key[1] == page_nb):
+                self.__preloaded.pop(key)
+
+    def delete(self, docid, page_nb=None):
+        """
+        Forget the thumbnails of a page, or of a whole document if page_nb
+        is None.
+        """
+        with self.__lock:
+            self.__drop_preloaded(docid, page_nb)
+            if page_nb is None:
+                self.__db.execute("DELETE FROM thumbnails WHERE docid = ?",
+                                  (docid,))
+            else:
+                self.__db.execute(
+                    "DELETE FROM thumbnails WHERE docid = ? AND page_nb = ?",
+                    (docid, page_nb)
+                )
+            self.__db.commit()
+
+    def move(self, docid, page_nb, new_docid, new_page_nb):
+        """
+        Must be called when the files of a page are moved, so its
+        thumbnails remain valid.
+        """
+        with self.__lock:
+            self.__drop_preloaded(docid, page_nb)
+            self.__drop_preloaded(new_docid, new_page_nb)
+            self.__db.execute(
+                "DELETE FROM thumbnails WHERE docid = ? AND page_nb = ?",
+                (new_docid, new_page_nb)
+            )
+            self.__db.execute(
+                "UPDATE thumbnails SET docid = ?, page_nb = ?"
+                " WHERE docid = ? AND page_nb = ?",
+                (new_docid, new_page_nb, docid, page_nb)
+            )
+            self.__db.commit()
+
+    def revalidate(self, doc):
+        """
+        Drop the thumbnails of the pages of the document that have been
+        modified since their thumbnails have been generated (or that
+        don't exist anymore).
+        """
+        with self.__lock:
+            manifest = self.__db.execute(
+                "SELECT DISTINCT page_nb, src_mtime FROM thumbnails"
+                " WHERE docid = ?",
+                (doc.docid,)
+            ).fetchall()
+        nb_pages = doc.nb_pages
+        for (page_nb, src_mtime) in manifest:
+            if page_nb < nb_pages:
+                try:
+                    path = doc.pages[page_nb].get_doc_file_path()
+                    if os.path.getmtime(path) == src_mtime:
+                        continue
+                except OSError:
+                    pass
+            logger.info("Thumbnails of %s p%d are outdated",
+                        doc.docid, page_nb + 1)
+            self.delete(doc.docid, page_nb)
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_thumbnail_store(workdir):
+    """
+    Returns the thumbnail store of the given work directory
+    """
+    workdir = os.path.abspath(workdir)
+    with _STORES_LOCK:
+        if workdir not in _STORES:
+            _STORES[workdir] = ThumbnailStore(workdir)
+        return _STORES[workdir]
@@ -0,0 +1,168 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tile pyramids of the page images, used to display only the visible part of
+the pages when zooming in.
+
+Level 0 of a pyramid is the full-size page image, level 1 is half its size,
+level 2 a quarter of it, etc. Each level is cut in tiles of TILE_SIZE x
+TILE_SIZE pixels, stored in the cache directory. Generating a level means
+decoding the whole page image: it must be done once (see generate_level())
+before its tiles can be read. Afterwards, only the requested tiles are read.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import time
+
+import PIL.Image
+
+from paperwork.backend.util import mkdir_p
+from paperwork.backend.util import rm_rf
+
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+TILE_JPEG_QUALITY = 90
+# number of page pyramids kept in the cache
+MAX_PYRAMIDS = 32
+
+
+def _get_tiles_dir():
+    base_cache_dir = os.getenv(
+        "XDG_CACHE_HOME",
+        os.path.expanduser("~/.cache")
+    )
+    return os.path.join(base_cache_dir, "paperwork", "tiles")
+
+
+def _prune(tiles_dir, max_pyramids=MAX_PYRAMIDS):
+    pyramids = []
+    for dirname in os.listdir(tiles_dir):
+        path = os.path.join(tiles_dir, dirname)
+        try:
+            pyramids.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    if len(pyramids) <= max_pyramids:
+        return
+    pyramids.sort()
+    for (_, path) in pyramids[:len(pyramids) - max_pyramids]:
+        logger.info("Dropping tiles %s", path)
+        rm_rf(path)
+
+
+class TilePyramid(object):
+
+    def __init__(self, page, tiles_dir=None):
+        if tiles_dir is None:
+            tiles_dir = _get_tiles_dir()
+        self.tiles_dir = tiles_dir
+        self.page = page
+        self.size = page.size
+
+        # the pyramid is invalidated by any change of the page file
+        src_path = page.get_doc_file_path()
+        key = "%s|%d|%f|%dx%d" % (src_path, page.page_nb,
+                                  os.path.getmtime(src_path),
+                                  self.size[0], self.size[1])
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        self.path = os.path.join(tiles_dir, hashlib.sha1(key).hexdigest())
+
+    def get_level(self, display_size):
+        """
+        Returns the smallest level at least as big as the given size
+        """
+        scale = float(display_size[0]) / self.size[0]
+        if scale >= 1.0:
+            return 0
+        return int(math.floor(math.log(1.0 / scale, 2)))
+
+    def get_level_size(self, level):
+        factor = 2 ** level
+        return (int(math.ceil(float(self.size[0]) / factor)),
+                int(math.ceil(float(self.size[1]) / factor)))
+
+    def get_nb_tiles(self, level):
+        """
+        Returns:
+            (nb columns, nb lines)
+        """
+        level_size = self.get_level_size(level)
+        return (int(math.ceil(float(level_size[0]) / TILE_SIZE)),
+                int(math.ceil(float(level_size[1]) / TILE_SIZE)))
+
+    def __get_level_path(self, level):
+        return os.path.join(self.path, str(level))
+
+    def has_level(self, level):
+        return os.path.exists(self.__get_level_path(level))
+
+    def generate_level(self, level):
+        """
+        Cut the page image in tiles at the given level, if it hasn't been
+        done yet. Slow: the whole page image is decoded.
+        """
+        if self.has_level(level):
+            return
+        start = time.time()
+        level_size = self.get_level_size(level)
+        img = self.page.get_image(level_size)
+        if img.size != level_size:
+            img = img.resize(level_size, PIL.Image.ANTIALIAS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        level_path = self.__get_level_path(level)
+        # the level becomes visible once all its tiles have been written
+        tmp_path = level_path + ".new"
+        if os.path.exists(tmp_path):
+            rm_rf(tmp_path)
+        mkdir_p(tmp_path)
+        (nb_columns, nb_lines) = self.get_nb_tiles(level)
+        for y in xrange(0, nb_lines):
+            for x in xrange(0, nb_columns):
+                tile = img.crop((
+                    x * TILE_SIZE, y * TILE_SIZE,
+                    min((x + 1) * TILE_SIZE, level_size[0]),
+                    min((y + 1) * TILE_SIZE, level_size[1]),
+                ))
+                tile.save(os.path.join(tmp_path, "%d_%d.jpg" % (x, y)),
+                          format="jpeg", quality=TILE_JPEG_QUALITY)
+        os.rename(tmp_path, level_path)
+        os.utime(self.path, None)
+        stop = time.time()
+        logger.info("%s: level %d (%dx%d, %d tiles) generated in %dms",
+                    self.page, level, level_size[0], level_size[1],
+                    nb_columns * nb_lines, (stop - start) * 1000)
+        _prune(self.tiles_dir)
+
+    def get_tile(self, level, x, y):
+        """
+        Returns:
+            The Pillow image of the tile. The tiles on the right and
+            bottom borders may be smaller than TILE_SIZE x TILE_SIZE.
+            The level must have been generated (see generate_level()).
+        """
+        level_path = self.__get_level_path(level)
+        img = PIL.Image.open(os.path.join(level_path, "%d_%d.jpg" % (x, y)))
+        img.load()
+        return img
@@ -14,11 +14,12 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>
 
-import array
+import collections
 import errno
 import logging
 import os
 import re
+import sys
 import threading
 import unicodedata
 
@@ -104,11 +105,100 @@ def dummy_progress_cb(progression, total, step=None, doc=None):
     pass
 
 
-_ENCHANT_LOCK = threading.Lock()
 _MAX_LEVENSHTEIN_DISTANCE = 1
 _MIN_WORD_LEN = 4
 
 
+class _WordCache(object):
+    """
+    Thread-safe LRU cache of the spell checking of single words.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+        self.__words = collections.OrderedDict()
+
+    def get(self, key):
+        with self.__lock:
+            value = self.__words.pop(key, None)
+            if value is not None:
+                self.__words[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__words.pop(key, None)
+            self.__words[key] = value
+            if len(self.__words) > self.max_size:
+                self.__words.popitem(last=False)
+
+
+# (lang, word) --> (score, replacement or None)
+_SPELLING_CACHE = _WordCache(20000)
+
+
+class _SpellingDictPool(object):
+    """
+    Thread-safe pool of dictionaries and tokenizers. A dictionary is only
+    used by one thread at a time, but it is given back to the pool once
+    done: the threads doing the OCR are short-lived, the dictionaries are
+    not.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__free = {}  # lang --> [(dictionary, tokenizer), ...]
+
+    def checkout(self, spelling_lang):
+        """
+        Returns:
+            (dictionary, tokenizer) for the given language. Must be given
+            back with checkin() once done.
+        """
+        with self.__lock:
+            free = self.__free.get(spelling_lang)
+            if free:
+                return free.pop()
+            # the creation of dictionaries is not thread-safe
+            words_dict = enchant.request_dict(spelling_lang)
+        try:
+            tknzr = enchant.tokenize.get_tokenizer(spelling_lang)
+        except enchant.tokenize.TokenizerNotFoundError:
+            # Fall back to default tokenization if no match for 'lang'
+            tknzr = enchant.tokenize.get_tokenizer()
+        return (words_dict, tknzr)
+
+    def checkin(self, spelling_lang, entry):
+        with self.__lock:
+            self.__free.setdefault(spelling_lang, []).append(entry)
+
+
+_SPELLING_DICTS = _SpellingDictPool()
+
+
+def _check_word_spelling(words_dict, word):
+    """
+    Returns:
+        A tuple: (score, replacement or None)
+    """
+    if words_dict.check(word):
+        # immediately correct words are a really good hint for
+        # orientation
+        return (100, None)
+    suggestions = words_dict.suggest(word)
+    if (len(suggestions) <= 0):
+        # this word is useless. It may even indicates a bad orientation
+        return (-10, None)
+    main_suggestion = suggestions[0]
+    lv_dist = Levenshtein.distance(word, main_suggestion)
+    if (lv_dist > _MAX_LEVENSHTEIN_DISTANCE):
+        # hm, this word looks like it's in a bad shape
+        return (0, None)
+    # fixed words may be a good hint for orientation
+    return (5, main_suggestion)
+
+
 def check_spelling(spelling_lang, txt):
     """
     Check the spelling in the text, and compute a score. The score is the
@@ -116,57 +206,46 @@ def check_spelling(spelling_lang, txt):
     of mispelled words. Words "almost" correct remains neutral (-> are not
     included in the score)
 
+    Can be called from many threads at the same time.
+
     Returns:
         A tuple : (fixed text, score)
     """
-    _ENCHANT_LOCK.acquire()
+    entry = _SPELLING_DICTS.checkout(spelling_lang)
     try:
-        # Maximum distance from the first suggestion from python-enchant
-
-        words_dict = enchant.request_dict(spelling_lang)
-        try:
-            tknzr = enchant.tokenize.get_tokenizer(spelling_lang)
-        except enchant.tokenize.TokenizerNotFoundError:
-            # Fall back to default tokenization if no match for 'lang'
-            tknzr = enchant.tokenize.get_tokenizer()
+        return _check_spelling(spelling_lang, entry, txt)
+    finally:
+        _SPELLING_DICTS.checkin(spelling_lang, entry)
 
-        score = 0
-        offset = 0
-        for (word, word_pos) in tknzr(txt):
-            if len(word) < _MIN_WORD_LEN:
-                continue
-            if words_dict.check(word):
-                # immediately correct words are a really good hint for
-                # orientation
-                score += 100
-                continue
-            suggestions = words_dict.suggest(word)
-            if (len(suggestions) <= 0):
-                # this word is useless. It may even indicates a bad orientation
-                score -= 10
-                continue
-            main_suggestion = suggestions[0]
-            lv_dist = Levenshtein.distance(word, main_suggestion)
-            if (lv_dist > _MAX_LEVENSHTEIN_DISTANCE):
-                # hm, this word looks like it's in a bad shape
-                continue
 
-            logger.debug("Spell checking: Replacing: %s -> %s",
-                         word, main_suggestion)
+def _check_spelling(spelling_lang, entry, txt):
+    (words_dict, tknzr) = entry
 
-            # let's replace the word by its suggestion
+    score = 0
+    fixed_txt = []
+    last_pos = 0
+    for (word, word_pos) in tknzr(txt):
+        if len(word) < _MIN_WORD_LEN:
+            continue
+        result = _SPELLING_CACHE.get((spelling_lang, word))
+        if result is None:
+            result = _check_word_spelling(words_dict, word)
+            _SPELLING_CACHE.put((spelling_lang, word), result)
+        (word_score, replacement) = result
+        score += word_score
+        if replacement is None:
+            continue
 
-            pre_txt = txt[:word_pos + offset]
-            post_txt = txt[word_pos + len(word) + offset:]
-            txt = pre_txt + main_suggestion + post_txt
-            offset += (len(main_suggestion) - len(word))
+        logger.debug("Spell checking: Replacing: %s -> %s",
+                     word, replacement)
 
-            # fixed words may be a good hint for orientation
-            score += 5
+        # let's replace the word by its suggestion
+        fixed_txt.append(txt[last_pos:word_pos])
+        fixed_txt.append(replacement)
+        last_pos = word_pos + len(word)
 
-        return (txt, score)
-    finally:
-        _ENCHANT_LOCK.release()
+    fixed_txt.append(txt[last_pos:])
+    return ("".join(fixed_txt), score)
 
 
 def mkdir_p(path):
@@ -204,19 +283,35 @@ def rm_rf(path):
             logger.exception("Could not remove directory: %s", path)
 
 
+# Cairo stores its pixels as native-endian 32 bits integers
+if sys.byteorder == "little":
+    _CAIRO_RGB24_RAWMODE = "BGRX"
+    _CAIRO_ARGB32_RAWMODE = "BGRA"
+else:
+    _CAIRO_RGB24_RAWMODE = "XRGB"
+    _CAIRO_ARGB32_RAWMODE = "ARGB"
+
+
 def surface2image(surface):
     """
     Convert a cairo surface into a PIL image
     """
+    import cairo
     import PIL.Image
-    import PIL.ImageDraw
 
     if surface is None:
         return None
+    surface.flush()
     dimension = (surface.get_width(), surface.get_height())
-    img = PIL.Image.frombuffer("RGBA", dimension,
-                               surface.get_data(), "raw", "BGRA", 0, 1)
-
+    if surface.get_format() == cairo.FORMAT_RGB24:
+        # opaque: the pixels are unpacked once, no compositing required
+        return PIL.Image.frombuffer("RGB", dimension, surface.get_data(),
+                                    "raw", _CAIRO_RGB24_RAWMODE,
+                                    surface.get_stride(), 1)
+
+    img = PIL.Image.frombuffer("RGBA", dimension, surface.get_data(),
+                               "raw", _CAIRO_ARGB32_RAWMODE,
+                               surface.get_stride(), 1)
     background = PIL.Image.new("RGB", img.size, (255, 255, 255))
     background.paste(img, mask=img.split()[3])  # 3 is the alpha channel
     return background
@@ -224,14 +319,19 @@ def surface2image(surface):
 
 def image2surface(img):
     """
-    Convert a PIL image into a Cairo surface
+    Convert a PIL image into a Cairo surface (opaque)
+
+    The pixels are packed once by Pillow directly in the Cairo format
+    (without alpha channel), and copied once in the memory of the surface.
+    The image is not modified.
     """
     import cairo
 
-    img.putalpha(256)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
     (width, height) = img.size
-    imgd = img.tobytes('raw', 'BGRA')
-    imga = array.array('B', imgd)
-    stride = width * 4
+    stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_RGB24,
+                                                        width)
+    data = bytearray(img.tobytes('raw', _CAIRO_RGB24_RAWMODE, stride))
     return cairo.ImageSurface.create_for_data(
-        imga, cairo.FORMAT_ARGB32, width, height, stride)
+        data, cairo.FORMAT_RGB24, width, height, stride)
@@ -37,6 +37,9 @@ from paperwork.frontend.mainwindow.pages import PageDrawer
 from paperwork.frontend.mainwindow.pages import PageDropHandler
 from paperwork.frontend.mainwindow.pages import JobFactoryPageBoxesLoader
 from paperwork.frontend.mainwindow.pages import JobFactoryPageImgLoader
+from paperwork.frontend.mainwindow.pages import JobFactoryPagePrefetcher
+from paperwork.frontend.mainwindow.pages import JobFactoryPageTilesGenerator
+from paperwork.frontend.mainwindow.pages import JobFactoryPageTilesLoader
 from paperwork.frontend.mainwindow.scan import ScanWorkflow
 from paperwork.frontend.mainwindow.scan import MultiAnglesScanWorkflowDrawer
 from paperwork.frontend.mainwindow.scan import SingleAngleScanWorkflowDrawer
@@ -64,6 +67,7 @@ from paperwork.backend.common.page import DummyPage
 from paperwork.backend.docsearch import DocSearch
 from paperwork.backend.docsearch import DummyDocSearch
 from paperwork.backend.labels import LabelStorage
+from paperwork.backend.ocr import BatchOCR
 
 
 _ = gettext.gettext
@@ -474,6 +478,97 @@ class JobFactoryIndexUpdater(JobFactory):
         return job
 
 
+class JobBatchOCR(Job):
+    """
+    Redo the OCR on all the pages of the given documents
+    """
+
+    __gsignals__ = {
+        'batch-ocr-start': (GObject.SignalFlags.RUN_LAST, None, ()),
+        'batch-ocr-progression': (GObject.SignalFlags.RUN_LAST, None,
+                                  (GObject.TYPE_FLOAT,
+                                   GObject.TYPE_STRING)),
+        'batch-ocr-end': (GObject.SignalFlags.RUN_LAST, None,
+                          # documents updated
+                          (GObject.TYPE_PYOBJECT, )),
+    }
+
+    can_stop = True
+    priority = 3  # lower than the OCR of freshly scanned pages
+
+    def __init__(self, factory, id, config, docs, checkpoint_path=None):
+        Job.__init__(self, factory, id)
+        self.__config = config
+        self.docs = docs
+        self.checkpoint_path = checkpoint_path
+        self.batch = None
+        self.will_resume = False
+
+    def __progress_cb(self, progression, total, step=None, page=None):
+        txt = _("Redoing OCR (%d/%d, %.1f pages/s)") % (
+            progression, total, self.batch.throughput
+        )
+        eta = self.batch.eta
+        if eta is not None:
+            txt += " - " + (_("%dh%02dm left") % (eta / 3600,
+                                                   (eta % 3600) / 60))
+        self.emit('batch-ocr-progression', float(progression) / total, txt)
+
+    def do(self):
+        # keep in mind that we may have been interrupted and then called back
+        # later
+        self.will_resume = False
+        if self.batch is None:
+            self.emit('batch-ocr-start')
+            nb_pages = 0
+            for doc in self.docs:
+                nb_pages += doc.nb_pages
+            pages = (page for doc in self.docs for page in doc.pages)
+            self.batch = BatchOCR(
+                pages, self.__config['langs'].value,
+                nb_pages=max(1, nb_pages),
+                checkpoint_path=self.checkpoint_path,
+                preprocessing=self.__config['ocr_preprocessing'].value
+            )
+
+        self.batch.run(progress_cb=self.__progress_cb)
+        if self.will_resume:
+            return
+        self.emit('batch-ocr-end', self.batch.docs)
+
+    def stop(self, will_resume=False):
+        self.will_resume = will_resume
+        if self.batch is not None:
+            self.batch.stop()
+
+
+GObject.type_register(JobBatchOCR)
+
+
+class JobFactoryBatchOCR(JobFactory):
+    def __init__(self, main_win, config):
+        JobFactory.__init__(self, "BatchOCR")
+        self.__main_win = main_win
+        self.__config = config
+
+    def make(self, docs, checkpoint_path=None):
+        job = JobBatchOCR(self, next(self.id_generator), self.__config,
+                          docs, checkpoint_path)
+        job.connect('batch-ocr-start',
+                    lambda job:
+                    GLib.idle_add(self.__main_win.set_progression, job,
+                                  0.0, _("Redoing OCR ...")))
+        job.connect('batch-ocr-progression',
+                    lambda job, progression, txt:
+                    GLib.idle_add(self.__main_win.set_progression, job,
+                                  progression, txt))
+        job.connect('batch-ocr-end',
+                    lambda job, docs:
+                    GLib.idle_add(self.__main_win.on_redo_ocr_end_cb, job,
+                                  docs))
+        return job
+
+
 class JobDocSearcher(Job):
     """
     Search the documents
@@ -1540,41 +1635,54 @@ class ActionRedoOCR(SimpleAction):
         self._do_next_page(pages_iterator)
 
 
-class AllPagesIterator(object):
-    def __init__(self, docsearch):
-        self.__doc_iter = iter(docsearch.docs)
-        doc = self.__doc_iter.next()
-        self.__page_iter = iter(doc.pages)
+class ActionBatchRedoOCR(SimpleAction):
+    """
+    Redo the OCR of whole documents in the background, using all the
+    processors/cores available.
+    """
+    def __init__(self, name, main_window):
+        SimpleAction.__init__(self, name)
+        self._main_win = main_window
 
-    def __iter__(self):
-        return self
+    def _get_docs(self):
+        raise NotImplementedError()
 
-    def next(self):
-        while True:
-            try:
-                return next(self.__page_iter)
-            except StopIteration:
-                doc = next(self.__doc_iter)
-                self.__page_iter = iter(doc.pages)
+    def _get_checkpoint_path(self):
+        return None
+
+    def do(self):
+        if not ask_confirmation(self._main_win.window):
+            return
+        SimpleAction.do(self)
+        job = self._main_win.job_factories['batch_ocr'].make(
+            self._get_docs(), self._get_checkpoint_path())
+        self._main_win.schedulers['ocr'].schedule(job)
 
 
-class ActionRedoAllOCR(ActionRedoOCR):
+class ActionRedoAllOCR(ActionBatchRedoOCR):
     def __init__(self, main_window):
-        ActionRedoOCR.__init__(self, "Redoing all ocr", main_window)
+        ActionBatchRedoOCR.__init__(self, "Redoing all ocr", main_window)
 
-    def do(self):
-        docsearch = self._main_win.docsearch
-        all_page_iter = AllPagesIterator(docsearch)
-        ActionRedoOCR.do(self, all_page_iter)
+    def _get_docs(self):
+        return list(self._main_win.docsearch.docs)
+
+    def _get_checkpoint_path(self):
+        # if interrupted (Paperwork closed, etc), the next run will resume
+        # where this one stopped
+        base_data_dir = os.getenv(
+            "XDG_DATA_HOME",
+            os.path.expanduser("~/.local/share")
+        )
+        return os.path.join(base_data_dir, "paperwork",
+                            "redo_ocr_all.checkpoint")
 
 
-class ActionRedoDocOCR(ActionRedoOCR):
+class ActionRedoDocOCR(ActionBatchRedoOCR):
     def __init__(self, main_window):
-        ActionRedoOCR.__init__(self, "Redoing doc ocr", main_window)
+        ActionBatchRedoOCR.__init__(self, "Redoing doc ocr", main_window)
 
-    def do(self):
-        doc = self._main_win.doc
-        ActionRedoOCR.do(self, iter(doc.pages))
+    def _get_docs(self):
+        return [self._main_win.doc]
 
 
 class ActionRedoPageOCR(ActionRedoOCR):
@@ -1915,6 +2023,9 @@ class ActionRefreshIndex(SimpleAction):
 
 
 class MainWindow(object):
+    # pages loaded in advance in the scrolling direction
+    PREFETCH_NB_PAGES = 3
+
     def __init__(self, config):
         self.app = self.__init_app()
         gactions = self.__init_gactions(self.app)
@@ -1951,6 +2062,9 @@ class MainWindow(object):
         self.page_drawers = []
         self.layout = "grid"
         self.scan_drawers = {}  # docid --> {page_nb: extra drawer}
+        # vertical position of the canvas and scrolling direction (1 or -1)
+        self.__last_img_position = 0
+        self.__img_scroll_direction = 1
 
         search_completion = Gtk.EntryCompletion()
         self.last_date = None
@@ -2094,6 +2208,7 @@ class MainWindow(object):
         }
 
         self.job_factories = {
+            'batch_ocr': JobFactoryBatchOCR(self, config),
             'doc_examiner': JobFactoryDocExaminer(self, config),
             'doc_searcher': JobFactoryDocSearcher(self, config),
             'export_previewer': JobFactoryExportPreviewer(self),
@@ -2105,6 +2220,9 @@ class MainWindow(object):
             ),
             'page_img_renderer': JobFactoryPageImgRenderer(),
             'page_img_loader': JobFactoryPageImgLoader(),
+            'page_prefetcher': JobFactoryPagePrefetcher(),
+            'page_tiles_generator': JobFactoryPageTilesGenerator(),
+            'page_tiles_loader': JobFactoryPageTilesLoader(),
             'page_boxes_loader': JobFactoryPageBoxesLoader(),
         }
 
@@ -2405,6 +2523,7 @@ class MainWindow(object):
             'main': JobScheduler("Main"),
             'ocr': JobScheduler("OCR"),
             'page_boxes_loader': JobScheduler("Page boxes loader"),
+            'page_tiles_generator': JobScheduler("Page tiles generator"),
             'progress': JobScheduler("Progress"),
             'scan': JobScheduler("Scan"),
             'index': JobScheduler("Index search / update"),
@@ -2545,8 +2664,15 @@ class MainWindow(object):
         self.img['boxes']['highlighted'] = []
         self.img['boxes']['visible'] = []
 
-    def on_redo_ocr_end_cb(self, src):
-        pass
+    def on_redo_ocr_end_cb(self, src, docs):
+        self.set_progression(src, 0.0, None)
+        if len(docs) <= 0:
+            return
+        if self.doc in docs:
+            self.show_doc(self.doc, force_refresh=True)
+        job = self.job_factories['index_updater'].make(
+            self.docsearch, upd_docs=set(docs), optimize=False)
+        self.schedulers['index'].schedule(job)
 
     def __popup_menu_cb(self, ev_component, event, ui_component, popup_menu):
         # we are only interested in right clicks
@@ -2584,6 +2710,15 @@ class MainWindow(object):
             self.job_factories['page_img_loader']
         )
         self.schedulers['main'].cancel_all(
+            self.job_factories['page_prefetcher']
+        )
+        self.schedulers['main'].cancel_all(
+            self.job_factories['page_tiles_loader']
+        )
+        self.schedulers['page_tiles_generator'].cancel_all(
+            self.job_factories['page_tiles_generator']
+        )
+        self.schedulers['page_boxes_loader'].cancel_all(
             self.job_factories['page_boxes_loader']
         )
 
@@ -2637,6 +2772,15 @@ class MainWindow(object):
             self.job_factories['page_img_loader']
         )
         self.schedulers['main'].cancel_all(
+            self.job_factories['page_prefetcher']
+        )
+        self.schedulers['main'].cancel_all(
+            self.job_factories['page_tiles_loader']
+        )
+        self.schedulers['page_tiles_generator'].cancel_all(
+            self.job_factories['page_tiles_generator']
+        )
+        self.schedulers['page_boxes_loader'].cancel_all(
             self.job_factories['page_boxes_loader']
         )
 
@@ -2646,10 +2790,17 @@ class MainWindow(object):
 
         factories = {
             'page_img_loader': self.job_factories['page_img_loader'],
+            'page_prefetcher': self.job_factories['page_prefetcher'],
+            'page_tiles_generator':
+                self.job_factories['page_tiles_generator'],
+            'page_tiles_loader': self.job_factories['page_tiles_loader'],
             'page_boxes_loader': self.job_factories['page_boxes_loader']
         }
         schedulers = {
             'page_img_loader': self.schedulers['main'],
+            'page_prefetcher': self.schedulers['main'],
+            'page_tiles_generator': self.schedulers['page_tiles_generator'],
+            'page_tiles_loader': self.schedulers['main'],
             'page_boxes_loader': self.schedulers['page_boxes_loader'],
         }
 
@@ -2687,7 +2838,7 @@ class MainWindow(object):
             self.page_drawers.append(drawer)
             self.img['canvas'].add_drawer(drawer)
 
-        for drawer in scan_drawers.values():
+        for (page_nb, drawer) in sorted(scan_drawers.items()):
             # remaining scan drawers ("scan new page", etc)
             drawer.previous_drawer = previous_drawer
             drawer.relocate()
@@ -3021,12 +3172,37 @@ class MainWindow(object):
             return
         if not hasattr(drawer, 'page'):
             return
+        self.__prefetch_pages(drawer)
         page = drawer.page
         if page is None:
             set_widget_state(self.need_page_widgets, False)
             return
         self.__select_page(page)
 
+    def __prefetch_pages(self, current_drawer):
+        """
+        Load in the surface cache the pages following the current one in
+        the scrolling direction
+        """
+        position = self.img['canvas'].position[1]
+        if position != self.__last_img_position:
+            self.__img_scroll_direction = (
+                1 if position > self.__last_img_position else -1
+            )
+            self.__last_img_position = position
+
+        if current_drawer not in self.page_drawers:
+            return
+        # pages already visible are ignored by PageDrawer.prefetch()
+        idx = self.page_drawers.index(current_drawer)
+        for offset in xrange(1, self.PREFETCH_NB_PAGES + 1):
+            prefetch_idx = idx + (offset * self.__img_scroll_direction)
+            if prefetch_idx < 0 or prefetch_idx >= len(self.page_drawers):
+                return
+            drawer = self.page_drawers[prefetch_idx]
+            if isinstance(drawer, PageDrawer):
+                drawer.prefetch()
+
     def make_scan_workflow(self):
         return ScanWorkflow(self.__config,
                             self.schedulers['scan'],
@@ -3,6 +3,7 @@ import datetime
 from functools import partial
 import gettext
 import logging
+import os
 
 from gi.repository import GLib
 from gi.repository import GObject
@@ -14,6 +15,7 @@ from paperwork.backend.common.doc import BasicDoc
 from paperwork.backend.common.page import BasicPage
 from paperwork.backend.img.doc import ImgDoc
 from paperwork.backend.labels import Label
+from paperwork.backend.thumbnails import get_thumbnail_store
 from paperwork.frontend.labeleditor import LabelEditor
 from paperwork.frontend.util import connect_actions
 from paperwork.frontend.util.actions import SimpleAction
@@ -58,8 +60,13 @@ class JobDocThumbnailer(Job):
     can_stop = True
     priority = 20
 
-    SMALL_THUMBNAIL_WIDTH = 64
-    SMALL_THUMBNAIL_HEIGHT = 80
+    SMALL_THUMBNAIL_WIDTH = BasicPage.THUMB_SIZES['doclist'][0]
+    SMALL_THUMBNAIL_HEIGHT = BasicPage.THUMB_SIZES['doclist'][1]
+
+    MIN_DOCS_FOR_PRELOAD = 20
+    # documents whose thumbnail is requested in advance, so several of them
+    # can be rendered at the same time (see BasicPage.prefetch_thumbnail())
+    NB_DOCS_PREFETCHED = 8
 
     def __init__(self, factory, id, doclist):
         Job.__init__(self, factory, id)
@@ -84,6 +91,15 @@ class JobDocThumbnailer(Job):
             img = new_img
         return img
 
+    def __prefetch(self, idx):
+        if idx >= len(self.__doclist):
+            return
+        doc = self.__doclist[idx]
+        if doc.nb_pages <= 0:
+            return
+        doc.pages[0].prefetch_thumbnail(self.SMALL_THUMBNAIL_WIDTH,
+                                        self.SMALL_THUMBNAIL_HEIGHT)
+
     def do(self):
         self.can_run = True
         if self.__current_idx >= len(self.__doclist):
@@ -94,16 +110,23 @@ class JobDocThumbnailer(Job):
         if self.__current_idx < 0:
             self.emit('doc-thumbnailing-start')
             self.__current_idx = 0
+            if len(self.__doclist) >= self.MIN_DOCS_FOR_PRELOAD:
+                # a single read for all the thumbnails of the list
+                workdir = os.path.dirname(self.__doclist[0].path)
+                get_thumbnail_store(workdir).preload('doclist')
+
+        for idx in xrange(self.__current_idx,
+                          self.__current_idx + self.NB_DOCS_PREFETCHED - 1):
+            self.__prefetch(idx)
 
         for idx in xrange(self.__current_idx, len(self.__doclist)):
+            self.__prefetch(idx + self.NB_DOCS_PREFETCHED - 1)
             doc = self.__doclist[idx]
             if doc.nb_pages <= 0:
                 continue
 
-            # always request the same size, even for small thumbnails
-            # so we don't invalidate cache + previous thumbnails
-            img = doc.pages[0].get_thumbnail(BasicPage.DEFAULT_THUMB_WIDTH,
-                                             BasicPage.DEFAULT_THUMB_HEIGHT)
+            img = doc.pages[0].get_thumbnail(self.SMALL_THUMBNAIL_WIDTH,
+                                             self.SMALL_THUMBNAIL_HEIGHT)
             if not self.can_run:
                 return
 
@@ -14,8 +14,10 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import logging
 import math
+import os
 import threading
 
 import gettext
@@ -29,10 +31,14 @@ from gi.repository import PangoCairo
 import PIL.Image
 
 from paperwork.backend.common.page import BasicPage
+from paperwork.backend.tiles import TILE_SIZE
+from paperwork.backend.tiles import TilePyramid
 from paperwork.backend.util import image2surface
 from paperwork.backend.util import split_words
 from paperwork.frontend.util.canvas.animations import SpinnerAnimation
 from paperwork.frontend.util.canvas.drawers import Drawer
+from paperwork.frontend.util.canvas.grid import SpatialGrid
+from paperwork.frontend.util.canvas.surfacecache import get_surface_cache
 from paperwork.frontend.util.imgcutting import ImgGripHandler
 from paperwork.frontend.util.jobs import Job
 from paperwork.frontend.util.jobs import JobFactory
@@ -42,6 +48,33 @@ _ = gettext.gettext
 logger = logging.getLogger(__name__)
 
 
+def get_surface_key(page, size):
+    """
+    Returns:
+        The key of the surface of the page at the given size in the surface
+        cache. It changes when the file the page is loaded from is modified
+        or replaced.
+    """
+    # page.id is only a position in the document: when a page is deleted or
+    # moved, the files of the next ones are renamed (mtimes are kept), so
+    # the file itself (inode) must be part of the key too
+    path = page.get_doc_file_path()
+    try:
+        stat = os.stat(path)
+        file_id = (stat.st_ino, stat.st_mtime, stat.st_size)
+    except OSError:
+        file_id = None
+    return (page.id, path, file_id, tuple(size))
+
+
+def use_thumbnail(size):
+    """
+    Returns:
+        True if the page can be displayed at this size from its thumbnail
+    """
+    return size[1] <= (BasicPage.THUMB_SIZES['preview'][1] * 1.5)
+
+
 class JobPageImgLoader(Job):
     can_stop = True
     priority = 500
@@ -72,30 +105,40 @@ class JobPageImgLoader(Job):
             if not self.can_run:
                 return
 
-            use_thumbnail = True
-            if self.size[1] > (BasicPage.DEFAULT_THUMB_HEIGHT * 1.5):
-                use_thumbnail = False
-            if not self.can_run:
-                return
-            if not use_thumbnail:
-                img = self.page.img
-            else:
-                img = self.page.get_thumbnail(BasicPage.DEFAULT_THUMB_WIDTH,
-                                              BasicPage.DEFAULT_THUMB_HEIGHT)
-            if not self.can_run:
-                return
-            if self.size != img.size:
-                img = img.resize(self.size, PIL.Image.ANTIALIAS)
-            if not self.can_run:
-                return
-            img.load()
-            if not self.can_run:
-                return
-            self.emit('page-loading-img', image2surface(img))
+            cache = get_surface_cache()
+            key = get_surface_key(self.page, self.size)
+            surface = cache.get(key)
+            if surface is None:
+                surface = self.__load_surface()
+                if surface is None:
+                    return
+                cache.put(key, surface)
+            self.emit('page-loading-img', surface)
 
         finally:
             self.emit('page-loading-done')
 
+    def __load_surface(self):
+        """
+        Returns:
+            The surface of the page, or None if the job has been stopped
+        """
+        if not self.can_run:
+            return None
+        if not use_thumbnail(self.size):
+            return self.page.get_surface(self.size)
+        img = self.page.get_thumbnail(self.size[0], self.size[1])
+        if not self.can_run:
+            return None
+        if self.size != img.size:
+            img = img.resize(self.size, PIL.Image.ANTIALIAS)
+        if not self.can_run:
+            return None
+        img.load()
+        if not self.can_run:
+            return None
+        return image2surface(img)
+
     def stop(self, will_resume=False):
         self.__cond.acquire()
         try:
@@ -115,6 +158,8 @@ class JobFactoryPageImgLoader(JobFactory):
 
     def make(self, drawer, page, size):
         job = JobPageImgLoader(self, next(self.id_generator), page, size)
+        # only the latest request for a given drawer matters
+        job.key = drawer
         job.connect('page-loading-img',
                     lambda job, img:
                     GLib.idle_add(drawer.on_page_loading_img,
@@ -126,15 +171,144 @@ class JobFactoryPageImgLoader(JobFactory):
         return job
 
 
+class JobPagePrefetcher(JobPageImgLoader):
+
+    """
+    Load the surface of a page that is not visible yet (but will probably
+    be soon) in the surface cache
+    """
+
+    # lower than anything else
+    priority = 1
+
+
+GObject.type_register(JobPagePrefetcher)
+
+
+class JobFactoryPagePrefetcher(JobFactory):
+
+    def __init__(self):
+        JobFactory.__init__(self, "PagePrefetcher")
+
+    def make(self, drawer, page, size):
+        job = JobPagePrefetcher(self, next(self.id_generator), page, size)
+        job.key = drawer
+        # nothing to tell the drawer: it will find the surface in the cache
+        return job
+
+
+class JobPageTilesLoader(Job):
+    can_stop = True
+    priority = 500
+
+    __gsignals__ = {
+        'page-loading-tile': (GObject.SignalFlags.RUN_LAST, None,
+                              (
+                                  GObject.TYPE_INT,  # level
+                                  GObject.TYPE_INT,  # x
+                                  GObject.TYPE_INT,  # y
+                                  GObject.TYPE_PYOBJECT,  # surface
+                              )),
+    }
+
+    def __init__(self, factory, job_id, pyramid, level, tiles):
+        Job.__init__(self, factory, job_id)
+        self.pyramid = pyramid
+        self.level = level
+        self.tiles = tiles
+
+    def do(self):
+        self.can_run = True
+        for (x, y) in self.tiles:
+            if not self.can_run:
+                return
+            img = self.pyramid.get_tile(self.level, x, y)
+            self.emit('page-loading-tile', self.level, x, y,
+                      image2surface(img))
+
+    def stop(self, will_resume=False):
+        self.can_run = False
+
+
+GObject.type_register(JobPageTilesLoader)
+
+
+class JobFactoryPageTilesLoader(JobFactory):
+
+    def __init__(self):
+        JobFactory.__init__(self, "PageTilesLoader")
+
+    def make(self, drawer, pyramid, level, tiles):
+        job = JobPageTilesLoader(self, next(self.id_generator), pyramid,
+                                 level, tiles)
+        # only the tiles currently visible matter
+        job.key = drawer
+        job.connect('page-loading-tile',
+                    lambda job, level, x, y, surface:
+                    GLib.idle_add(drawer.on_page_loading_tile,
+                                  level, x, y, surface))
+        return job
+
+
+class JobPageTilesGenerator(Job):
+
+    """
+    Cut a page in tiles at a given level of its tile pyramid (see
+    TilePyramid.generate_level())
+    """
+
+    can_stop = False
+    # the page is displayed zoomed out meanwhile
+    priority = 1
+
+    __gsignals__ = {
+        'page-tiles-generated': (GObject.SignalFlags.RUN_LAST, None,
+                                 (GObject.TYPE_INT,)),  # level
+    }
+
+    def __init__(self, factory, job_id, pyramid, level):
+        Job.__init__(self, factory, job_id)
+        self.pyramid = pyramid
+        self.level = level
+
+    def do(self):
+        self.pyramid.generate_level(self.level)
+        self.emit('page-tiles-generated', self.level)
+
+
+GObject.type_register(JobPageTilesGenerator)
+
+
+class JobFactoryPageTilesGenerator(JobFactory):
+
+    def __init__(self):
+        JobFactory.__init__(self, "PageTilesGenerator")
+
+    def make(self, drawer, pyramid, level):
+        job = JobPageTilesGenerator(self, next(self.id_generator), pyramid,
+                                    level)
+        # only the level matching the current zoom matters
+        job.key = drawer
+        job.connect('page-tiles-generated',
+                    lambda job, level:
+                    GLib.idle_add(drawer.on_page_tiles_generated, level))
+        return job
+
+
 class JobPageBoxesLoader(Job):
     can_stop = True
     priority = 100
 
+    # in pixels of the page image (a word is usually smaller)
+    BOX_GRID_CELL_SIZE = 128
+
     __gsignals__ = {
         'page-loading-start': (GObject.SignalFlags.RUN_LAST, None, ()),
         'page-loading-boxes': (GObject.SignalFlags.RUN_LAST, None,
                                (
                                    GObject.TYPE_PYOBJECT,  # all boxes
+                                   GObject.TYPE_PYOBJECT,  # box index
+                                   GObject.TYPE_PYOBJECT,  # box grid
                                )),
         'page-loading-done': (GObject.SignalFlags.RUN_LAST, None, ()),
     }
@@ -161,8 +335,15 @@ class JobPageBoxesLoader(Job):
             boxes = []
             for line in line_boxes:
                 boxes += line.word_boxes
-
-            self.emit('page-loading-boxes', boxes)
+            # built here so highlighting doesn't have to go through all
+            # the boxes
+            box_index = self.page.box_index
+            # and so hit-testing doesn't have to either
+            box_grid = SpatialGrid(self.BOX_GRID_CELL_SIZE)
+            for box in boxes:
+                box_grid.add(box, box.position)
+
+            self.emit('page-loading-boxes', boxes, box_index, box_grid)
         finally:
             self.emit('page-loading-done')
 
@@ -185,10 +366,11 @@ class JobFactoryPageBoxesLoader(JobFactory):
 
     def make(self, drawer, page):
         job = JobPageBoxesLoader(self, next(self.id_generator), page)
+        job.key = drawer
         job.connect('page-loading-boxes',
-                    lambda job, all_boxes:
+                    lambda job, all_boxes, box_index, box_grid:
                     GLib.idle_add(drawer.on_page_loading_boxes,
-                                  job.page, all_boxes))
+                                  job.page, all_boxes, box_index, box_grid))
         return job
 
 
@@ -258,6 +440,13 @@ class PageDrawer(Drawer, GObject.GObject):
 
     PAGE_DRAG_ID = 128
 
+    # when the page is displayed this many times bigger than the visible
+    # area on both axes, only its visible tiles are loaded (see
+    # TilePyramid). Below that, a single surface is cheaper.
+    TILING_MIN_RATIO = 3
+    # tiles kept in memory
+    MAX_TILES = 96
+
     __gsignals__ = {
         'page-selected': (GObject.SignalFlags.RUN_LAST, None, (GObject.TYPE_INT,)),
         'page-edited': (GObject.SignalFlags.RUN_LAST, None,
@@ -293,12 +482,19 @@ class PageDrawer(Drawer, GObject.GObject):
         self.drag_enabled = True
 
         self.surface = None
+        self.tile_pyramid = None
+        self.tiles = collections.OrderedDict()  # (level, x, y) --> surface
+        self.requested_tiles = set()
+        self.requested_level = None  # tile level being generated
         self.boxes = {
             'all': set(),
             'highlighted': set(),
             'mouse_over': None,
         }
+        self.box_index = None
+        self.box_grid = None
         self.sentence = sentence
+        self.shown = False  # on the canvas
         self.visible = False
         self.loading = False
 
@@ -415,6 +611,7 @@ class PageDrawer(Drawer, GObject.GObject):
                           + self.previous_page_drawer.size[1]
                           + (2 * self.MARGIN))
         self.position = (position_w, position_h)
+        GLib.idle_add(self.update_visibility)
 
     def set_canvas(self, canvas):
         Drawer.set_canvas(self, canvas)
@@ -427,6 +624,8 @@ class PageDrawer(Drawer, GObject.GObject):
                        lambda canvas, event:
                        GLib.idle_add(self._on_mouse_button_release, event))
         canvas.connect(self, "size-allocate", self._on_size_allocate_cb)
+        canvas.connect(self, "window-moved",
+                       lambda canvas: self.update_visibility())
 
         canvas.connect(self, "drag-begin", self._on_drag_begin)
         canvas.connect(self, "drag-data-get", self._on_drag_data_get)
@@ -502,6 +701,8 @@ class PageDrawer(Drawer, GObject.GObject):
         self.unload_content()
         self.visible = False  # will force a reload if visible
         self.upd_spinner_position()
+        if self.canvas is not None:
+            GLib.idle_add(self.update_visibility)
 
     size = property(_get_size, _set_size)
 
@@ -509,24 +710,100 @@ class PageDrawer(Drawer, GObject.GObject):
         self.size = (int(factor * self.max_size[0]),
                      int(factor * self.max_size[1]))
 
+    def use_tiles(self):
+        if self.angle != 0 or self.editor_state != "before":
+            return False
+        return (self.size[0] > self.TILING_MIN_RATIO * self.canvas.size[0]
+                and self.size[1] > self.TILING_MIN_RATIO * self.canvas.size[1])
+
+    def update_visibility(self):
+        """
+        Load the content of the page when it enters the visible area of the
+        canvas, and unload it when it leaves it. Called when the page, the
+        visible area or the way the page is displayed change.
+        """
+        if not self.shown:
+            # removed from the canvas in the meantime
+            return False
+        should_be_visible = self.compute_visibility(
+            self.canvas.offset, self.canvas.size,
+            self.position, self.size)
+        if should_be_visible and not self.visible:
+            self.visible = True
+            self.load_content()
+        elif not should_be_visible and self.visible:
+            self.unload_content()
+            self.visible = False
+        elif (self.visible and self.surface is None
+              and not self.use_tiles()):
+            # the page may have been displayed with tiles until now
+            self.load_content()
+        return False
+
     def load_content(self):
         if self.loading:
             return
+        if self.use_tiles():
+            # visible tiles are requested when drawing
+            self.load_boxes()
+            return
+        surface = get_surface_cache().get(get_surface_key(self.page,
+                                                          self.size))
+        if surface is not None:
+            self.surface = surface
+            self.load_boxes()
+            return
         self.canvas.add_drawer(self.spinner)
         self.loading = True
+        if use_thumbnail(self.size):
+            # the loaders are run one at a time, but the pages of all the
+            # visible drawers can be rendered at the same time
+            self.page.prefetch_thumbnail(self.size[0], self.size[1])
         job = self.factories['page_img_loader'].make(self, self.page,
                                                      self.size)
         self.schedulers['page_img_loader'].schedule(job)
 
+    def prefetch(self):
+        """
+        Load the surface of the page in the surface cache, in case the page
+        becomes visible soon
+        """
+        if self.visible or self.loading or self.use_tiles():
+            return
+        if get_surface_key(self.page, self.size) in get_surface_cache():
+            return
+        job = self.factories['page_prefetcher'].make(self, self.page,
+                                                     self.size)
+        self.schedulers['page_prefetcher'].schedule(job)
+
     def on_page_loading_img(self, page, surface):
         if not self.visible:
             return
         self.surface = surface
+        self.load_boxes()
+
+    def load_boxes(self):
         if (len(self.boxes['all']) <= 0
                 and (self.show_boxes or self.show_border)):
             job = self.factories['page_boxes_loader'].make(self, self.page)
             self.schedulers['page_boxes_loader'].schedule(job)
 
+    def on_page_tiles_generated(self, level):
+        if level != self.requested_level:
+            return
+        self.requested_level = None
+        if self.visible:
+            self.redraw()
+
+    def on_page_loading_tile(self, level, x, y, surface):
+        self.requested_tiles.discard((level, x, y))
+        if not self.visible:
+            return
+        self.tiles[(level, x, y)] = surface
+        while len(self.tiles) > self.MAX_TILES:
+            self.tiles.popitem(last=False)
+        self.redraw()
+
     def on_page_loading_done(self, page):
         if self.loading:
             self.canvas.remove_drawer(self.spinner)
@@ -551,16 +828,10 @@ class PageDrawer(Drawer, GObject.GObject):
             keywords = sentence
 
         output = set()
+        if self.box_index is None:
+            return output
         for keyword in keywords:
-            for box in self.boxes["all"]:
-                if keyword in box.content:
-                    output.add(box)
-                    continue
-                # unfold generator output
-                words = [x for x in split_words(box.content)]
-                if keyword in words:
-                    output.add(box)
-                    continue
+            output.update(self.box_index.find(keyword))
         return output
 
     def reload_boxes(self, new_sentence=None):
@@ -569,10 +840,12 @@ class PageDrawer(Drawer, GObject.GObject):
         self.boxes["highlighted"] = self._get_highlighted_boxes(self.sentence)
         self.redraw()
 
-    def on_page_loading_boxes(self, page, all_boxes):
+    def on_page_loading_boxes(self, page, all_boxes, box_index, box_grid):
         if not self.visible:
             return
         self.boxes['all'] = set(all_boxes)
+        self.box_index = box_index
+        self.box_grid = box_grid
         self.reload_boxes()
 
     def unload_content(self):
@@ -582,14 +855,25 @@ class PageDrawer(Drawer, GObject.GObject):
         if self.surface is not None:
             del(self.surface)
             self.surface = None
+        # the page may have been modified in the meantime
+        self.tile_pyramid = None
+        self.tiles = collections.OrderedDict()
+        self.requested_tiles = set()
+        self.requested_level = None
         self.boxes = {
             'all': set(),
             'highlighted': set(),
             'mouse_over': None,
         }
+        self.box_index = None
+        self.box_grid = None
+
+    def show(self):
+        self.shown = True
 
     def hide(self):
         self.unload_content()
+        self.shown = False
         self.visible = False
 
     def draw_border(self, cairo_context):
@@ -633,6 +917,66 @@ class PageDrawer(Drawer, GObject.GObject):
         finally:
             cairo_context.restore()
 
+    def draw_tiles(self, cairo_context):
+        if self.tile_pyramid is None:
+            self.tile_pyramid = TilePyramid(self.page)
+        pyramid = self.tile_pyramid
+        level = pyramid.get_level(self.size)
+        if level == self.requested_level:
+            return
+        if not pyramid.has_level(level):
+            self.requested_level = level
+            job = self.factories['page_tiles_generator'].make(
+                self, pyramid, level
+            )
+            self.schedulers['page_tiles_generator'].schedule(job)
+            return
+        level_size = pyramid.get_level_size(level)
+        (nb_columns, nb_lines) = pyramid.get_nb_tiles(level)
+        scale = (float(self.size[0]) / level_size[0],
+                 float(self.size[1]) / level_size[1])
+        tile_size = (TILE_SIZE * scale[0], TILE_SIZE * scale[1])
+
+        # visible area, relative to the page
+        visible_min = (
+            max(0, self.canvas.offset[0] - self.position[0]),
+            max(0, self.canvas.offset[1] - self.position[1]),
+        )
+        visible_max = (
+            min(self.size[0], self.canvas.offset[0] + self.canvas.size[0]
+                - self.position[0]),
+            min(self.size[1], self.canvas.offset[1] + self.canvas.size[1]
+                - self.position[1]),
+        )
+
+        missing = []
+        for y in xrange(int(visible_min[1] / tile_size[1]),
+                        min(nb_lines,
+                            int(math.ceil(visible_max[1] / tile_size[1])))):
+            for x in xrange(int(visible_min[0] / tile_size[0]),
+                            min(nb_columns,
+                                int(math.ceil(visible_max[0]
+                                              / tile_size[0])))):
+                key = (level, x, y)
+                position = (self.position[0] + (x * tile_size[0]),
+                            self.position[1] + (y * tile_size[1]))
+                surface = self.tiles.pop(key, None)
+                if surface is None:
+                    missing.append(key)
+                    continue
+                self.tiles[key] = surface  # most recently used
+                self.draw_surface(cairo_context, surface, position,
+                                  (surface.get_width() * scale[0],
+                                   surface.get_height() * scale[1]))
+
+        if len(set(missing).difference(self.requested_tiles)) > 0:
+            # the new job replaces any pending one for this drawer
+            self.requested_tiles = set(missing)
+            job = self.factories['page_tiles_loader'].make(
+                self, pyramid, level, [(x, y) for (_, x, y) in missing]
+            )
+            self.schedulers['page_tiles_loader'].schedule(job)
+
     def _get_factors(self):
         return (
             (float(self._size[0]) / self.max_size[0]),
@@ -810,23 +1154,19 @@ class PageDrawer(Drawer, GObject.GObject):
             cairo_ctx.restore()
 
     def draw(self, cairo_context):
-        should_be_visible = self.compute_visibility(
-            self.canvas.offset, self.canvas.size,
-            self.position, self.size)
-        if should_be_visible and not self.visible:
-            self.load_content()
-        elif not should_be_visible and self.visible:
-            self.unload_content()
-        self.visible = should_be_visible
-
         if not self.visible:
+            # content not loaded (yet), see update_visibility()
+            self.draw_tmp_area(cairo_context)
             return
 
         if (self.page.selected or (self.show_border
                 and (self.mouse_over or self.boxes['highlighted']))):
             self.draw_border(cairo_context)
 
-        if not self.surface:
+        if self.use_tiles():
+            self.draw_tmp_area(cairo_context)
+            self.draw_tiles(cairo_context)
+        elif not self.surface:
             self.draw_tmp_area(cairo_context)
         else:
             self.draw_surface(cairo_context,
@@ -853,7 +1193,9 @@ class PageDrawer(Drawer, GObject.GObject):
             self.draw_mask(cairo_context, (0.0, 0.0, 0.0, 0.15))
 
     def _get_box_at(self, x, y):
-        for box in self.boxes["all"]:
+        if self.box_grid is None:
+            return None
+        for box in self.box_grid.get_candidates_at(x, y):
             if (x >= box.position[0][0]
                     and x <= box.position[1][0]
                     and y >= box.position[0][1]
@@ -1004,6 +1346,7 @@ class PageDrawer(Drawer, GObject.GObject):
         self.set_drag_enabled(False)
         self.editor_state = "during"
         self.mouse_over_button = self.editor_buttons['during'][0]
+        self.update_visibility()
         self.redraw()
 
     def _on_edit_crop(self):
@@ -1039,7 +1382,9 @@ class PageDrawer(Drawer, GObject.GObject):
             self.editor_grips = None
         self.editor_state = "before"
         self.angle = 0
-        self.hide()
+        self.unload_content()
+        self.visible = False  # will force a reload
+        self.update_visibility()
         self.canvas.redraw()
 
     def _on_edit_cancel(self):
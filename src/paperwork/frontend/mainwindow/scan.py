@@ -15,17 +15,15 @@
 #    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import multiprocessing
-import re
-import threading
 import time
 
 from gi.repository import GLib
 from gi.repository import GObject
-import pyocr
-import pyocr.builders
 
-from paperwork.backend.util import check_spelling
+from paperwork.backend.ocr import compute_ocr_score
+from paperwork.backend.ocr import get_ocr_tool
+from paperwork.backend.ocr import guess_orientation
+from paperwork.backend.ocr import image_to_boxes
 from paperwork.frontend.mainwindow.pages import PageDrawer
 from paperwork.frontend.util.jobs import Job
 from paperwork.frontend.util.jobs import JobFactory
@@ -107,7 +105,10 @@ class JobScan(Job):
             self.emit('scan-error', exc)
             raise
 
-        img = self.scan_session.images[-1]
+        # With the ADF, the scan session keeps all the images scanned so
+        # far. Once given to the workflow, they don't have to stay in memory
+        # until the end of the session.
+        img = self.scan_session.images.pop()
         self.emit('scan-done', img)
         logger.info("Scan done")
         del self.scan_session
@@ -153,79 +154,6 @@ class JobFactoryScan(JobFactory):
         return job
 
 
-class _ImgOCRThread(threading.Thread):
-    # we don't use jobs here, because we would need 1 scheduler for each job
-    # --> too painful and useless
-
-    def __init__(self, name, ocr_tool, langs, angle, img):
-        threading.Thread.__init__(self, name="OCR")
-        self.name = name
-        self.ocr_tool = ocr_tool
-        self.langs = langs
-        self.angle = angle
-        self.img = img
-        self.score = -1
-        self.boxes = None
-
-    def __compute_ocr_score_with_spell_checking(self, txt):
-        return check_spelling(self.langs['spelling'], txt)
-
-    @staticmethod
-    def __boxes_to_txt(boxes):
-        txt = u""
-        for line in boxes:
-            txt += line.content + u"\n"
-        return txt
-
-    @staticmethod
-    def __compute_ocr_score_without_spell_checking(txt):
-        """
-        Try to evaluate how well the OCR worked.
-        Current implementation:
-            The score is the number of words only made of 4 or more letters
-            ([a-zA-Z])
-        """
-        # TODO(Jflesch): i18n / l10n
-        score = 0
-        prog = re.compile(r'^[a-zA-Z]{4,}$')
-        for word in txt.split(" "):
-            if prog.match(word):
-                score += 1
-        return (txt, score)
-
-    def run(self):
-        SCORE_METHODS = [
-            ("spell_checker", self.__compute_ocr_score_with_spell_checking),
-            ("lucky_guess", self.__compute_ocr_score_without_spell_checking),
-            ("no_score", lambda txt: (txt, 0))
-        ]
-
-        logger.info("Running OCR on page orientation %s", self.name)
-        self.boxes = self.ocr_tool.image_to_string(
-            self.img, lang=self.langs['ocr'],
-            builder=pyocr.builders.LineBoxBuilder())
-
-        txt = self.__boxes_to_txt(self.boxes)
-
-        for score_method in SCORE_METHODS:
-            try:
-                logger.info("Evaluating score of page orientation (%s)"
-                            " using method '%s' ...",
-                            self.name, score_method[0])
-                (_, self.score) = score_method[1](txt)
-                # TODO(Jflesch): For now, we throw away the fixed version of
-                # the text:
-                # The original version may contain proper nouns, and spell
-                # checking could make them disappear
-                # However, it would be best if we could keep both versions
-                # without increasing too much indexation time
-                return
-            except Exception, exc:
-                logger.error("Scoring method '%s' on orientation %s failed !",
-                             score_method[0], self.name)
-                logger.error("Reason: %s" % exc)
-
-
 class JobOCR(Job):
     __gsignals__ = {
         'ocr-started': (GObject.SignalFlags.RUN_LAST, None,
@@ -245,15 +173,14 @@ class JobOCR(Job):
     can_stop = False
     priority = 5
 
-    OCR_THREADS_POLLING_TIME = 0.1
-
     def __init__(self, factory, id,
-                 ocr_tool, langs, angles, img):
+                 ocr_tool, langs, angles, img, preprocessing=None):
         Job.__init__(self, factory, id)
         self.ocr_tool = ocr_tool
         self.langs = langs
         self.img = img
         self.angles = angles
+        self.preprocessing = preprocessing
 
     def do_ocr_with_tool_heuristic(self, img):
         if not self.ocr_tool.can_detect_orientation():
@@ -263,20 +190,17 @@ class JobOCR(Job):
         if len(self.angles) == 1:
             orientation = {'angle': self.angles[0]}
         else:
+            ocr_img = img
+            if self.preprocessing is not None:
+                ocr_img = self.preprocessing.apply(img)[0]
             orientation = self.ocr_tool.detect_orientation(
-                img, lang=self.langs['ocr'])
+                ocr_img, lang=self.langs['ocr'])
 
         if orientation['angle'] not in self.angles:
             raise Exception("OCR tool returned an unexpected orientation: %d"
                             % orientation['angle'])
 
         logger.info("Detected orientation: %d", orientation['angle'])
-        if orientation['angle'] != 0:
-            # The angle provided by pyocr is clockwise, so we want to rotate
-            # the image with an angle of -1 * <angle of pyocr> (clockwise).
-            # PIL expect a counter-clockwise angle --> -1 * angle
-            # So they both cancel each other.
-            img = img.rotate(orientation['angle'], expand=True)
 
         for angle in self.angles:
             # tell the observer we decided to not OCR some orientations
@@ -284,58 +208,43 @@ class JobOCR(Job):
                 continue
             self.emit('ocr-score', angle, 0)
 
-        boxes = self.ocr_tool.image_to_string(
-            img, lang=self.langs['ocr'],
-            builder=pyocr.builders.LineBoxBuilder())
+        # The angle provided by pyocr is clockwise, so we want to rotate
+        # the image with an angle of -1 * <angle of pyocr> (clockwise).
+        # PIL expect a counter-clockwise angle --> -1 * angle
+        # So they both cancel each other.
+        (img, boxes) = image_to_boxes(self.ocr_tool, img, self.langs['ocr'],
+                                      angle=orientation['angle'],
+                                      preprocessing=self.preprocessing)
 
         self.emit('ocr-score', orientation['angle'], 1)
 
         return (orientation['angle'], img, boxes)
 
     def do_ocr_with_custom_heuristic(self, img):
-        imgs = {angle: img.rotate(angle, expand=True) for angle in self.angles}
-        self.emit('ocr-angles', imgs.keys())
+        self.emit('ocr-angles', self.angles)
 
-        if len(imgs) <= 0:
+        if len(self.angles) <= 0:
             self.emit('ocr-score', 0, 0)
             return (0, img, [])
 
-        max_threads = multiprocessing.cpu_count()
-        threads = []
-        scores = []
-
-        if len(imgs) > 1:
-            logger.debug("Will use %d process(es) for OCR", max_threads)
-
-        # Run the OCR tools in as many threads as there are processors/core
-        # on the computer
-        nb = 0
-        while (len(imgs) > 0 or len(threads) > 0):
-            # look for finished threads
-            for thread in threads:
-                if not thread.is_alive():
-                    threads.remove(thread)
-                    logger.info("OCR done on angle %d: %f",
-                                thread.angle, thread.score)
-                    scores.append((thread.score, thread.angle,
-                                   thread.img, thread.boxes))
-                    self.emit('ocr-score', thread.angle, thread.score)
-            # start new threads if required
-            while (len(threads) < max_threads and len(imgs) > 0):
-                (angle, img) = imgs.popitem()
-                logger.info("Starting OCR on angle %d", angle)
-                thread = _ImgOCRThread(str(nb), self.ocr_tool,
-                                       self.langs, angle, img)
-                thread.start()
-                threads.append(thread)
-                nb += 1
-            time.sleep(self.OCR_THREADS_POLLING_TIME)
-
-        # We want the higher score first
-        scores.sort(cmp=lambda x, y: cmp(y[0], x[0]))
-
-        logger.info("Best: %f", scores[0][0])
-        return scores[0][1:]
+        angle = self.angles[0]
+        if len(self.angles) > 1:
+            # Only the center of the page, scaled down, is OCR'ed for each
+            # orientation. Then we do a real OCR on the best one.
+            scores = guess_orientation(
+                self.ocr_tool, self.langs, img, self.angles,
+                score_cb=lambda angle, score:
+                self.emit('ocr-score', angle, score)
+            )
+            logger.info("Best: %d (%f)", scores[0][1], scores[0][0])
+            angle = scores[0][1]
+
+        (img, boxes) = image_to_boxes(self.ocr_tool, img, self.langs['ocr'],
+                                      angle=angle,
+                                      preprocessing=self.preprocessing)
+        if len(self.angles) <= 1:
+            self.emit('ocr-score', angle, compute_ocr_score(self.langs, boxes))
+        return (angle, img, boxes)
 
     def do(self):
         self.emit('ocr-started', self.img)
@@ -364,14 +273,12 @@ class JobFactoryOCR(JobFactory):
     def make(self, img, nb_angles):
         angles = range(0, nb_angles * 90, 90)
 
-        ocr_tools = pyocr.get_available_tools()
-        if len(ocr_tools) == 0:
-            raise Exception("No OCR tool found")
-        ocr_tool = ocr_tools[0]
+        ocr_tool = get_ocr_tool()
         logger.info("Will use tool '%s'", ocr_tool.get_name())
 
         job = JobOCR(self, next(self.id_generator), ocr_tool,
-                     self.__config['langs'].value, angles, img)
+                     self.__config['langs'].value, angles, img,
+                     self.__config['ocr_preprocessing'].value)
         job.connect("ocr-started", lambda job, img:
                     GLib.idle_add(self.scan_workflow.on_ocr_started, img))
         job.connect("ocr-angles", lambda job, imgs:
@@ -890,6 +797,9 @@ class ScanWorkflow(GObject.GObject):
                     self.calibration[1][1]
                 )
             )
+        if img is not None and self.__resolution > 0:
+            # used to preprocess the image before the OCR
+            img.info['dpi'] = (self.__resolution, self.__resolution)
 
         self.emit('scan-done', img)
 
@@ -24,6 +24,7 @@ from gi.repository import Gdk
 from gi.repository import Gtk
 
 from paperwork.frontend.multiscan.scan import PageScan
+from paperwork.frontend.multiscan.scan import PageScanPipeline
 from paperwork.frontend.multiscan.scan import DocScan
 from paperwork.frontend.multiscan.scan import PageScanDrawer
 from paperwork.frontend.util import load_uifile
@@ -148,6 +149,7 @@ class ActionScan(SimpleAction):
         self.__config = config
         self.__docsearch = docsearch
         self.__main_win = main_win
+        self.__pipeline = None
 
     def do(self):
         SimpleAction.do(self)
@@ -204,21 +206,15 @@ class ActionScan(SimpleAction):
                 new_height += drawer.size[1]
             position = (MARGIN, new_height)
 
-        first_page_scan = page_scans[0]
-        last_page_scan = None
-        for page_scan in page_scans:
-            if last_page_scan:
-                last_page_scan.connect_next_page_scan(page_scan)
-            last_page_scan = page_scan
-
-        if last_page_scan:
-            last_page_scan.connect(
-                "done",
-                lambda _: GLib.idle_add(
-                    self.__multiscan_win.on_global_scan_end_cb)
-            )
-        if first_page_scan:
-            first_page_scan.start_scan_workflow()
+        pipeline = PageScanPipeline(
+            page_scans, self.__config['scanner_max_in_flight_pages'].value
+        )
+        pipeline.connect(
+            "done",
+            lambda _: GLib.idle_add(self.__multiscan_win.on_global_scan_end_cb)
+        )
+        self.__pipeline = pipeline
+        pipeline.start()
 
 
 class ActionCancel(SimpleAction):
@@ -44,6 +44,14 @@ class PageScan(GObject.GObject):
     __gsignals__ = {
         'scanworkflow-inst': (GObject.SignalFlags.RUN_LAST, None,
                               (GObject.TYPE_PYOBJECT, )),
+        # img (None if the scan has been canceled)
+        'scan-done': (GObject.SignalFlags.RUN_LAST, None,
+                      (GObject.TYPE_PYOBJECT, )),
+        # img, line boxes
+        'ocr-done': (GObject.SignalFlags.RUN_LAST, None,
+                     (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT, )),
+        'error': (GObject.SignalFlags.RUN_LAST, None,
+                  (GObject.TYPE_PYOBJECT, )),
         'done': (GObject.SignalFlags.RUN_LAST, None, ()),
     }
 
@@ -63,21 +71,25 @@ class PageScan(GObject.GObject):
         self.page_nb = page_nb
         self.total_pages = total_pages
 
+    def __on_scan_done(self, img):
+        self.emit("scan-done", img)
+
     def __on_ocr_done(self, img, line_boxes):
-        docid = self.__main_win.remove_scan_workflow(self.scan_workflow)
-        self.__main_win.add_page(docid, img, line_boxes)
-        self.emit("done")
+        self.emit("ocr-done", img, line_boxes)
 
     def __on_error(self, exc):
         logger.error("Scan failed: %s", exc)
         self.__main_win.remove_scan_workflow(self.scan_workflow)
         self.__main_win.refresh_page_list()
         self.__multiscan_win.on_scan_error_cb(self, exc)
+        self.emit("error", exc)
 
     def __make_scan_workflow(self):
         self.scan_workflow = self.__main_win.make_scan_workflow()
         self.scan_workflow.connect("scan-start", lambda _: GLib.idle_add(
             self.__multiscan_win.on_scan_start_cb, self))
+        self.scan_workflow.connect("scan-done", lambda _, img:
+                                   GLib.idle_add(self.__on_scan_done, img))
         self.scan_workflow.connect("scan-error", lambda _, exc:
                                    GLib.idle_add(self.__on_error, exc))
         self.scan_workflow.connect("ocr-start", lambda _, a: GLib.idle_add(
@@ -93,23 +105,120 @@ class PageScan(GObject.GObject):
         self.emit('scanworkflow-inst', self.scan_workflow)
 
     def start_scan_workflow(self):
+        """
+        Start the scan of the page. The OCR is started as soon as the scan
+        is done. Returns immediately.
+        Listen for the signal 'ocr-done' to get the result and call
+        commit() to add the page to the document.
+        """
         self.__make_scan_workflow()
         if not self.doc_scan.doc:
             self.doc_scan.doc = self.__main_win.doclist.get_new_doc()
         self.__main_win.show_doc(self.doc_scan.doc)
         drawer = self.__main_win.make_scan_workflow_drawer(
             self.scan_workflow, single_angle=False)
-        self.__main_win.add_scan_workflow(self.doc_scan.doc, drawer)
+        # many pages of the same document may be in progress at the same
+        # time
+        self.__main_win.add_scan_workflow(self.doc_scan.doc, drawer,
+                                          page_nb=self.page_nb)
         self.scan_workflow.scan_and_ocr(self.resolution, self.__scan_session)
 
-    def connect_next_page_scan(self, next_page_scan):
-        self.connect("done", lambda _: GLib.idle_add(
-            next_page_scan.start_scan_workflow))
+    def commit(self, img, line_boxes):
+        docid = self.__main_win.remove_scan_workflow(self.scan_workflow)
+        self.__main_win.add_page(docid, img, line_boxes)
+        self.emit("done")
 
 
 GObject.type_register(PageScan)
 
 
+class PageScanPipeline(GObject.GObject):
+
+    """
+    Scanner --> OCR (including the preprocessing) --> document.
+
+    The scan of the next page doesn't wait for the OCR of the previous
+    ones: the scanner keeps feeding pages while the OCR scheduler processes
+    them. The number of pages scanned but not yet added to their document
+    is limited to 'max_in_flight' (each of them is a full-size image in
+    memory): once the limit is reached, the scanner waits for the OCR to
+    catch up.
+
+    Pages are added to their documents in the order they have been scanned.
+    """
+
+    __gsignals__ = {
+        'done': (GObject.SignalFlags.RUN_LAST, None, ()),
+    }
+
+    def __init__(self, page_scans, max_in_flight):
+        GObject.GObject.__init__(self)
+        self.page_scans = page_scans
+        self.max_in_flight = max(1, max_in_flight)
+
+        self.__next_scan = 0  # index of the next page to scan
+        self.__next_commit = 0  # index of the next page to add to its doc
+        self.__scanning = False
+        self.__stopped = False
+        self.__results = {}  # page idx --> (img, line_boxes)
+
+        for (idx, page_scan) in enumerate(page_scans):
+            page_scan.connect("scan-done", self.__on_scan_done, idx)
+            page_scan.connect("ocr-done", self.__on_ocr_done, idx)
+            page_scan.connect("error", self.__on_error)
+
+    def __get_nb_in_flight(self):
+        return self.__next_scan - self.__next_commit
+
+    nb_in_flight = property(__get_nb_in_flight)
+
+    def start(self):
+        if len(self.page_scans) <= 0:
+            self.emit("done")
+            return
+        self.__feed()
+
+    def __feed(self):
+        if self.__stopped or self.__scanning:
+            return
+        if self.__next_scan >= len(self.page_scans):
+            return
+        if self.nb_in_flight >= self.max_in_flight:
+            logger.info("%d pages waiting for the OCR. Scanner paused",
+                        self.nb_in_flight)
+            return
+        page_scan = self.page_scans[self.__next_scan]
+        self.__next_scan += 1
+        self.__scanning = True
+        page_scan.start_scan_workflow()
+
+    def __on_scan_done(self, page_scan, img, idx):
+        self.__scanning = False
+        if img is None:
+            logger.info("Scan canceled. Stopping the multi-scan")
+            self.__stopped = True
+            return
+        self.__feed()
+
+    def __on_ocr_done(self, page_scan, img, line_boxes, idx):
+        self.__results[idx] = (img, line_boxes)
+        while self.__next_commit in self.__results:
+            (img, line_boxes) = self.__results.pop(self.__next_commit)
+            self.page_scans[self.__next_commit].commit(img, line_boxes)
+            self.__next_commit += 1
+        if self.__next_commit >= len(self.page_scans):
+            self.emit("done")
+            return
+        self.__feed()
+
+    def __on_error(self, page_scan, exc):
+        self.__scanning = False
+        self.__stopped = True
+
+
+GObject.type_register(PageScanPipeline)
+
+
 class PageScanDrawer(Animation):
     layer = Drawer.IMG_LAYER
     visible = True
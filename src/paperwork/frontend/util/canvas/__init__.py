@@ -33,6 +33,7 @@ from gi.repository import Gdk
 from gi.repository import Gtk
 
 from paperwork.frontend.util import PriorityQueue
+from paperwork.frontend.util.canvas.grid import SpatialGrid
 
 
 logger = logging.getLogger(__name__)
@@ -71,6 +72,9 @@ class Canvas(Gtk.DrawingArea, Gtk.Scrollable):
     }
 
     TICK_INTERVAL = (1000 / 25)
+    # drawers may draw a little outside of their area (page borders, grips,
+    # etc)
+    DRAW_MARGIN = 32
 
     def __init__(self, scrollbars):
         Gtk.DrawingArea.__init__(self)
@@ -82,6 +86,12 @@ class Canvas(Gtk.DrawingArea, Gtk.Scrollable):
         self.visible_size = (1, 1)
 
         self.drawers = PriorityQueue()
+        # [(drawer, ((x1, y1), (x2, y2))), ...], in the order of self.drawers
+        self.__layout = []
+        # rebuilt when the layout changes
+        self.__drawer_grid = None
+        self.__drawer_ranks = {}  # drawer --> rank in the layout
+        self.__overlays = []
         self.tick_counter_lock = threading.Lock()
 
         self.set_hadjustment(hadj)
@@ -176,13 +186,31 @@ class Canvas(Gtk.DrawingArea, Gtk.Scrollable):
 
     def recompute_size(self):
         (full_x, full_y) = (1, 1)
+        layout = []
         for drawer in self.drawers:
-            x = drawer.position[0] + drawer.size[0]
-            y = drawer.position[1] + drawer.size[1]
+            position = drawer.position
+            size = drawer.size
+            x = position[0] + size[0]
+            y = position[1] + size[1]
+            if drawer.angle:
+                # the area is enlarged, see Drawer.relative_position
+                diff = max(size) - min(size)
+                if size[0] < size[1]:
+                    area = ((position[0] - (diff / 2), position[1]),
+                            (x + (diff / 2), y))
+                else:
+                    area = ((position[0], position[1] - (diff / 2)),
+                            (x, y + (diff / 2)))
+            else:
+                area = (position, (x, y))
+            layout.append((drawer, area))
             if (full_x < x):
                 full_x = x
             if (full_y < y):
                 full_y = y
+        if layout != self.__layout:
+            self.__layout = layout
+            self.__drawer_grid = None
         new_size = (full_x, full_y)
         if (new_size[0] != self.full_size[0]
                 or new_size[1] != self.full_size[1]):
@@ -210,10 +238,34 @@ class Canvas(Gtk.DrawingArea, Gtk.Scrollable):
         self.hadjustment.set_value(int(val_h))
         self.vadjustment.set_value(int(val_v))
 
+    def __get_drawers_in(self, area):
+        """
+        Returns:
+            A set of the drawers that may draw in the given area (absolute
+            coordinates), overlays excluded
+        """
+        ((x1, y1), (x2, y2)) = area
+        return self.__get_drawer_grid().get_candidates_in((
+            (x1 - self.DRAW_MARGIN, y1 - self.DRAW_MARGIN),
+            (x2 + self.DRAW_MARGIN, y2 + self.DRAW_MARGIN),
+        ))
+
     def __on_draw(self, _, cairo_ctx):
         self.recompute_size()
 
-        for drawer in self.drawers:
+        # only the drawers in the damaged area are drawn
+        offset = self.offset
+        (x1, y1, x2, y2) = cairo_ctx.clip_extents()
+        drawers = self.__get_drawers_in(
+            ((x1 + offset[0], y1 + offset[1]),
+             (x2 + offset[0], y2 + offset[1]))
+        )
+        ranks = self.__drawer_ranks
+        drawers = [drawer for drawer in drawers if drawer in ranks]
+        drawers += self.__overlays
+        drawers.sort(key=ranks.get)
+
+        for drawer in drawers:
             cairo_ctx.save()
             try:
                 drawer.draw(cairo_ctx)
@@ -240,10 +292,34 @@ class Canvas(Gtk.DrawingArea, Gtk.Scrollable):
         self.recompute_size()
         self.redraw((drawer.relative_position, drawer.relative_size))
 
+    def __get_drawer_grid(self):
+        if self.__drawer_grid is None:
+            grid = SpatialGrid()
+            ranks = {}
+            overlays = []
+            for (rank, (drawer, area)) in enumerate(self.__layout):
+                ranks[drawer] = rank
+                if drawer.overlay:
+                    overlays.append(drawer)
+                else:
+                    grid.add(drawer, area)
+            self.__drawer_ranks = ranks
+            self.__overlays = overlays
+            self.__drawer_grid = grid
+        return self.__drawer_grid
+
     def get_drawer_at(self, position):
+        """
+        Look for the drawer at the given position, among the drawers where
+        they were when the layout was last computed (see recompute_size()).
+        If many drawers are at this position, the one drawn first is
+        returned.
+        """
         (x, y) = position
 
-        for drawer in self.drawers:
+        candidates = self.__get_drawer_grid().get_candidates_at(x, y)
+        candidates += self.__overlays
+        for drawer in sorted(candidates, key=self.__drawer_ranks.get):
             pt_a = drawer.position
             pt_b = (drawer.position[0] + drawer.size[0],
                     drawer.position[1] + drawer.size[1])
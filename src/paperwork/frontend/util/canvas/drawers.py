@@ -38,6 +38,9 @@ class Drawer(object):
     position = (0, 0)  # (x, y)
     size = (0, 0)  # (width, height)
     angle = 0
+    # overlays are drawn relative to the visible area instead of their
+    # position: the canvas must always draw them
+    overlay = False
 
     def __init__(self):
         self.canvas = None
@@ -204,6 +207,8 @@ class Drawer(object):
 
 class BackgroundDrawer(Drawer):
     layer = Drawer.BACKGROUND_LAYER
+    # paints the visible area, whatever its position
+    overlay = True
 
     def __init__(self, rgb):
         Drawer.__init__(self)
@@ -509,6 +514,7 @@ class TargetAreaDrawer(Drawer):
 class ProgressBarDrawer(Drawer):
     layer = Drawer.PROGRESSION_INDICATOR_LAYER
     visible = True
+    overlay = True
 
     TXT_MARGIN = 5
 
@@ -0,0 +1,96 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Uniform grid used to find quickly the elements (boxes, drawers) at a given
+position or in a given area, without going through all of them.
+"""
+
+
+class SpatialGrid(object):
+
+    """
+    The plane is cut in square cells. Each element is referenced in all the
+    cells its rectangle overlaps. Elements overlapping too many cells (the
+    background for instance) are not referenced in the cells but kept aside
+    and always returned.
+
+    The grid only returns candidates: callers must still check the exact
+    position of the elements (the grid doesn't know if the borders of their
+    rectangles are included or not).
+    """
+
+    DEFAULT_CELL_SIZE = 256
+    MAX_CELLS = 64  # per element
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.__cells = {}  # (x, y) --> [elements]
+        self.__large = []
+        self.__nb_elements = 0
+
+    def __len__(self):
+        return self.__nb_elements
+
+    def __get_cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def __get_cell_range(self, rect):
+        ((x1, y1), (x2, y2)) = rect
+        (min_x, min_y) = self.__get_cell(min(x1, x2), min(y1, y2))
+        (max_x, max_y) = self.__get_cell(max(x1, x2), max(y1, y2))
+        return (min_x, min_y, max_x, max_y)
+
+    def add(self, element, rect):
+        """
+        Arguments:
+            rect --- ((x1, y1), (x2, y2)) (same format than the positions
+                of the pyocr boxes)
+        """
+        self.__nb_elements += 1
+        (min_x, min_y, max_x, max_y) = self.__get_cell_range(rect)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > self.MAX_CELLS:
+            self.__large.append(element)
+            return
+        for y in xrange(min_y, max_y + 1):
+            for x in xrange(min_x, max_x + 1):
+                cell = self.__cells.get((x, y))
+                if cell is None:
+                    self.__cells[(x, y)] = [element]
+                else:
+                    cell.append(element)
+
+    def get_candidates_at(self, x, y):
+        """
+        Returns:
+            The elements that may contain the given point
+        """
+        cell = self.__cells.get(self.__get_cell(x, y), [])
+        return cell + self.__large
+
+    def get_candidates_in(self, rect):
+        """
+        Returns:
+            A set of the elements that may overlap the given rectangle
+        """
+        (min_x, min_y, max_x, max_y) = self.__get_cell_range(rect)
+        candidates = set(self.__large)
+        for y in xrange(min_y, max_y + 1):
+            for x in xrange(min_x, max_x + 1):
+                cell = self.__cells.get((x, y))
+                if cell is not None:
+                    candidates.update(cell)
+        return candidates
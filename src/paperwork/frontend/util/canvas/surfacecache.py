@@ -0,0 +1,138 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache of the cairo surfaces ready to be drawn (pages loaded at a given
+size), shared by all the drawers. Bounded by the memory used by the
+surfaces: when full, the least recently used surfaces are dropped first.
+"""
+
+import collections
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# default memory budget
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+def _get_surface_nb_bytes(surface):
+    return surface.get_stride() * surface.get_height()
+
+
+class SurfaceCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.__lock = threading.Lock()
+        self.__max_bytes = max_bytes
+        # key --> (cairo surface, nb bytes), least recently used first
+        self.__surfaces = collections.OrderedDict()
+        self.__nb_bytes = 0
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+
+    def __get_max_bytes(self):
+        return self.__max_bytes
+
+    def __set_max_bytes(self, max_bytes):
+        with self.__lock:
+            self.__max_bytes = max_bytes
+            self.__evict()
+
+    max_bytes = property(__get_max_bytes, __set_max_bytes)
+
+    def __get_nb_bytes(self):
+        return self.__nb_bytes
+
+    nb_bytes = property(__get_nb_bytes)
+
+    def __len__(self):
+        return len(self.__surfaces)
+
+    def __contains__(self, key):
+        # doesn't count as a use of the surface
+        return key in self.__surfaces
+
+    def __evict(self):
+        while (self.__nb_bytes > self.__max_bytes
+                and len(self.__surfaces) > 0):
+            (key, (_, nb_bytes)) = self.__surfaces.popitem(last=False)
+            self.__nb_bytes -= nb_bytes
+            self.nb_evictions += 1
+            logger.debug("Surface cache: %s evicted", str(key))
+
+    def get(self, key):
+        """
+        Returns:
+            The cached surface, or None
+        """
+        with self.__lock:
+            entry = self.__surfaces.pop(key, None)
+            if entry is None:
+                self.nb_misses += 1
+                return None
+            # most recently used
+            self.__surfaces[key] = entry
+            self.nb_hits += 1
+            return entry[0]
+
+    def put(self, key, surface):
+        nb_bytes = _get_surface_nb_bytes(surface)
+        with self.__lock:
+            previous = self.__surfaces.pop(key, None)
+            if previous is not None:
+                self.__nb_bytes -= previous[1]
+            if nb_bytes > self.__max_bytes:
+                # would evict everything else and itself
+                return
+            self.__surfaces[key] = (surface, nb_bytes)
+            self.__nb_bytes += nb_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__surfaces = collections.OrderedDict()
+            self.__nb_bytes = 0
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict: {'hits': int, 'misses': int, 'evictions': int,
+            'entries': int, 'bytes': int, 'max_bytes': int}
+        """
+        with self.__lock:
+            return {
+                'hits': self.nb_hits,
+                'misses': self.nb_misses,
+                'evictions': self.nb_evictions,
+                'entries': len(self.__surfaces),
+                'bytes': self.__nb_bytes,
+                'max_bytes': self.__max_bytes,
+            }
+
+
+_SURFACE_CACHE = SurfaceCache()
+
+
+def get_surface_cache():
+    """
+    Returns the surface cache shared by all the drawers
+    """
+    return _SURFACE_CACHE
@@ -17,6 +17,7 @@
 import ConfigParser
 import locale
 import logging
+import multiprocessing
 import re
 
 import pycountry
@@ -26,6 +27,7 @@ import pyinsane.abstract_th as pyinsane
 from paperwork.backend.config import PaperworkConfig
 from paperwork.backend.config import PaperworkSetting
 from paperwork.backend.config import paperwork_cfg_boolean
+from paperwork.backend.preprocessing import OCRPreprocessing
 from paperwork.frontend.util.scanner import maximize_scan_area
 from paperwork.frontend.util.scanner import set_scanner_opt
 
@@ -165,6 +167,39 @@ class _PaperworkLangs(object):
         pass
 
 
+class _PaperworkOCRPreprocessing(object):
+
+    """
+    Convenience setting. Gives the preprocessing to apply on images before
+    the OCR (None if disabled)
+    """
+
+    def __init__(self, enabled_setting, dpi_setting, binarize_setting,
+                 trim_setting):
+        self.enabled_setting = enabled_setting
+        self.dpi_setting = dpi_setting
+        self.binarize_setting = binarize_setting
+        self.trim_setting = trim_setting
+        self.section = "OCR"
+
+    def __get_preprocessing(self):
+        if not self.enabled_setting.value:
+            return None
+        return OCRPreprocessing(target_dpi=self.dpi_setting.value,
+                                binarize=self.binarize_setting.value,
+                                trim=self.trim_setting.value)
+
+    value = property(__get_preprocessing)
+
+    @staticmethod
+    def load(_):
+        pass
+
+    @staticmethod
+    def update(_):
+        pass
+
+
 class _PaperworkSize(object):
 
     def __init__(self, section, base_token,
@@ -252,6 +287,37 @@ def load_config():
             "OCR", "Lang",
             _PaperworkFrontendConfigUtil.get_default_ocr_lang
         ),
+        # processes doing the OCR when it is redone on many documents
+        'ocr_nb_workers': PaperworkSetting(
+            "OCR", "NbWorkers", lambda: multiprocessing.cpu_count(), int
+        ),
+        'ocr_preprocessing_enabled': PaperworkSetting(
+            "OCR", "Preprocessing", lambda: True, paperwork_cfg_boolean
+        ),
+        'ocr_preprocessing_dpi': PaperworkSetting(
+            "OCR", "PreprocessingDPI", lambda: 300, int
+        ),
+        'ocr_preprocessing_binarize': PaperworkSetting(
+            "OCR", "PreprocessingBinarize", lambda: False,
+            paperwork_cfg_boolean
+        ),
+        'ocr_preprocessing_trim': PaperworkSetting(
+            "OCR", "PreprocessingTrim", lambda: False, paperwork_cfg_boolean
+        ),
+        # memory used by the pages ready to be displayed (MB)
+        'page_cache_size': PaperworkSetting(
+            "GUI", "PageCacheSize", lambda: 128, int
+        ),
+        # Poppler documents kept open
+        'pdf_max_open_docs': PaperworkSetting(
+            "PDF", "MaxOpenDocs", lambda: 16, int
+        ),
+        # processes rendering the PDF pages (0 = render them in the GUI
+        # process)
+        'pdf_nb_renderers': PaperworkSetting(
+            "PDF", "NbRenderers",
+            lambda: min(4, multiprocessing.cpu_count()), int
+        ),
         'result_sorting': PaperworkSetting(
             "GUI", "Sorting", lambda: "scan_date"
         ),
@@ -266,6 +332,10 @@ def load_config():
             "Scanner", "Has_Feeder",
             lambda: False,
             paperwork_cfg_boolean),
+        # pages scanned but not yet OCR'ed (multi-scan)
+        'scanner_max_in_flight_pages': PaperworkSetting(
+            "Scanner", "MaxInFlightPages", lambda: 3, int
+        ),
         'scan_time': _ScanTimes(),
         'zoom_level': PaperworkSetting("GUI", "zoom_level",
                                        lambda: 0.0, float),
@@ -278,6 +348,12 @@ def load_config():
     settings['langs'] = (
         _PaperworkLangs(settings['ocr_lang'], settings['spelling_lang'])
     )
+    settings['ocr_preprocessing'] = _PaperworkOCRPreprocessing(
+        settings['ocr_preprocessing_enabled'],
+        settings['ocr_preprocessing_dpi'],
+        settings['ocr_preprocessing_binarize'],
+        settings['ocr_preprocessing_trim'],
+    )
 
     for (k, v) in settings.iteritems():
         config.settings[k] = v
@@ -17,6 +17,7 @@
 import StringIO
 
 from gi.repository import GdkPixbuf
+from gi.repository import GLib
 import PIL.ImageDraw
 
 
@@ -39,9 +40,26 @@ def image2pixbuf(img):
     """
     if img is None:
         return None
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    if not hasattr(GdkPixbuf.Pixbuf, "new_from_bytes"):
+        # GdkPixbuf < 2.32
+        return _image2pixbuf_ppm(img)
+    (width, height) = img.size
+    has_alpha = (img.mode == "RGBA")
+    rowstride = width * (4 if has_alpha else 3)
+    # Pillow packs the pixels directly in the layout expected by GdkPixbuf
+    data = GLib.Bytes.new(img.tobytes())
+    return GdkPixbuf.Pixbuf.new_from_bytes(
+        data, GdkPixbuf.Colorspace.RGB, has_alpha, 8, width, height,
+        rowstride
+    )
+
+
+def _image2pixbuf_ppm(img):
     file_desc = StringIO.StringIO()
     try:
-        img.save(file_desc, "ppm")
+        img.convert("RGB").save(file_desc, "ppm")
         contents = file_desc.getvalue()
     finally:
         file_desc.close()
@@ -61,6 +61,8 @@ class JobEntry(object):
     def __init__(self, job):
         self.job = job
         self.idx = next(_job_idx_generator)
+        # cancelled entries are left in the heap and skipped when popped
+        self.cancelled = False
 
     def __eq__(self, other):
         if isinstance(other, JobEntry):
@@ -101,6 +103,11 @@ class Job(GObject.GObject):  # inherits from GObject so it can send signals
 
     already_started_once = False
 
+    # optional coalescing key: when a job is scheduled while another job
+    # from the same factory with the same key is still pending, the pending
+    # one is cancelled and replaced
+    key = None
+
     def __init__(self, job_factory, job_id):
         GObject.GObject.__init__(self)
         self.factory = job_factory
@@ -109,10 +116,6 @@ class Job(GObject.GObject):  # inherits from GObject so it can send signals
         self._wait_time = None
         self._wait_cond = threading.Condition()
 
-    @property
-    def _entry(self):
-        return JobEntry(self)
-
     def _wait(self, wait_time, force=False):
         """Convenience function to wait while being stoppable"""
         if self._wait_time is None or force:
@@ -162,6 +165,10 @@ class Job(GObject.GObject):  # inherits from GObject so it can send signals
 
 class JobScheduler(object):
 
+    # when that many cancelled entries are left in the heap (and they
+    # outnumber the pending ones), the heap is rebuilt without them
+    MIN_CANCELLED_BEFORE_COMPACTION = 64
+
     def __init__(self, name):
         self.name = name
         self._thread = None
@@ -171,7 +178,11 @@ class JobScheduler(object):
         # _job_queue_cond.notify_all() is called each time the queue is
         # modified (except on cancel())
         self._job_queue_cond = threading.Condition()
-        self._job_queue = []
+        self._job_queue = []  # heap of JobEntry (including cancelled ones)
+        self._pending = {}  # job --> JobEntry
+        self._pending_by_factory = {}  # factory --> set(JobEntry)
+        self._pending_by_key = {}  # (factory, key) --> JobEntry
+        self._nb_cancelled = 0
         self._active_job = None
 
     def start(self):
@@ -183,6 +194,72 @@ class JobScheduler(object):
         self.running = True
         self._thread.start()
 
+    def _push(self, job):
+        """
+        Add the job to the queue and to the indexes. Caller must hold
+        _job_queue_cond.
+
+        Returns:
+            False if the job was already pending
+        """
+        if job in self._pending:
+            return False
+        entry = JobEntry(job)
+        heapq.heappush(self._job_queue, entry)
+        self._pending[job] = entry
+        if job.factory not in self._pending_by_factory:
+            self._pending_by_factory[job.factory] = set()
+        self._pending_by_factory[job.factory].add(entry)
+        if job.key is not None:
+            self._pending_by_key[(job.factory, job.key)] = entry
+        return True
+
+    def _unindex(self, entry):
+        job = entry.job
+        del self._pending[job]
+        entries = self._pending_by_factory[job.factory]
+        entries.discard(entry)
+        if not entries:
+            del self._pending_by_factory[job.factory]
+        if job.key is not None:
+            key = (job.factory, job.key)
+            if self._pending_by_key.get(key) is entry:
+                del self._pending_by_key[key]
+
+    def _pop(self):
+        """
+        Returns the pending job with the highest priority. Caller must hold
+        _job_queue_cond and make sure there is at least one pending job.
+        """
+        while True:
+            entry = heapq.heappop(self._job_queue)
+            if not entry.cancelled:
+                break
+            self._nb_cancelled -= 1
+        self._unindex(entry)
+        return entry.job
+
+    def _cancel_entry(self, entry):
+        """
+        Caller must hold _job_queue_cond. The entry remains in the heap
+        until it's popped or until the heap is compacted.
+        """
+        self._unindex(entry)
+        entry.cancelled = True
+        self._nb_cancelled += 1
+        if entry.job.already_started_once:
+            entry.job.stop(will_resume=False)
+        logger.debug("[Scheduler %s] Job %s cancelled",
+                     self.name, entry.job)
+
+    def _compact(self):
+        if (self._nb_cancelled < self.MIN_CANCELLED_BEFORE_COMPACTION
+                or self._nb_cancelled < len(self._pending)):
+            return
+        self._job_queue = [e for e in self._job_queue if not e.cancelled]
+        heapq.heapify(self._job_queue)
+        self._nb_cancelled = 0
+
     def _run(self):
         logger.info("[Scheduler %s] Started", self.name)
 
@@ -190,11 +267,11 @@ class JobScheduler(object):
 
             self._job_queue_cond.acquire()
             try:
-                while not self._job_queue:
+                while not self._pending:
                     self._job_queue_cond.wait()
                     if not self.running:
                         return
-                self._active_job = heapq.heappop(self._job_queue).job
+                self._active_job = self._pop()
             finally:
                 self._job_queue_cond.release()
 
@@ -276,7 +353,14 @@ class JobScheduler(object):
 
         self._job_queue_cond.acquire()
         try:
-            heapq.heappush(self._job_queue, job._entry)
+            if job.key is not None:
+                previous = self._pending_by_key.get((job.factory, job.key))
+                if previous is not None and previous.job is not job:
+                    logger.debug("[Scheduler %s] Job %s replaces job %s",
+                                 self.name, job, previous.job)
+                    self._cancel_entry(previous)
+                    self._compact()
+            self._push(job)
 
             # if a job with a lower priority is running, we try to stop
             # it and take its place
@@ -290,49 +374,44 @@ class JobScheduler(object):
                 else:
                     self._stop_active_job(will_resume=True)
                     # the active job may have already been re-queued
-                    # previously. In which case we don't want to requeue
-                    # it again
-                    if active not in self._job_queue:
-                        heapq.heappush(self._job_queue, job._entry)
+                    # previously (in which case _push() does nothing), or
+                    # superseded by a pending job with the same key
+                    if (active.key is None or (active.factory, active.key)
+                            not in self._pending_by_key):
+                        self._push(active)
 
             self._job_queue_cond.notify_all()
         finally:
             self._job_queue_cond.release()
 
-    def _cancel_matching_jobs(self, condition):
+    def cancel(self, target_job):
+        logger.debug("[Scheduler %s] Canceling job %s",
+                     self.name, target_job)
         self._job_queue_cond.acquire()
         try:
-            try:
-                to_rm = []
-                for j in self._job_queue:
-                    if condition(j.job):
-                        to_rm.append(j)
-                for j in to_rm:
-                    self._job_queue.remove(j)
-                    if j.job.already_started_once:
-                        j.job.stop(will_resume=False)
-                    logger.debug("[Scheduler %s] Job %s cancelled",
-                                 self.name, j.job)
-            except ValueError:
-                pass
-
-            heapq.heapify(self._job_queue)
-            if (self._active_job is not None and condition(self._active_job)):
+            entry = self._pending.get(target_job)
+            if entry is not None:
+                self._cancel_entry(entry)
+                self._compact()
+            if self._active_job is not None and self._active_job == target_job:
                 self._stop_active_job(will_resume=False)
         finally:
             self._job_queue_cond.release()
 
-    def cancel(self, target_job):
-        logger.debug("[Scheduler %s] Canceling job %s",
-                     self.name, target_job)
-        self._cancel_matching_jobs(
-            lambda job: (job == target_job))
-
     def cancel_all(self, factory):
         logger.debug("[Scheduler %s] Canceling all jobs %s",
                      self.name, factory.name)
-        self._cancel_matching_jobs(
-            lambda job: (job.factory == factory))
+        self._job_queue_cond.acquire()
+        try:
+            entries = self._pending_by_factory.get(factory, ())
+            for entry in list(entries):
+                self._cancel_entry(entry)
+            self._compact()
+            if (self._active_job is not None
+                    and self._active_job.factory == factory):
+                self._stop_active_job(will_resume=False)
+        finally:
+            self._job_queue_cond.release()
 
     def stop(self):
         assert(self.running)
@@ -32,7 +32,13 @@ import locale
 import logging
 import signal
 
+from backend.ocr import start_ocr_worker_pool
+from backend.ocr import stop_ocr_worker_pool
+from backend.pdf.cache import get_document_pool
+from backend.pdf.renderer import start_renderer_pool
+from backend.pdf.renderer import stop_renderer_pool
 from frontend.mainwindow import ActionRefreshIndex, MainWindow
+from frontend.util.canvas.surfacecache import get_surface_cache
 from frontend.util.config import load_config
 
 
@@ -109,6 +115,16 @@ def main():
         config = load_config()
         config.read()
 
+        get_document_pool().max_docs = config['pdf_max_open_docs'].value
+        get_surface_cache().max_bytes = (config['page_cache_size'].value
+                                         * 1024 * 1024)
+
+        # the renderers and the OCR workers are forked: must be done before
+        # any thread is started
+        if config['pdf_nb_renderers'].value > 0:
+            start_renderer_pool(config['pdf_nb_renderers'].value)
+        start_ocr_worker_pool(max(1, config['ocr_nb_workers'].value))
+
         main_win = MainWindow(config)
         ActionRefreshIndex(main_win, config).do()
         Gtk.main()
@@ -118,6 +134,8 @@ def main():
 
         config.write()
     finally:
+        stop_ocr_worker_pool()
+        stop_renderer_pool()
         logger.info("Good bye")
 
 